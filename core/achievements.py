@@ -1,35 +1,143 @@
+import asyncio
 import logging
-from typing import Optional, List
-from core.models import Achievement, Task
-from core.ai_core import generate_achievement_title
+from datetime import datetime
+from typing import Optional, List, Tuple
+from core.cache import TTLCache
+from core.models import Achievement, AchievementTitle
+from core.ai_core import generate_achievement_titles, get_default_achievement
+from core.task_manager import get_total_completed_tasks
+from core.config import (
+    ACHIEVEMENT_POOL_OFFPEAK_HOURS,
+    ACHIEVEMENT_POOL_REFILL_INTERVAL,
+    ACHIEVEMENT_POOL_SIZE,
+)
 
 logger = logging.getLogger(__name__)
 
 MILESTONES = [10, 50, 100, 250, 500, 1000, 2500, 5000]
 
+# Ближайшая неразблокированная веха чата (None - открыты все), прогревается лениво
+_next_milestone = TTLCache(max_size=10000, ttl=6 * 3600, name="next_milestone")
 
-async def check_and_unlock_achievements(chat_id: str) -> Optional[Achievement]:
-    completed_count = await Task.filter(chat_id=chat_id, status="done").count()
-    unlocked = await Achievement.filter(chat_id=chat_id).all()
-    unlocked_milestones = {a.milestone for a in unlocked}
+
+def invalidate_milestone_cache(chat_id: str):
+    """Сбросить закэшированную веху чата (после очистки задач или достижений)."""
+    _next_milestone.pop(str(chat_id), None)
+
+
+def _first_locked_milestone(unlocked_milestones) -> Optional[int]:
+    for milestone in MILESTONES:
+        if milestone not in unlocked_milestones:
+            return milestone
+    return None
+
+
+async def take_pooled_title(milestone: int) -> Optional[Tuple[str, str]]:
+    """Забрать заготовленное название из пула. None, если пул вехи пуст."""
+    for _ in range(3):
+        entry = await AchievementTitle.filter(milestone=milestone).order_by("id").first()
+        if entry is None:
+            return None
+        # Параллельная выдача могла забрать ту же запись - тогда берём следующую
+        if await AchievementTitle.filter(id=entry.id).delete():
+            return entry.title, entry.emoji
+    return None
+
+
+async def check_and_unlock_achievements(chat_id: str, completed_count: Optional[int] = None) -> Optional[Achievement]:
+    """
+    Разблокировать достижения, вехи которых достигнуты счётчиком выполненных задач.
+
+    Args:
+        completed_count: текущее значение UserSettings.total_completed_tasks, если уже известно
+
+    Большинство выполнений не пересекает веху: тогда проверка сводится к сравнению
+    с закэшированной ближайшей вехой, без запросов к БД.
+    """
+    chat_id = str(chat_id)
+    if completed_count is None:
+        completed_count = await get_total_completed_tasks(chat_id)
+    
+    if chat_id in _next_milestone:
+        next_milestone = _next_milestone.get(chat_id)
+        if next_milestone is None or completed_count < next_milestone:
+            return None
+    
+    unlocked_milestones = set(await Achievement.filter(chat_id=chat_id).values_list("milestone", flat=True))
     
     new_achievement = None
     for milestone in MILESTONES:
         if completed_count >= milestone and milestone not in unlocked_milestones:
-            title, emoji = await generate_achievement_title(milestone)
+            # Название берётся из пула, AI в ответе на "выполнено" не участвует
+            title, emoji = await take_pooled_title(milestone) or get_default_achievement(milestone)
             new_achievement = await Achievement.create(
                 chat_id=chat_id,
                 milestone=milestone,
                 title=title,
                 emoji=emoji
             )
+            unlocked_milestones.add(milestone)
             logger.info(f"Achievement unlocked for chat {chat_id}: {milestone} tasks - {title}")
     
+    _next_milestone.set(chat_id, _first_locked_milestone(unlocked_milestones))
     return new_achievement
 
 
+def _is_off_peak(now: Optional[datetime] = None) -> bool:
+    """Попадает ли текущий час в ACHIEVEMENT_POOL_OFFPEAK_HOURS (например "1-6" или "23-5")."""
+    try:
+        start, end = (int(h) for h in ACHIEVEMENT_POOL_OFFPEAK_HOURS.split("-", 1))
+    except ValueError:
+        return True
+    hour = (now or datetime.now()).hour
+    if start <= end:
+        return start <= hour <= end
+    return hour >= start or hour <= end
+
+
+async def refill_title_pool(only_empty: bool = False) -> int:
+    """
+    Пополнить пул названий до ACHIEVEMENT_POOL_SIZE на каждую веху.
+
+    Args:
+        only_empty: пополнять только вехи с пустым пулом
+
+    Returns:
+        Сколько новых названий добавлено
+    """
+    added = 0
+    for milestone in MILESTONES:
+        existing = await AchievementTitle.filter(milestone=milestone).values_list("title", flat=True)
+        missing = ACHIEVEMENT_POOL_SIZE - len(existing)
+        if missing <= 0 or (only_empty and existing):
+            continue
+
+        seen = {t.lower() for t in existing}
+        batch = []
+        for title, emoji in await generate_achievement_titles(milestone, missing):
+            if title.lower() not in seen:
+                seen.add(title.lower())
+                batch.append(AchievementTitle(milestone=milestone, title=title, emoji=emoji))
+        if batch:
+            await AchievementTitle.bulk_create(batch[:missing], ignore_conflicts=True)
+            added += len(batch[:missing])
+    return added
+
+
+async def run_title_pool_refiller(interval: float = ACHIEVEMENT_POOL_REFILL_INTERVAL):
+    """Фоновое пополнение пула: полностью - в часы низкой нагрузки, пустые вехи - всегда."""
+    while True:
+        try:
+            added = await refill_title_pool(only_empty=not _is_off_peak())
+            if added:
+                logger.info(f"Achievement title pool refilled: +{added}")
+        except Exception:
+            logger.exception("Achievement title pool refill failed")
+        await asyncio.sleep(interval)
+
+
 async def get_all_achievements(chat_id: str) -> List[dict]:
-    completed_count = await Task.filter(chat_id=chat_id, status="done").count()
+    completed_count = await get_total_completed_tasks(chat_id)
     unlocked = await Achievement.filter(chat_id=chat_id).order_by("milestone").all()
     unlocked_dict = {a.milestone: a for a in unlocked}
     
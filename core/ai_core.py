@@ -1,12 +1,25 @@
+import hashlib
+import json
 import logging
-from typing import List, Dict
+import re
+import time
+from typing import Awaitable, Callable, List, Dict, Optional, Set, Tuple, TypeVar, Union
 import asyncio
 
-from core.config import AI_TOKEN
+from core import metrics
+from core.ai_gateway import AIUnavailable, ModelUnavailable, Priority, gateway
+from core.cache import TTLCache
+from core.chat_history import chat_history, estimate_tokens
+from core.config import (AI_API_BASE, AI_BULK_DECOMPOSE_TOKENS, AI_CACHE_SIZE, AI_PRIMARY_TIMEOUT_SHARE, AI_ROUTES,
+                         AI_STREAM_EDIT_INTERVAL, AI_TOKEN)
 
 logger = logging.getLogger(__name__)
 
-CHAT_HISTORIES: Dict[int, List[Dict]] = {}
+DEFAULT_MODEL = "gemini/gemini-2.0-flash"
+# Быстрая и дешёвая модель для коротких служебных ответов
+FAST_MODEL = "gemini/gemini-2.0-flash-lite"
+
+T = TypeVar("T")
 
 SYSTEM_PROMPT = {
     "role": "system",
@@ -16,51 +29,374 @@ SYSTEM_PROMPT = {
     ),
 }
 
+# Политики кэша по местам вызова: TTL ответа в секундах, 0 - только объединение
+# одновременных одинаковых запросов. Места без политики (и диалог в get_response) не кэшируются.
+CACHE_POLICIES: Dict[str, float] = {
+    "book_keywords": 24 * 3600,
+    "report_insights": 3600,
+    # Повторная просьба разбить ту же задачу должна давать новый вариант - без TTL
+    "decompose": 0,
+    "motivation": 0,
+    "achievement_title": 0,
+}
+
+# Маршруты по местам вызова: основная модель, запасные по порядку, таймаут и max_tokens.
+# Таймаут - общий срок на всю цепочку: модель, после которой есть запасные, получает
+# AI_PRIMARY_TIMEOUT_SHARE оставшегося времени, последняя - всё, что осталось. Модели
+# с разомкнутым предохранителем пропускаются сразу и времени не тратят.
+# Переопределяются из AI_ROUTES (JSON вида {"motivation": {"model": "...", "fallbacks": []}}).
+DEFAULT_ROUTES: Dict[str, Dict] = {
+    "default": {"model": DEFAULT_MODEL, "fallbacks": [], "timeout": 30.0, "max_tokens": 300},
+    "chat": {"model": DEFAULT_MODEL, "fallbacks": [FAST_MODEL], "timeout": 30.0, "max_tokens": 300},
+    "decompose": {"model": DEFAULT_MODEL, "fallbacks": [FAST_MODEL], "timeout": 30.0, "max_tokens": 400},
+    "achievement_title": {"model": FAST_MODEL, "fallbacks": [DEFAULT_MODEL], "timeout": 10.0, "max_tokens": 50},
+    "motivation": {"model": FAST_MODEL, "fallbacks": [DEFAULT_MODEL], "timeout": 15.0, "max_tokens": 200},
+    "book_keywords": {"model": FAST_MODEL, "fallbacks": [DEFAULT_MODEL], "timeout": 15.0, "max_tokens": 200},
+    "report_insights": {"model": DEFAULT_MODEL, "fallbacks": [FAST_MODEL], "timeout": 30.0, "max_tokens": 300},
+}
+
+
+def _load_routes(overrides_json: str) -> Dict[str, Dict]:
+    routes = {site: dict(route) for site, route in DEFAULT_ROUTES.items()}
+    if not overrides_json:
+        return routes
+    try:
+        overrides = json.loads(overrides_json)
+        for site, override in overrides.items():
+            routes[site] = {**routes.get(site, routes["default"]), **override}
+    except (ValueError, AttributeError, TypeError) as e:
+        logger.error(f"Invalid AI_ROUTES, using default routes: {e}")
+        return {site: dict(route) for site, route in DEFAULT_ROUTES.items()}
+    return routes
+
+
+ROUTES = _load_routes(AI_ROUTES)
+
+
+def get_route(site: Optional[str]) -> Dict:
+    """Маршрут места вызова (для неизвестных мест - маршрут по умолчанию)."""
+    return ROUTES.get(site or "default") or ROUTES["default"]
+
+
+def _route_models(route: Dict) -> List[str]:
+    """Основная и запасные модели маршрута без повторов."""
+    return list(dict.fromkeys([route["model"], *route.get("fallbacks", [])]))
+
+
+def _attempt_timeout(deadline: float, is_last: bool) -> float:
+    """Таймаут очередной модели цепочки из общего срока маршрута (deadline по time.monotonic)."""
+    remaining = max(0.0, deadline - time.monotonic())
+    return remaining if is_last else remaining * AI_PRIMARY_TIMEOUT_SHARE
+
+
+_response_cache = TTLCache(AI_CACHE_SIZE, 3600, name="ai_responses")
+_inflight: Dict[str, asyncio.Future] = {}
+
 try:
     from litellm import acompletion
-    from litellm.exceptions import RateLimitError
     _HAS_LITELLM = True
 except Exception:
     acompletion = None
-    RateLimitError = Exception
     _HAS_LITELLM = False
 
 
+async def _call_model(messages: List[Dict], *, model: str, max_tokens: int, temperature: float,
+                      timeout: float, priority: Priority, site: str = "default") -> str:
+    """Один вызов модели через общий шлюз (лимиты, приоритеты, предохранитель, хеджирование)."""
+    estimated = sum(estimate_tokens(m.get("content") or "") for m in messages) + max_tokens
+    resp = await gateway.call(
+        lambda: acompletion(
+            model=model,
+            messages=messages,
+            api_key=AI_TOKEN,
+            api_base=AI_API_BASE or None,
+            max_tokens=max_tokens,
+            temperature=temperature,
+            timeout=timeout,
+            # Повторы делает шлюз: каждая 429 и таймаут должны дойти до AIGateway._record_failure
+            num_retries=0,
+            max_retries=0,
+        ),
+        priority=priority,
+        estimated_tokens=estimated,
+        timeout=timeout,
+        site=site,
+        model=model,
+        hedge=True,
+    )
+    return (resp.choices[0].message.content or "").strip()
+
+
 async def get_response(chat_id: int, text: str) -> str:
     key = int(chat_id)
-    if key not in CHAT_HISTORIES:
-        CHAT_HISTORIES[key] = [SYSTEM_PROMPT]
-
-    CHAT_HISTORIES[key].append({"role": "user", "content": text})
-    messages = [SYSTEM_PROMPT] + CHAT_HISTORIES[key][-10:]
+    await chat_history.append(key, "user", text)
+    messages = [SYSTEM_PROMPT] + await chat_history.get_messages(key)
 
     if not _HAS_LITELLM or not AI_TOKEN:
         logger.info("AI unavailable")
         return "Извини, сейчас нет доступа к AI. Установи litellm и настрой AI_TOKEN."
 
-    for attempt in range(3):
+    route = get_route("chat")
+    answer = await _complete_uncached(
+        messages, _route_models(route), route["max_tokens"], 0.8, route["timeout"], Priority.INTERACTIVE, "chat"
+    )
+    if answer:
+        await chat_history.append(key, "assistant", answer)
+        return answer
+    return "Извини, не могу ответить."
+
+
+async def complete(
+    prompt: Union[str, List[Dict]],
+    *,
+    system: Optional[str] = None,
+    model: Optional[str] = None,
+    max_tokens: Optional[int] = None,
+    temperature: float = 0.7,
+    timeout: Optional[float] = None,
+    priority: Priority = Priority.INTERACTIVE,
+    site: Optional[str] = None,
+) -> Optional[str]:
+    """
+    Одноразовый запрос к модели без истории чата - для служебных промптов.
+
+    Args:
+        prompt: Текст запроса пользователя или готовый список сообщений
+        system: Системный промпт (только для строкового prompt)
+        model, max_tokens, timeout: Переопределяют значения маршрута места вызова
+        priority: Класс запроса в AI-шлюзе (фоновые уступают интерактивным)
+        site: Место вызова - по нему выбираются маршрут из ROUTES и политика кэша из CACHE_POLICIES
+
+    Returns:
+        Текст ответа или None, если AI недоступен или запрос не удался -
+        вызывающий код сам выбирает запасной вариант.
+    """
+    if not _HAS_LITELLM or not AI_TOKEN:
+        return None
+
+    if isinstance(prompt, str):
+        messages = [{"role": "user", "content": prompt}]
+        if system:
+            messages.insert(0, {"role": "system", "content": system})
+    else:
+        messages = list(prompt)
+
+    route = get_route(site)
+    models = [model] if model else _route_models(route)
+    max_tokens = max_tokens or route["max_tokens"]
+    timeout = timeout or route["timeout"]
+
+    ttl = CACHE_POLICIES.get(site) if site else None
+    if ttl is None:
+        return await _complete_uncached(messages, models, max_tokens, temperature, timeout, priority, site)
+
+    key = _cache_key(models[0], messages, max_tokens, temperature)
+    if ttl > 0:
+        cached = _response_cache.get(key)
+        if cached is not None:
+            metrics.inc(f"ai.cache.hit.{site}")
+            return cached
+
+    while True:
+        pending = _inflight.get(key)
+        if pending is None:
+            break
+        # Такой же запрос уже выполняется - ждём его результат
+        metrics.inc(f"ai.cache.coalesced.{site}")
+        try:
+            return await asyncio.shield(pending)
+        except asyncio.CancelledError:
+            if not pending.cancelled():
+                raise
+            # Отменили ведущий запрос, а не нас - выполняем запрос сами (или ждём нового ведущего)
+
+    metrics.inc(f"ai.cache.miss.{site}")
+    future = asyncio.get_running_loop().create_future()
+    _inflight[key] = future
+    try:
+        answer = await _complete_uncached(messages, models, max_tokens, temperature, timeout, priority, site)
+    except Exception as e:
+        future.set_exception(e)
+        # Ждущих может не быть - помечаем исключение полученным, чтобы asyncio не ругался
+        future.exception()
+        raise
+    else:
+        if answer is not None and ttl > 0:
+            _response_cache.set(key, answer, ttl=ttl)
+        future.set_result(answer)
+        return answer
+    finally:
+        if _inflight.get(key) is future:
+            del _inflight[key]
+        if not future.done():
+            # Ведущий отменён: ждущие повторят запрос сами, а не получат None
+            future.cancel()
+
+
+async def stream_complete(
+    prompt: Union[str, List[Dict]],
+    on_partial: Callable[[str], Awaitable[None]],
+    *,
+    system: Optional[str] = None,
+    model: Optional[str] = None,
+    max_tokens: Optional[int] = None,
+    temperature: float = 0.7,
+    timeout: Optional[float] = None,
+    priority: Priority = Priority.INTERACTIVE,
+    site: Optional[str] = None,
+    interval: float = AI_STREAM_EDIT_INTERVAL,
+) -> Optional[str]:
+    """
+    Как complete, но ответ приходит потоком: накопленный текст передаётся в on_partial
+    не чаще раза в interval секунд. Колбэк не тормозит чтение потока - его вызовы
+    идут фоном и дожидаются перед возвратом результата. Запасная модель маршрута
+    пробуется, только если предыдущая не успела ничего выдать.
+
+    Returns:
+        Полный текст ответа или None (как complete).
+    """
+    if not _HAS_LITELLM or not AI_TOKEN:
+        return None
+
+    if isinstance(prompt, str):
+        messages = [{"role": "user", "content": prompt}]
+        if system:
+            messages.insert(0, {"role": "system", "content": system})
+    else:
+        messages = list(prompt)
+
+    route = get_route(site)
+    models = [model] if model else _route_models(route)
+    max_tokens = max_tokens or route["max_tokens"]
+    timeout = timeout or route["timeout"]
+
+    ttl = CACHE_POLICIES.get(site) if site else None
+    key = _cache_key(models[0], messages, max_tokens, temperature) if ttl else None
+    if key:
+        cached = _response_cache.get(key)
+        if cached is not None:
+            metrics.inc(f"ai.cache.hit.{site}")
+            return cached
+
+    updates: List[asyncio.Task] = []
+
+    def publish(text: str) -> None:
+        updates.append(asyncio.create_task(on_partial(text)))
+
+    async def consume(model: str, timeout: float) -> str:
+        stream = await acompletion(
+            model=model,
+            messages=messages,
+            api_key=AI_TOKEN,
+            api_base=AI_API_BASE or None,
+            max_tokens=max_tokens,
+            temperature=temperature,
+            timeout=timeout,
+            num_retries=0,
+            max_retries=0,
+            stream=True,
+        )
+        parts: List[str] = []
+        started = time.perf_counter()
+        last_published = 0.0
+        async for chunk in stream:
+            delta = chunk.choices[0].delta.content if chunk.choices else None
+            if not delta:
+                continue
+            if not parts:
+                metrics.observe("ai.stream.first_token", time.perf_counter() - started)
+            parts.append(delta)
+            now = time.monotonic()
+            if now - last_published >= interval:
+                last_published = now
+                publish("".join(parts))
+        return "".join(parts).strip()
+
+    estimated = sum(estimate_tokens(m.get("content") or "") for m in messages) + max_tokens
+    answer = None
+    deadline = time.monotonic() + timeout
+    try:
+        for attempt, current in enumerate(models):
+            attempt_timeout = _attempt_timeout(deadline, attempt == len(models) - 1)
+            if attempt_timeout <= 0:
+                break
+            try:
+                answer = await gateway.call(
+                    lambda: consume(current, attempt_timeout), priority=priority, estimated_tokens=estimated,
+                    timeout=attempt_timeout, site=site or "default", model=current,
+                )
+                if attempt:
+                    metrics.inc(f"ai.fallback.{site or 'default'}")
+                break
+            except ModelUnavailable as e:
+                # Предохранитель этой модели разомкнут - сразу к следующей
+                logger.warning(f"AI unavailable: {e}")
+            except AIUnavailable as e:
+                logger.warning(f"AI unavailable: {e}")
+                break
+            except asyncio.TimeoutError:
+                logger.warning(f"AI stream from {current} timed out after {attempt_timeout:.1f}s")
+            except Exception:
+                logger.exception(f"AI stream from {current} failed")
+            if updates:
+                # Часть ответа уже показана - другой моделью не продолжаем
+                break
+    finally:
+        if updates:
+            await asyncio.gather(*updates, return_exceptions=True)
+
+    if answer and key:
+        _response_cache.set(key, answer, ttl=ttl)
+    return answer or None
+
+
+def _cache_key(model: str, messages: List[Dict], max_tokens: int, temperature: float) -> str:
+    """Ключ кэша по нормализованным сообщениям и параметрам запроса."""
+    normalized = [
+        {"role": m.get("role"), "content": re.sub(r"\s+", " ", m.get("content") or "").strip()}
+        for m in messages
+    ]
+    raw = json.dumps([model, normalized, max_tokens, temperature], ensure_ascii=False, sort_keys=True)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+async def _complete_uncached(messages: List[Dict], models: List[str], max_tokens: int, temperature: float,
+                             timeout: float, priority: Priority, site: Optional[str] = None) -> Optional[str]:
+    """Пройти цепочку моделей маршрута до первого непустого ответа за общий срок timeout."""
+    deadline = time.monotonic() + timeout
+    for attempt, model in enumerate(models):
+        attempt_timeout = _attempt_timeout(deadline, attempt == len(models) - 1)
+        if attempt_timeout <= 0:
+            break
         try:
-            resp = await acompletion(
-                model="gemini/gemini-2.0-flash",
-                messages=messages,
-                api_key=AI_TOKEN,
-                max_tokens=300,
-                temperature=0.8,
+            answer = await _call_model(
+                messages, model=model, max_tokens=max_tokens, temperature=temperature,
+                timeout=attempt_timeout, priority=priority, site=site or "default",
             )
-            answer = resp.choices[0].message.content.strip()
-            CHAT_HISTORIES[key].append({"role": "assistant", "content": answer})
-            return answer
-        except RateLimitError:
-            wait = 2 ** attempt
-            logger.warning(f"Rate limit - waiting {wait}s")
-            await asyncio.sleep(wait)
+            if answer:
+                if attempt:
+                    metrics.inc(f"ai.fallback.{site or 'default'}")
+                return answer
+        except ModelUnavailable as e:
+            # Предохранитель этой модели разомкнут - сразу к следующей
+            logger.warning(f"AI unavailable: {e}")
+        except AIUnavailable as e:
+            # Очередь или лимиты шлюза не укладываются в срок - запасные модели не помогут
+            logger.warning(f"AI unavailable: {e}")
+            return None
+        except asyncio.TimeoutError:
+            logger.warning(f"AI request to {model} timed out after {attempt_timeout:.1f}s")
         except Exception:
-            logger.exception("AI request failed")
-            break
-    return "Извини, не могу ответить."
+            logger.exception(f"AI request to {model} failed")
+    return None
 
 
-async def decompose_with_ai(chat_id: int, task: str, max_subtasks: int = 5) -> List[str]:
+async def decompose_with_ai(chat_id: int, task: str, max_subtasks: int = 5,
+                            on_partial: Optional[Callable[[str], Awaitable[None]]] = None) -> List[str]:
+    """
+    Разбить задачу на подзадачи. С on_partial ответ модели стримится и
+    частичный текст передаётся в колбэк по мере генерации.
+    """
     prompt = (
         f"""Ты — опытный менеджер проектов, эксперт по декомпозиции (разбиению) задач. 
     Твоя цель — разбить сложную ЗАДАЧУ на серию максимально простых, понятных и логичных шагов для исполнителя.
@@ -81,64 +417,270 @@ async def decompose_with_ai(chat_id: int, task: str, max_subtasks: int = 5) -> L
     """
     )
     try:
-        response = await get_response(chat_id, prompt)
-        if not response or "нет доступа" in response.lower():
+        if on_partial is not None:
+            response = await stream_complete(prompt, on_partial, temperature=0.7, site="decompose")
+        else:
+            response = await complete(prompt, temperature=0.7, site="decompose")
+        if not response:
             return []
-        lines = [line.strip() for line in response.split('\n') if line.strip()]
-        import re
-        cleaned = []
-        for line in lines:
-            cleaned_line = re.sub(r'^[\d\-•\*\.)\]]+\s*', '', line).strip()
-            if cleaned_line:
-                cleaned.append(cleaned_line)
-        return cleaned[:max_subtasks]
+        return _clean_subtask_lines(response.split('\n'))[:max_subtasks]
     except Exception:
         logger.exception("decompose_with_ai error")
         return []
 
 
-async def generate_achievement_title(milestone: int) -> tuple[str, str]:
-    if not _HAS_LITELLM or not AI_TOKEN:
-        return get_default_achievement(milestone)
+def _clean_subtask_lines(lines: List[str]) -> List[str]:
+    """Убрать нумерацию и маркеры списка, пустые строки отбросить."""
+    cleaned = []
+    for line in lines:
+        cleaned_line = re.sub(r'^[\d\-•\*\.)\]]+\s*', '', line.strip()).strip()
+        if cleaned_line:
+            cleaned.append(cleaned_line)
+    return cleaned
+
+
+# Оценка ответа на одну задачу в пакетном разбиении: строки подзадач плюс заголовок
+_BULK_TOKENS_PER_SUBTASK = 30
+
+_BULK_DECOMPOSE_HEADER = """Ты — опытный менеджер проектов, эксперт по декомпозиции задач.
+Разбей КАЖДУЮ задачу из списка ниже ровно на {n} последовательных, конкретных шагов
+(каждый начинается с глагола, выполняется за один подход, вместе они приводят к результату).
+
+Формат ответа строго такой, для каждой задачи по порядку:
+[номер задачи]
+шаг
+шаг
+...
+Без нумерации шагов, маркеров и комментариев.
+
+ЗАДАЧИ:
+"""
+
+_BULK_SECTION_RE = re.compile(r'^\s*\[(\d+)\]')
+
+
+def _pack_decompose_batches(tasks: List[str], max_subtasks: int, token_budget: int) -> List[List[int]]:
+    """Разложить задачи по запросам так, чтобы промпт и ожидаемый ответ укладывались в бюджет токенов."""
+    header_cost = estimate_tokens(_BULK_DECOMPOSE_HEADER)
+    batches: List[List[int]] = []
+    current: List[int] = []
+    used = header_cost
+    for i, task in enumerate(tasks):
+        cost = estimate_tokens(task) + (max_subtasks + 1) * _BULK_TOKENS_PER_SUBTASK
+        if current and used + cost > token_budget:
+            batches.append(current)
+            current, used = [], header_cost
+        current.append(i)
+        used += cost
+    if current:
+        batches.append(current)
+    return batches
+
+
+def _parse_bulk_decomposition(response: str, count: int, max_subtasks: int) -> Dict[int, List[str]]:
+    """Разобрать ответ по секциям [номер]; номера 1..count переводятся в индексы пакета."""
+    sections: Dict[int, List[str]] = {}
+    current: Optional[int] = None
+    for line in response.split('\n'):
+        match = _BULK_SECTION_RE.match(line)
+        if match:
+            number = int(match.group(1))
+            current = number - 1 if 1 <= number <= count else None
+            if current is not None:
+                sections.setdefault(current, [])
+            continue
+        if current is not None:
+            sections[current].append(line)
+    parsed: Dict[int, List[str]] = {}
+    for index, lines in sections.items():
+        cleaned = _clean_subtask_lines(lines)
+        if cleaned:
+            parsed[index] = cleaned[:max_subtasks]
+    return parsed
+
+
+async def decompose_many(chat_id: int, tasks: List[str], max_subtasks: int = 5,
+                         token_budget: int = AI_BULK_DECOMPOSE_TOKENS) -> List[List[str]]:
+    """
+    Разбить сразу несколько задач: задачи упаковываются в общие промпты по бюджету токенов,
+    пакеты выполняются параллельно. Задачи, пропущенные моделью в ответе,
+    разбиваются отдельными запросами.
+
+    Returns:
+        Подзадачи для каждой задачи в порядке tasks (пустой список - не удалось)
+    """
+    results: List[List[str]] = [[] for _ in tasks]
+
+    async def run_batch(indices: List[int]) -> None:
+        listing = "\n".join(f"[{pos}] {tasks[i]}" for pos, i in enumerate(indices, 1))
+        prompt = _BULK_DECOMPOSE_HEADER.format(n=max_subtasks) + listing
+        response = await complete(
+            prompt,
+            max_tokens=len(indices) * (max_subtasks + 1) * _BULK_TOKENS_PER_SUBTASK,
+            temperature=0.7,
+            timeout=60.0,
+            site="decompose",
+        )
+        if not response:
+            return
+        for pos, subtasks in _parse_bulk_decomposition(response, len(indices), max_subtasks).items():
+            results[indices[pos]] = subtasks
+
+    batches = _pack_decompose_batches(tasks, max_subtasks, token_budget)
+    metrics.inc("decompose.bulk.batches", len(batches))
+    await asyncio.gather(*(run_batch(batch) for batch in batches))
+
+    missing = [i for i, subtasks in enumerate(results) if not subtasks]
+    if missing:
+        metrics.inc("decompose.bulk.fallback", len(missing))
+        retried = await asyncio.gather(*(decompose_with_ai(chat_id, tasks[i], max_subtasks) for i in missing))
+        for i, subtasks in zip(missing, retried):
+            results[i] = subtasks
+    return results
+
+
+# Разделители шагов в тексте задачи: всегда и только перед глаголом
+_HARD_STEP_SEPARATOR = re.compile(
+    r'\s*(?:;|\n|\.\s+|,?\s+(?:а\s+)?(?:и\s+)?(?:затем|потом|после\s+этого|после\s+чего|а\s+также)\s+)\s*',
+    re.IGNORECASE,
+)
+_SOFT_STEP_SEPARATOR = re.compile(r'\s*(?:,|\s+и\s+)\s*', re.IGNORECASE)
+# Инфинитив или повелительное наклонение: "купить", "отнести", "испечь", "позвоните"
+_VERB_RE = re.compile(r'^[а-яё-]{2,}(?:ть|ти|чь|ться|тись|ите|йте)$', re.IGNORECASE)
+
+# Общие шаги, которыми дополняется план, если в тексте задачи шагов меньше нужного
+_PLAN_PREFIX = ["Уточнить цель и ожидаемый результат", "Подготовить всё необходимое"]
+_PLAN_SUFFIX = ["Проверить результат", "Подвести итоги"]
+
+
+def _split_before_verbs(text: str) -> List[str]:
+    parts, start = [], 0
+    for match in _SOFT_STEP_SEPARATOR.finditer(text):
+        next_word = re.match(r'[а-яё-]+', text[match.end():], re.IGNORECASE)
+        if next_word and _VERB_RE.match(next_word.group(0)):
+            parts.append(text[start:match.start()])
+            start = match.end()
+    parts.append(text[start:])
+    return parts
+
+
+def split_task_locally(task: str, max_subtasks: int = 5) -> List[str]:
+    """
+    Разбить задачу без AI: по перечислениям, союзам и глаголам в тексте,
+    недостающие шаги - общими шагами плана. Запасной вариант, когда AI не успевает.
+    """
+    steps = []
+    for chunk in _HARD_STEP_SEPARATOR.split(task):
+        for part in _split_before_verbs(chunk):
+            part = part.strip(" ,.;:-")
+            if part and part.lower() not in {s.lower() for s in steps}:
+                steps.append(part[0].upper() + part[1:])
+
+    if len(steps) > max_subtasks:
+        rest = steps[max_subtasks - 1:]
+        steps = steps[:max_subtasks - 1] + ["; ".join([rest[0]] + [r[0].lower() + r[1:] for r in rest[1:]])]
+
+    prefix, suffix = list(_PLAN_PREFIX), list(_PLAN_SUFFIX)
+    head: List[str] = []
+    tail: List[str] = []
+    while len(head) + len(steps) + len(tail) < max_subtasks and (prefix or suffix):
+        # Чередуем: сначала проверка в конце, затем подготовка в начале
+        if suffix and len(tail) <= len(head):
+            tail.append(suffix.pop(0))
+        elif prefix:
+            head.append(prefix.pop(0))
+        else:
+            tail.append(suffix.pop(0))
+    return (head + steps + tail)[:max_subtasks]
+
+
+_late_results: Set[asyncio.Task] = set()
+
+
+async def with_deadline(coro: Awaitable[T], deadline: float, *, site: str,
+                        on_late: Optional[Callable[[T], Awaitable[None]]] = None) -> Tuple[Optional[T], bool]:
+    """
+    Дождаться результата AI-вызова не дольше deadline секунд.
+
+    Returns:
+        (результат, срок вышел). Если срок вышел, результат None и вызывающий код
+        отдаёт запасной ответ; опоздавший непустой результат передаётся в on_late
+        (например, чтобы заменить запасной ответ правкой сообщения), без on_late
+        опоздавший вызов отменяется. Пустой результат без истечения срока - быстрый
+        отказ AI (нет токена, разомкнут предохранитель, ошибка провайдера): ждать нечего.
+    """
+    task = asyncio.ensure_future(coro)
+    try:
+        return await asyncio.wait_for(asyncio.shield(task), deadline), False
+    except asyncio.TimeoutError:
+        metrics.inc(f"ai.deadline_missed.{site}")
+        logger.info(f"AI call for {site} missed its {deadline}s deadline, using fallback")
+        if on_late is None:
+            task.cancel()
+        else:
+            late = asyncio.create_task(_deliver_late(task, on_late, site))
+            _late_results.add(late)
+            late.add_done_callback(_late_results.discard)
+        return None, True
+    except BaseException:
+        task.cancel()
+        raise
+
+
+async def _deliver_late(task: asyncio.Future, on_late: Callable[[T], Awaitable[None]], site: str) -> None:
+    try:
+        result = await task
+        if result:
+            metrics.inc(f"ai.late_result.{site}")
+            await on_late(result)
+    except asyncio.CancelledError:
+        raise
+    except Exception:
+        logger.exception(f"Failed to apply late AI result for {site}")
+
+
+def _parse_achievement_title(answer: str) -> tuple[str, str]:
+    """Разбор ответа вида "Название, эмодзи"."""
+    if ',' in answer:
+        parts = answer.rsplit(',', 1)
+        title = parts[0].strip()
+        emoji = parts[1].strip() if len(parts) > 1 else "🏆"
+    else:
+        title = answer
+        emoji = "🏆"
     
+    title = title.replace('"', '').replace("'", '').strip()
+    
+    return title[:100], emoji[:10]
+
+
+async def generate_achievement_titles(milestone: int, count: int) -> List[tuple[str, str]]:
+    """Пачка вариантов названия достижения одним запросом (для пула заготовок)."""
     prompt = (
-        f"Придумай название достижения для пользователя, который выполнил {milestone} задач. "
-        f"Формат ответа: только название (максимум 3-4 слова) и один эмодзи через запятую. "
-        f"Название должно быть креативным, мотивирующим и немного забавным. "
-        f"Пример: Боец невидимого фронта, 💪"
+        f"Придумай {count} разных названий достижения для пользователя, который выполнил {milestone} задач. "
+        f"Каждое название на отдельной строке в формате: название (максимум 3-4 слова) и один эмодзи через запятую. "
+        f"Названия должны быть креативными, мотивирующими и немного забавными, без нумерации. "
+        f"Пример строки: Боец невидимого фронта, 💪"
     )
     
-    try:
-        messages = [
-            SYSTEM_PROMPT,
-            {"role": "user", "content": prompt}
-        ]
-        
-        resp = await acompletion(
-            model="gemini/gemini-2.0-flash",
-            messages=messages,
-            api_key=AI_TOKEN,
-            max_tokens=50,
-            temperature=1.0,
-        )
-        
-        answer = resp.choices[0].message.content.strip()
-        
-        if ',' in answer:
-            parts = answer.rsplit(',', 1)
-            title = parts[0].strip()
-            emoji = parts[1].strip() if len(parts) > 1 else "🏆"
-        else:
-            title = answer
-            emoji = "🏆"
-        
-        title = title.replace('"', '').replace("'", '').strip()
-        
-        return title[:100], emoji[:10]
-        
-    except Exception:
-        logger.exception("generate_achievement_title error")
-        return get_default_achievement(milestone)
+    answer = await complete(
+        [SYSTEM_PROMPT, {"role": "user", "content": prompt}],
+        max_tokens=40 * count,
+        temperature=1.0,
+        priority=Priority.BACKGROUND,
+        site="achievement_title",
+    )
+    if not answer:
+        return []
+    
+    titles = []
+    for line in answer.split('\n'):
+        line = re.sub(r'^[\d\-•\*\.)\]]+\s*', '', line).strip()
+        if line:
+            title, emoji = _parse_achievement_title(line)
+            if title:
+                titles.append((title, emoji))
+    return titles
 
 
 def get_default_achievement(milestone: int) -> tuple[str, str]:
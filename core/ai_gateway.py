@@ -0,0 +1,303 @@
+"""
+Общий шлюз вызовов AI-провайдера.
+
+Все запросы из ai_core проходят через один экземпляр gateway:
+- не больше AI_MAX_IN_FLIGHT одновременных вызовов, интерактивные обслуживаются раньше фоновых;
+- лимиты запросов и токенов в минуту (token bucket);
+- предохранитель на каждую модель: при серии ошибок модели её вызовы сразу отклоняются,
+  и вызывающий код переходит на запасную модель маршрута или запасной ответ
+  вместо ожидания таймаутов;
+- хеджирование: если ответ задерживается дольше p90 своего места вызова,
+  уходит второй такой же запрос и берётся тот, что ответит первым
+  (доля дополнительных запросов ограничена бюджетом).
+"""
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from enum import IntEnum
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from core import metrics
+from core.config import (
+    AI_BACKGROUND_QUEUE_TIMEOUT,
+    AI_BREAKER_FAILURES,
+    AI_BREAKER_RESET,
+    AI_HEDGE_BUDGET,
+    AI_HEDGE_ENABLED,
+    AI_HEDGE_MIN_SAMPLES,
+    AI_HEDGE_PERCENTILE,
+    AI_MAX_IN_FLIGHT,
+    AI_QUEUE_TIMEOUT,
+    AI_RPM,
+    AI_TPM,
+)
+from core.limits import CircuitBreaker, TokenBucket
+
+logger = logging.getLogger(__name__)
+
+try:
+    from litellm.exceptions import BadRequestError, RateLimitError
+except Exception:
+    BadRequestError = RateLimitError = None
+
+
+class Priority(IntEnum):
+    INTERACTIVE = 0  # пользователь ждёт ответа
+    BACKGROUND = 1   # фоновые задачи: пулы, напоминания
+
+
+class AIUnavailable(Exception):
+    """Шлюз отклонил вызов: провайдер нездоров или очередь/лимиты не укладываются в срок."""
+
+
+class ModelUnavailable(AIUnavailable):
+    """Разомкнут предохранитель конкретной модели - запасная модель маршрута ещё может ответить."""
+
+
+class AIGateway:
+    # Запас хеджей: сколько можно отправить подряд, накопив бюджет
+    HEDGE_BURST = 5.0
+
+    def __init__(self, max_in_flight: int = 4, rpm: float = 15, tpm: float = 1_000_000,
+                 queue_timeouts: Dict[Priority, float] = None, breaker_failures: int = 5,
+                 breaker_reset: float = 30.0,
+                 hedge_enabled: bool = False, hedge_budget: float = 0.05,
+                 hedge_percentile: float = 90, hedge_min_samples: int = 20):
+        self.max_in_flight = max_in_flight
+        # Запас на всплеск - четверть минутного лимита
+        self.requests = TokenBucket(rpm / 60, max(1.0, rpm / 4))
+        self.tokens = TokenBucket(tpm / 60, max(1.0, tpm / 4))
+        self.queue_timeouts = queue_timeouts or {Priority.INTERACTIVE: 5, Priority.BACKGROUND: 120}
+        self.breaker_failures = breaker_failures
+        self.breaker_reset = breaker_reset
+        # Предохранители по моделям: отказ основной модели не блокирует запасные
+        self.breakers: Dict[str, CircuitBreaker] = {}
+        self.hedge_enabled = hedge_enabled
+        self.hedge_budget = hedge_budget
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_samples = hedge_min_samples
+        # Каждый вызов добавляет hedge_budget, хедж тратит 1 - так хеджей не больше бюджетной доли
+        self._hedge_tokens = 0.0
+
+        self._in_flight = 0
+        self._waiters: List[list] = []  # куча [priority, seq, future]
+        self._seq = itertools.count()
+
+        metrics.register_source("ai_gateway", self.stats)
+
+    async def call(self, fn: Callable[[], Awaitable[Any]], *, priority: Priority = Priority.INTERACTIVE,
+                   estimated_tokens: int = 0, timeout: float = 30.0, site: str = "default",
+                   model: str = "default", hedge: bool = False) -> Any:
+        """
+        Выполнить вызов провайдера в рамках лимитов шлюза.
+
+        Args:
+            fn: Фабрика вызова - с hedge может быть вызвана дважды
+            site: Место вызова - по нему копится статистика задержек для порога хеджирования
+            model: Модель вызова - у каждой модели свой предохранитель
+            hedge: Разрешить хедж-запрос (только для вызовов без побочных эффектов)
+
+        Raises:
+            ModelUnavailable: предохранитель модели разомкнут - стоит попробовать запасную.
+            AIUnavailable: ожидание превысило бюджет очереди или лимитов.
+            Исключения самого вызова (в том числе asyncio.TimeoutError) пробрасываются.
+        """
+        label = priority.name.lower()
+        breaker = self.breaker_for(model)
+        if breaker.is_open():
+            metrics.inc("ai.rejected.breaker_open")
+            raise ModelUnavailable(f"AI circuit for {model} is open")
+
+        started = time.monotonic()
+        deadline = started + self.queue_timeouts.get(priority, AI_QUEUE_TIMEOUT)
+        await self._acquire_slot(priority, deadline)
+        try:
+            await self._acquire_rate(estimated_tokens, deadline)
+            metrics.observe(f"ai.queue_wait.{label}", time.monotonic() - started)
+
+            if not breaker.allow():
+                metrics.inc("ai.rejected.breaker_open")
+                raise ModelUnavailable(f"AI circuit for {model} is open")
+
+            call_started = time.perf_counter()
+            threshold = self._hedge_threshold(site) if hedge and self.hedge_enabled else None
+            try:
+                if threshold is None:
+                    result = await asyncio.wait_for(fn(), timeout)
+                    metrics.observe(f"ai.call.{site}", time.perf_counter() - call_started)
+                else:
+                    result = await asyncio.wait_for(
+                        self._call_hedged(fn, threshold, estimated_tokens, site), timeout)
+            except asyncio.CancelledError:
+                breaker.release()
+                raise
+            except Exception as e:
+                self._record_failure(model, e)
+                raise
+            breaker.record_success()
+            elapsed = time.perf_counter() - call_started
+            metrics.inc("ai.calls")
+            metrics.observe("ai.call", elapsed)
+            return result
+        finally:
+            self._release_slot()
+
+    def _hedge_threshold(self, site: str) -> Optional[float]:
+        """Порог хеджирования - текущий перцентиль задержек места вызова (None - статистики мало)."""
+        self._hedge_tokens = min(self.HEDGE_BURST, self._hedge_tokens + self.hedge_budget)
+        if metrics.latency_count(f"ai.call.{site}") < self.hedge_min_samples:
+            return None
+        return metrics.latency_percentile(f"ai.call.{site}", self.hedge_percentile)
+
+    async def _call_hedged(self, fn: Callable[[], Awaitable[Any]], threshold: float, estimated_tokens: int,
+                           site: str) -> Any:
+        """
+        Вызов с хеджем: через threshold секунд без ответа отправить второй и взять первый ответ.
+
+        В ai.call.{site} пишется задержка основного запроса, а не победителя: иначе выигравшие
+        хеджи занижают перцентиль, порог падает и хеджей становится всё больше.
+        """
+        started = time.perf_counter()
+        primary_elapsed: List[float] = []
+
+        async def timed_primary():
+            result = await fn()
+            primary_elapsed.append(time.perf_counter() - started)
+            return result
+
+        primary = asyncio.ensure_future(timed_primary())
+        pending = {primary}
+        hedge_slot = False
+        try:
+            done, _ = await asyncio.wait(pending, timeout=threshold)
+            if done:
+                return primary.result()
+            # Хедж тратит бюджет, лимиты провайдера и слот; чего-то нет - просто ждём основной
+            tokens = min(max(1, estimated_tokens), self.tokens.capacity)
+            if (self._hedge_tokens < 1 or self._in_flight >= self.max_in_flight or self._waiters
+                    or self.requests.wait_time(1) > 0 or self.tokens.wait_time(tokens) > 0):
+                metrics.inc("ai.hedge.skipped")
+                return await primary
+            self._in_flight += 1
+            hedge_slot = True
+            self._hedge_tokens -= 1
+            self.requests.try_acquire(1)
+            self.tokens.try_acquire(tokens)
+            metrics.inc("ai.hedge.sent")
+            hedged = asyncio.ensure_future(fn())
+            pending.add(hedged)
+
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is hedged:
+                            metrics.inc("ai.hedge.won")
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            if not primary.done():
+                # Основной не дождались - его задержка не меньше прошедшего времени
+                metrics.observe(f"ai.call.{site}", time.perf_counter() - started)
+            elif primary_elapsed:
+                metrics.observe(f"ai.call.{site}", primary_elapsed[0])
+            for task in pending:
+                task.cancel()
+            if hedge_slot:
+                self._release_slot()
+
+    def breaker_for(self, model: str) -> CircuitBreaker:
+        if model not in self.breakers:
+            self.breakers[model] = CircuitBreaker(self.breaker_failures, self.breaker_reset)
+        return self.breakers[model]
+
+    def _record_failure(self, model: str, error: Exception) -> None:
+        metrics.inc("ai.failures")
+        breaker = self.breaker_for(model)
+        if BadRequestError is not None and isinstance(error, BadRequestError):
+            # Ошибка в самом запросе, а не нездоровье провайдера
+            breaker.release()
+            return
+        if RateLimitError is not None and isinstance(error, RateLimitError):
+            metrics.inc("ai.rate_limited")
+            # Провайдер уже ограничивает - обнуляем запас, чтобы остальные притормозили
+            self.requests.tokens = 0
+        was_open = breaker.state == CircuitBreaker.OPEN
+        breaker.record_failure()
+        if not was_open and breaker.state == CircuitBreaker.OPEN:
+            metrics.inc("ai.breaker_opened")
+            logger.warning(f"AI circuit for {model} opened after {breaker.failures} failures: {error!r}")
+
+    async def _acquire_slot(self, priority: Priority, deadline: float) -> None:
+        if self._in_flight < self.max_in_flight and not self._waiters:
+            self._in_flight += 1
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        entry = [int(priority), next(self._seq), future]
+        heapq.heappush(self._waiters, entry)
+        try:
+            await asyncio.wait_for(asyncio.shield(future), max(0.0, deadline - time.monotonic()))
+        except BaseException as e:
+            if future.done():
+                # Слот успели передать - возвращаем его следующему
+                self._release_slot()
+            else:
+                future.cancel()
+                self._waiters.remove(entry)
+                heapq.heapify(self._waiters)
+            if isinstance(e, asyncio.TimeoutError):
+                metrics.inc("ai.rejected.queue_timeout")
+                raise AIUnavailable("AI queue wait exceeded") from None
+            raise
+
+    def _release_slot(self) -> None:
+        # Слот переходит ожидающему с наивысшим приоритетом, счётчик не меняется
+        if self._waiters:
+            _, _, future = heapq.heappop(self._waiters)
+            future.set_result(None)
+            return
+        self._in_flight -= 1
+
+    async def _acquire_rate(self, estimated_tokens: int, deadline: float) -> None:
+        tokens = min(max(1, estimated_tokens), self.tokens.capacity)
+        while True:
+            wait = max(self.requests.wait_time(1), self.tokens.wait_time(tokens))
+            if wait <= 0:
+                self.requests.try_acquire(1)
+                self.tokens.try_acquire(tokens)
+                return
+            if time.monotonic() + wait > deadline:
+                metrics.inc("ai.rejected.rate_limit")
+                raise AIUnavailable("AI rate limit wait exceeded")
+            await asyncio.sleep(wait)
+
+    def stats(self) -> Dict:
+        return {
+            "in_flight": self._in_flight,
+            "waiting": len(self._waiters),
+            "breakers": {
+                model: {"state": breaker.state, "consecutive_failures": breaker.failures}
+                for model, breaker in self.breakers.items()
+            },
+            "hedge_budget": round(self._hedge_tokens, 2) if self.hedge_enabled else None,
+        }
+
+
+# Глобальный экземпляр шлюза
+gateway = AIGateway(
+    max_in_flight=AI_MAX_IN_FLIGHT,
+    rpm=AI_RPM,
+    tpm=AI_TPM,
+    queue_timeouts={Priority.INTERACTIVE: AI_QUEUE_TIMEOUT, Priority.BACKGROUND: AI_BACKGROUND_QUEUE_TIMEOUT},
+    breaker_failures=AI_BREAKER_FAILURES,
+    breaker_reset=AI_BREAKER_RESET,
+    hedge_enabled=AI_HEDGE_ENABLED,
+    hedge_budget=AI_HEDGE_BUDGET,
+    hedge_percentile=AI_HEDGE_PERCENTILE,
+    hedge_min_samples=AI_HEDGE_MIN_SAMPLES,
+)
@@ -1,12 +1,185 @@
 """
 Модуль для подбора книг с использованием AI и внешних API.
 """
+import asyncio
 import logging
 import json
 import re
-import aiohttp
 import random
-from typing import List, Dict, Optional
+import time
+from collections import deque
+from typing import List, Dict, Optional, Tuple
+
+import aiohttp
+
+from core import metrics
+from core.cache import PersistentCache, TTLCache
+from core.catalog import book_catalog
+from core.config import (
+    BOOK_CACHE_PERSIST,
+    BOOK_CACHE_SIZE,
+    BOOK_CATALOG_MIN_RESULTS,
+    BOOK_PAGE_TTL,
+    BOOK_KEYWORDS_CACHE_TTL,
+    BOOK_RESULTS_CACHE_TTL,
+    BOOK_SEARCH_FAST,
+    BOOK_SEARCH_SUPERSET,
+    BOOK_SOURCE_BREAKER_FAILURES,
+    BOOK_SOURCE_BREAKER_RESET,
+    BOOK_SOURCE_CONNECT_TIMEOUT,
+    BOOK_SOURCE_READ_TIMEOUT,
+    BOOK_SOURCE_WINDOW,
+)
+from core.http import http_client
+from core.limits import CircuitBreaker
+
+
+class BookSourceError(Exception):
+    """Источник книг ответил ошибкой."""
+
+
+_PLACEHOLDERS = {"", "Без названия", "Автор не указан", "Описание отсутствует", "Описание доступно по ссылке",
+                 "Дата не указана", "Не указано", "Нет рейтинга"}
+
+
+def _is_missing(value) -> bool:
+    """Пустое значение или заглушка вроде "Описание отсутствует"."""
+    if isinstance(value, str):
+        return value in _PLACEHOLDERS
+    return value is None or value == []
+
+
+def truncate_description(description: Optional[str], limit: int = 300) -> str:
+    """Описание для карточки: "..." только у обрезанного, без описания - заглушка из _PLACEHOLDERS."""
+    if not description:
+        return "Описание отсутствует"
+    return description[:limit] + "..." if len(description) > limit else description
+
+
+def _normalize_text(text: str) -> str:
+    text = str(text).lower().replace("ё", "е")
+    return " ".join(re.sub(r"[^\w\s]", " ", text).split())
+
+
+def book_key(book: Dict) -> str:
+    """Ключ книги для поиска дублей: нормализованные название и фамилия первого автора."""
+    title = _normalize_text(book.get("title", ""))
+    # Подзаголовок ("Дюна: Мессия" / "Дюна. Мессия") источники пишут по-разному
+    title = re.split(r"\s{2,}|:|\.", title)[0].strip() or title
+    authors = book.get("authors") or []
+    author_words = _normalize_text(authors[0]).split() if authors and not _is_missing(authors[0]) else []
+    author = author_words[-1] if author_words else ""
+    return f"{title}|{author}"
+
+
+def merge_books(sources: List[List[Dict]]) -> List[Dict]:
+    """
+    Объединить выдачи источников, склеивая дубли по ISBN и по названию с автором.
+    У склеенной книги недостающие поля берутся из другого источника, а в sources
+    перечислены все источники, где она нашлась.
+    """
+    merged: List[Dict] = []
+    by_isbn: Dict[str, Dict] = {}
+    by_key: Dict[str, Dict] = {}
+    for books in sources:
+        for book in books:
+            key = book_key(book)
+            isbns = [isbn.replace("-", "") for isbn in book.get("isbn", [])]
+            existing = next((by_isbn[i] for i in isbns if i in by_isbn), None) or by_key.get(key)
+            if existing is None:
+                existing = {**book, "sources": [book.get("source", "")]}
+                merged.append(existing)
+            else:
+                for field, value in book.items():
+                    if field not in ("source", "isbn") and _is_missing(existing.get(field)) \
+                            and not _is_missing(value):
+                        existing[field] = value
+                if book.get("source") not in existing["sources"]:
+                    existing["sources"].append(book.get("source", ""))
+                existing["isbn"] = list(dict.fromkeys(existing.get("isbn", []) + book.get("isbn", [])))
+            by_key.setdefault(key, existing)
+            for isbn in isbns:
+                by_isbn.setdefault(isbn, existing)
+    return merged
+
+
+def rank_books(books: List[Dict], keywords: Dict[str, str]) -> List[Dict]:
+    """Упорядочить книги по совпадению с запросом, полноте карточки и числу источников."""
+    terms = set(_normalize_text(" ".join(
+        keywords.get(field, "") or "" for field in ("keywords", "genre", "topic", "author")
+    )).split())
+
+    def score(book: Dict) -> float:
+        title = set(_normalize_text(book.get("title", "")).split())
+        details = set(_normalize_text(" ".join(book.get("categories", [])) + " " + book.get("description", "")).split())
+        value = 3 * len(terms & title) + len(terms & details)
+        value += 2 * (len(book.get("sources", [])) - 1)
+        if not _is_missing(book.get("description")):
+            value += 1
+        if isinstance(book.get("rating"), (int, float)):
+            value += book["rating"] / 5
+        if keywords.get("language", "ru") == "ru" and book.get("language") == "ru":
+            value += 1
+        return value
+
+    return sorted(books, key=score, reverse=True)
+
+
+def sample_ranked(books: List[Dict], count: int, pool_size: Optional[int] = None) -> List[Dict]:
+    """Случайные count книг из лучших pool_size (по умолчанию 2*count) - для разнообразия выдачи, в порядке ранга."""
+    pool = books[:pool_size or count * 2]
+    if len(pool) <= count:
+        return pool
+    chosen = set(random.sample(range(len(pool)), count))
+    return [book for i, book in enumerate(pool) if i in chosen]
+
+
+class SourceHealth:
+    """
+    Здоровье одного источника книг: доля ошибок и задержки за последние window запросов
+    и предохранитель, который после серии ошибок перестаёт слать запросы до пробного (half-open).
+    """
+
+    def __init__(self, window: int = 50, failure_threshold: int = 3, reset_timeout: float = 60.0):
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+        self.outcomes: deque = deque(maxlen=window)  # (успех, секунды)
+
+    def record(self, ok: bool, seconds: float) -> None:
+        self.outcomes.append((ok, seconds))
+        if ok:
+            self.breaker.record_success()
+        else:
+            self.breaker.record_failure()
+
+    def error_rate(self) -> float:
+        if not self.outcomes:
+            return 0.0
+        return sum(1 for ok, _ in self.outcomes if not ok) / len(self.outcomes)
+
+    def latency(self, q: float = 50) -> Optional[float]:
+        return metrics.percentile([seconds for _, seconds in self.outcomes], q)
+
+    def rank(self) -> Tuple:
+        """Ключ сортировки: сначала замкнутые, затем с меньшей долей ошибок и задержкой."""
+        return self.breaker.is_open(), round(self.error_rate(), 1), self.latency() or 0.0
+
+    def stats(self) -> Dict:
+        p50, p90 = self.latency(50), self.latency(90)
+        return {
+            "state": self.breaker.state,
+            "requests": len(self.outcomes),
+            "error_rate": round(self.error_rate(), 3),
+            "p50": round(p50, 3) if p50 is not None else None,
+            "p90": round(p90, 3) if p90 is not None else None,
+        }
+
+
+def keywords_cache_key(keywords: Dict[str, str]) -> str:
+    """Ключ выдачи: нормализованные поля, которые уходят в запросы к источникам."""
+    return json.dumps({
+        field: _normalize_text(keywords.get(field, "") or "")
+        for field in ("keywords", "genre", "author", "topic", "language")
+    }, sort_keys=True, ensure_ascii=False)
 
 
 class BookSearchService:
@@ -16,6 +189,33 @@ class BookSearchService:
         # Приоритет API: сначала Google Books, если не работает - OpenLibrary
         self.google_books_url = "https://www.googleapis.com/books/v1/volumes"
         self.openlibrary_url = "https://openlibrary.org/search.json"
+        # Источники опрашиваются параллельно; порядок - приоритет при равном ранге
+        self.sources = {
+            "google": self.fetch_google,
+            "openlibrary": self.fetch_openlibrary,
+        }
+        # Здоровье источников: разомкнутые не опрашиваются, порядок - от здоровых к больным
+        self.health: Dict[str, SourceHealth] = {}
+        # Явные таймауты соединения и чтения: зависший источник не держит поиск до общего таймаута
+        self.timeout = aiohttp.ClientTimeout(
+            total=BOOK_SOURCE_CONNECT_TIMEOUT + BOOK_SOURCE_READ_TIMEOUT,
+            sock_connect=BOOK_SOURCE_CONNECT_TIMEOUT,
+            sock_read=BOOK_SOURCE_READ_TIMEOUT,
+        )
+        metrics.register_source("books.sources", self.source_stats)
+        # Остаток выдачи по чатам для кнопки "📚 Ещё":
+        # chat_id -> {"request", "keywords", "queue": непоказанные книги, "shown": ключи показанных}
+        self.pages = TTLCache(BOOK_CACHE_SIZE, BOOK_PAGE_TTL, name="book_pages")
+        # Фоновые дополнения выдачи каталога (ссылки держим, чтобы задачи не собрал GC)
+        self._background = set()
+        # Двухуровневый кэш: запрос -> ключевые слова (без AI-вызова),
+        # ключевые слова -> запас ранжированных книг (без запросов к источникам)
+        self.keywords_cache = PersistentCache(
+            "book_keywords", BOOK_CACHE_SIZE, BOOK_KEYWORDS_CACHE_TTL, persist=BOOK_CACHE_PERSIST
+        )
+        self.results_cache = PersistentCache(
+            "book_results", BOOK_CACHE_SIZE, BOOK_RESULTS_CACHE_TTL, persist=BOOK_CACHE_PERSIST
+        )
         
     async def extract_search_keywords(self, user_request: str) -> Dict[str, str]:
         """
@@ -28,7 +228,7 @@ class BookSearchService:
             Словарь с извлеченными ключевыми словами
         """
         try:
-            from core.ai_core import get_response
+            from core.ai_core import complete
             
             prompt = f"""
 Проанализируй запрос пользователя о книгах и извлеки ключевые параметры для поиска.
@@ -52,7 +252,9 @@ class BookSearchService:
 Отвечай только JSON без дополнительного текста.
 """
             
-            ai_response = await get_response(0, prompt)  # chat_id=0 для служебных запросов
+            ai_response = await complete(prompt, temperature=0.2, site="book_keywords")
+            if not ai_response:
+                return self._extract_keywords_fallback(user_request)
             
             # Парсим JSON ответ от AI
             try:
@@ -141,6 +343,104 @@ class BookSearchService:
         
         return modified_keywords
     
+    def _google_query(self, keywords: Dict[str, str]) -> str:
+        query_parts = []
+        if keywords.get("keywords"):
+            query_parts.append(keywords["keywords"])
+        if keywords.get("author"):
+            query_parts.append(f"inauthor:{keywords['author']}")
+        if keywords.get("genre"):
+            query_parts.append(keywords["genre"])
+            
+        query = " ".join(query_parts)
+        
+        # Добавляем языковые фильтры
+        if keywords.get("language", "ru") == "ru":
+            query += " язык:ru"
+        return query
+
+    async def fetch_google(self, keywords: Dict[str, str], limit: int) -> List[Dict]:
+        """
+        Запрос к Google Books API без перемешивания и обработки ошибок.
+        
+        Raises:
+            BookSourceError: API ответил ошибкой
+        """
+        params = {
+            "q": self._google_query(keywords),
+            "maxResults": min(40, limit),
+            "printType": "books",
+            # Варьируем порядок для получения разных результатов
+            "orderBy": random.choice(["relevance", "newest"])
+        }
+        
+        async with http_client.session.get(self.google_books_url, params=params, timeout=self.timeout) as response:
+            if response.status != 200:
+                raise BookSourceError(f"Google Books API error: {response.status}")
+            data = await response.json()
+        
+        books = []
+        for item in data.get("items", []):
+            volume_info = item.get("volumeInfo", {})
+            isbns = [
+                identifier.get("identifier")
+                for identifier in volume_info.get("industryIdentifiers", [])
+                if identifier.get("type") in ("ISBN_10", "ISBN_13")
+            ]
+            books.append({
+                "title": volume_info.get("title", "Без названия"),
+                "authors": volume_info.get("authors", ["Автор не указан"]),
+                "description": truncate_description(volume_info.get("description")),
+                "published_date": volume_info.get("publishedDate", "Дата не указана"),
+                "page_count": volume_info.get("pageCount", "Не указано"),
+                "categories": volume_info.get("categories", []),
+                "rating": volume_info.get("averageRating", "Нет рейтинга"),
+                "preview_link": volume_info.get("previewLink", ""),
+                "isbn": [isbn for isbn in isbns if isbn],
+                "language": volume_info.get("language", ""),
+                "source": "Google Books"
+            })
+        return books
+
+    async def fetch_openlibrary(self, keywords: Dict[str, str], limit: int) -> List[Dict]:
+        """
+        Запрос к OpenLibrary API без перемешивания и обработки ошибок.
+        
+        Raises:
+            BookSourceError: API ответил ошибкой
+        """
+        query = keywords.get("keywords", "")
+        if keywords.get("author"):
+            query += f" {keywords['author']}"
+            
+        params = {
+            "q": query,
+            # Без языкового фильтра: он блокирует результаты
+            "limit": limit
+        }
+        
+        async with http_client.session.get(self.openlibrary_url, params=params, timeout=self.timeout) as response:
+            if response.status != 200:
+                raise BookSourceError(f"OpenLibrary API error: {response.status}")
+            data = await response.json()
+        
+        books = []
+        for doc in data.get("docs", []):
+            books.append({
+                "title": doc.get("title", "Без названия"),
+                "authors": doc.get("author_name", ["Автор не указан"]),
+                "description": "Описание доступно по ссылке",
+                "published_date": str(doc.get("first_publish_year", "Дата не указана")),
+                "page_count": doc.get("number_of_pages_median") or "Не указано",
+                "categories": doc.get("subject", [])[:3],  # Первые 3 категории
+                "rating": round(doc["ratings_average"], 1) if doc.get("ratings_average") else "Нет рейтинга",
+                "preview_link": f"https://openlibrary.org{doc.get('key', '')}",
+                "isbn": doc.get("isbn", [])[:10],
+                "language": "ru" if "rus" in doc.get("language", []) else "",
+                "source": "OpenLibrary"
+            })
+        return books
+
     async def search_books_google(self, keywords: Dict[str, str], max_results: int = 5) -> List[Dict]:
         """
         Поиск книг через Google Books API.
@@ -153,66 +453,14 @@ class BookSearchService:
             Список найденных книг
         """
         try:
-            # Формируем поисковый запрос
-            query_parts = []
-            if keywords.get("keywords"):
-                query_parts.append(keywords["keywords"])
-            if keywords.get("author"):
-                query_parts.append(f"inauthor:{keywords['author']}")
-            if keywords.get("genre"):
-                query_parts.append(keywords["genre"])
-                
-            query = " ".join(query_parts)
-            
-            # Добавляем языковые фильтры
-            if keywords.get("language", "ru") == "ru":
-                query += " язык:ru"
-            
-            # Варьируем параметры поиска для получения разных результатов
-            order_options = ["relevance", "newest"]
-            selected_order = random.choice(order_options)
-            
-            params = {
-                "q": query,
-                "maxResults": max_results + 2,  # Запрашиваем больше для последующей рандомизации
-                "printType": "books",
-                "orderBy": selected_order
-            }
-            
-            async with aiohttp.ClientSession() as session:
-                async with session.get(self.google_books_url, params=params) as response:
-                    if response.status == 200:
-                        data = await response.json()
-                        books = []
-                        
-                        for item in data.get("items", []):
-                            volume_info = item.get("volumeInfo", {})
-                            book = {
-                                "title": volume_info.get("title", "Без названия"),
-                                "authors": volume_info.get("authors", ["Автор не указан"]),
-                                "description": volume_info.get("description", "Описание отсутствует")[:300] + "...",
-                                "published_date": volume_info.get("publishedDate", "Дата не указана"),
-                                "page_count": volume_info.get("pageCount", "Не указано"),
-                                "categories": volume_info.get("categories", []),
-                                "rating": volume_info.get("averageRating", "Нет рейтинга"),
-                                "preview_link": volume_info.get("previewLink", ""),
-                                "source": "Google Books"
-                            }
-                            books.append(book)
-                            
-                        # Перемешиваем результаты и возвращаем нужное количество
-                        random.shuffle(books)
-                        final_books = books[:max_results]
-                        
-                        logging.info(f"Found {len(final_books)} books via Google Books API (randomized from {len(books)})")
-                        return final_books
-                    else:
-                        logging.error(f"Google Books API error: {response.status}")
-                        return []
-                        
+            # Запрашиваем больше для последующей рандомизации
+            books = await self.fetch_google(keywords, max_results + 2)
         except Exception as e:
             logging.exception(f"Error searching Google Books: {e}")
             return []
+        random.shuffle(books)
+        logging.info(f"Found {len(books[:max_results])} books via Google Books API (randomized from {len(books)})")
+        return books[:max_results]
     
     async def search_books_openlibrary(self, keywords: Dict[str, str], max_results: int = 5) -> List[Dict]:
         """
@@ -226,87 +474,228 @@ class BookSearchService:
             Список найденных книг
         """
         try:
-            # Формируем поисковый запрос
-            query = keywords.get("keywords", "")
-            if keywords.get("author"):
-                query += f" {keywords['author']}"
-                
-            params = {
-                "q": query,
-                # Убираем языковой фильтр, так как он блокирует результаты
-                # "language": "rus" if keywords.get("language", "ru") == "ru" else "eng",
-                "limit": max_results + 3  # Запрашиваем больше для рандомизации
-            }
-            
-            async with aiohttp.ClientSession() as session:
-                async with session.get(self.openlibrary_url, params=params) as response:
-                    if response.status == 200:
-                        data = await response.json()
-                        books = []
-                        
-                        for doc in data.get("docs", []):
-                            book = {
-                                "title": doc.get("title", "Без названия"),
-                                "authors": doc.get("author_name", ["Автор не указан"]),
-                                "description": "Описание доступно по ссылке",
-                                "published_date": str(doc.get("first_publish_year", "Дата не указана")),
-                                "page_count": "Не указано",
-                                "categories": doc.get("subject", [])[:3],  # Первые 3 категории
-                                "rating": "Нет рейтинга",
-                                "preview_link": f"https://openlibrary.org{doc.get('key', '')}",
-                                "source": "OpenLibrary"
-                            }
-                            books.append(book)
-                            
-                        # Перемешиваем результаты и возвращаем нужное количество
-                        random.shuffle(books)
-                        final_books = books[:max_results]
-                        
-                        logging.info(f"Found {len(final_books)} books via OpenLibrary API (randomized from {len(books)})")
-                        return final_books
-                    else:
-                        logging.error(f"OpenLibrary API error: {response.status}")
-                        return []
-                        
+            # Запрашиваем больше для последующей рандомизации
+            books = await self.fetch_openlibrary(keywords, max_results + 3)
         except Exception as e:
             logging.exception(f"Error searching OpenLibrary: {e}")
             return []
-    
-    async def search_books(self, user_request: str, max_results: int = 5) -> List[Dict]:
+        random.shuffle(books)
+        logging.info(f"Found {len(books[:max_results])} books via OpenLibrary API (randomized from {len(books)})")
+        return books[:max_results]
+
+    def source_health(self, name: str) -> SourceHealth:
+        if name not in self.health:
+            self.health[name] = SourceHealth(
+                BOOK_SOURCE_WINDOW, BOOK_SOURCE_BREAKER_FAILURES, BOOK_SOURCE_BREAKER_RESET
+            )
+        return self.health[name]
+
+    def ordered_sources(self) -> List[str]:
+        """Имена источников от самого здорового к самому больному."""
+        return sorted(self.sources, key=lambda name: self.source_health(name).rank())
+
+    def source_stats(self) -> Dict:
+        return {name: self.source_health(name).stats() for name in self.ordered_sources()}
+
+    async def _fetch_guarded(self, name: str, keywords: Dict[str, str], limit: int) -> List[Dict]:
+        """
+        Запрос к источнику через его предохранитель с учётом здоровья.
+
+        Raises:
+            BookSourceError: предохранитель разомкнут или источник ответил ошибкой
+        """
+        health = self.source_health(name)
+        if not health.breaker.allow():
+            metrics.inc(f"books.source.{name}.skipped")
+            raise BookSourceError(f"{name} circuit is open")
+        started = time.perf_counter()
+        try:
+            books = await self.sources[name](keywords, limit)
+        except asyncio.CancelledError:
+            # Отменён быстрым режимом - о здоровье источника это ничего не говорит
+            health.breaker.release()
+            raise
+        except Exception:
+            health.record(False, time.perf_counter() - started)
+            metrics.inc(f"books.source.{name}.failed")
+            raise
+        elapsed = time.perf_counter() - started
+        health.record(True, elapsed)
+        metrics.observe(f"books.source.{name}", elapsed)
+        return books
+
+    async def search_sources(self, keywords: Dict[str, str], limit: int, fast: bool = False,
+                             enough: Optional[int] = None, local: Optional[List[Dict]] = None) -> List[Dict]:
+        """
+        Опросить источники параллельно и объединить результаты без дублей.
+        Источники с разомкнутым предохранителем пропускаются без запроса.
+        
+        Args:
+            keywords: Ключевые слова поиска
+            limit: Сколько результатов запрашивать у каждого источника
+            fast: Вернуться, как только один источник дал enough результатов, остальные отменить
+            enough: Порог для быстрого режима (по умолчанию limit)
+            local: Книги из локального каталога - идут первыми, источники дополняют их поля
+            
+        Returns:
+            Объединённый список книг, лучшие - первыми
+        """
+        enough = enough or limit
+        order = self.ordered_sources()
+        tasks = {
+            asyncio.ensure_future(self._fetch_guarded(name, keywords, limit)): name
+            for name in order
+        }
+        results: Dict[str, List[Dict]] = {}
+        pending = set(tasks)
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    name = tasks[task]
+                    if task.exception() is not None:
+                        logging.warning(f"Book source {name} failed: {task.exception()!r}")
+                        continue
+                    results[name] = task.result()
+                if fast and any(len(books) >= enough for books in results.values()):
+                    metrics.inc("books.fast_return")
+                    break
+        finally:
+            for task in pending:
+                task.cancel()
+        
+        # При равном ранге первыми остаются книги более здорового источника
+        merged = merge_books([local or []] + [results[name] for name in order if name in results])
+        return rank_books(merged, keywords)
+
+    async def get_keywords(self, user_request: str) -> Dict[str, str]:
+        """Ключевые слова запроса из кэша; AI спрашивается только при промахе."""
+        key = _normalize_text(user_request)
+        keywords = await self.keywords_cache.get(key)
+        if keywords is not None:
+            metrics.inc("books.keywords_cache_hit")
+            return keywords
+        keywords = await self.extract_search_keywords(user_request)
+        # Запасной разбор без AI не кэшируем - следующий запрос снова попробует AI
+        if keywords != self._extract_keywords_fallback(user_request):
+            await self.keywords_cache.set(key, keywords)
+        return keywords
+
+    async def get_ranked_books(self, keywords: Dict[str, str]) -> List[Dict]:
+        """
+        Запас ранжированных книг по ключевым словам: из кэша, локального каталога
+        или опросом источников. Запас шире одной выдачи, повторные запросы выбирают из него без сети.
+        """
+        key = keywords_cache_key(keywords)
+        books = await self.results_cache.get(key)
+        if books is not None:
+            metrics.inc("books.results_cache_hit")
+            return books
+
+        local = await book_catalog.search(keywords, BOOK_SEARCH_SUPERSET)
+        if len(local) >= BOOK_CATALOG_MIN_RESULTS:
+            # Каталога хватает: отвечаем сразу, источники дополнят запас в фоне
+            metrics.inc("books.catalog_served")
+            books = rank_books(merge_books([local]), keywords)
+            await self.results_cache.set(key, books)
+            task = asyncio.ensure_future(self._enrich(key, keywords, local))
+            self._background.add(task)
+            task.add_done_callback(self._background.discard)
+            return books
+
+        books = await self.search_sources(
+            keywords, BOOK_SEARCH_SUPERSET, fast=BOOK_SEARCH_FAST, enough=BOOK_SEARCH_SUPERSET // 2, local=local
+        )
+        if books:
+            await self.results_cache.set(key, books)
+        return books
+
+    async def _enrich(self, key: str, keywords: Dict[str, str], local: List[Dict]) -> None:
+        """Дополнить выдачу каталога книгами и полями внешних источников и обновить кэш."""
+        try:
+            books = await self.search_sources(keywords, BOOK_SEARCH_SUPERSET, local=local)
+            if len(books) > len(local) or any(len(book["sources"]) > 1 for book in books):
+                await self.results_cache.set(key, books)
+        except Exception as e:
+            logging.warning(f"Book catalog enrichment failed: {e}")
+
+    async def search_books(self, user_request: str, max_results: int = 5,
+                           chat_id: Optional[str] = None) -> List[Dict]:
         """
         Основной метод поиска книг.
-        Сначала извлекает ключевые слова с помощью AI, затем ищет в API.
+        Ключевые слова и запас найденных книг берутся из кэша, при промахе - через AI
+        и параллельный опрос источников. Разнообразие выдачи - случайным ранжированием
+        и выборкой из запаса.
         
         Args:
             user_request: Запрос пользователя на естественном языке
             max_results: Максимальное количество результатов
+            chat_id: Чат, для которого сохранить остаток выдачи (кнопка "📚 Ещё")
             
         Returns:
             Список найденных книг
         """
         try:
-            # Извлекаем ключевые слова с помощью AI
-            base_keywords = await self.extract_search_keywords(user_request)
+            base_keywords = await self.get_keywords(user_request)
+            books = await self.get_ranked_books(base_keywords)
             
-            # Добавляем вариативность для получения разных результатов
+            # Вариативность: запас переранжируется по случайно расширенным ключевым словам
             keywords = self._add_search_variety(base_keywords)
-            
             logging.info(f"Original keywords: {base_keywords.get('keywords')}")
             logging.info(f"Modified keywords: {keywords.get('keywords')}")
             
-            # Пробуем Google Books API (приоритетный)
-            books = await self.search_books_google(keywords, max_results)
-            
-            # Если Google Books не вернул результатов, пробуем OpenLibrary
-            if not books:
-                logging.info("Google Books returned no results, trying OpenLibrary...")
-                books = await self.search_books_openlibrary(keywords, max_results)
-            
-            return books
+            ranked = rank_books(books, keywords)
+            page = sample_ranked(ranked, max_results, pool_size=max_results * 4)
+            if chat_id is not None:
+                shown = {book_key(book) for book in page}
+                self.pages.set(str(chat_id), {
+                    "request": user_request,
+                    "keywords": base_keywords,
+                    "queue": [book for book in ranked if book_key(book) not in shown],
+                    "shown": list(shown),
+                })
+            return page
             
         except Exception as e:
             logging.exception(f"Error in book search: {e}")
             return []
+
+    def next_page(self, chat_id: str, count: int) -> Tuple[Optional[str], List[Dict]]:
+        """
+        Следующие count книг из остатка выдачи чата - без AI и сети.
+
+        Returns:
+            (запрос пользователя, книги); запрос None - остаток истёк или поиска не было,
+            пустой список книг - остаток исчерпан, нужен fetch_more
+        """
+        key = str(chat_id)
+        entry = self.pages.get(key)
+        if entry is None:
+            return None, []
+        page = entry["queue"][:count]
+        del entry["queue"][:count]
+        entry["shown"].extend(book_key(book) for book in page)
+        # Каждая порция продлевает жизнь остатка
+        self.pages.set(key, entry)
+        if page:
+            metrics.inc("books.page_from_buffer")
+        return entry["request"], page
+
+    async def fetch_more(self, chat_id: str, count: int) -> Tuple[Optional[str], List[Dict]]:
+        """Остаток исчерпан: дозапросить источники с другими ключевыми словами, без уже показанных книг."""
+        entry = self.pages.get(str(chat_id))
+        if entry is None:
+            return None, []
+        keywords = self._add_search_variety(entry["keywords"])
+        try:
+            books = await self.search_sources(keywords, BOOK_SEARCH_SUPERSET)
+        except Exception as e:
+            logging.exception(f"Error fetching more books: {e}")
+            books = []
+        shown = set(entry["shown"])
+        entry["queue"] = [book for book in books if book_key(book) not in shown]
+        metrics.inc("books.page_refetch")
+        return self.next_page(chat_id, count)
     
     def format_book_result(self, book: Dict) -> str:
         """
@@ -376,6 +765,34 @@ class BookSearchService:
         
         return result
 
+    def format_search_reply(self, user_request: str, books: List[Dict]) -> str:
+        """Итоговое сообщение с результатами подбора книг (HTML)."""
+        if not books:
+            return (
+                f"😔 К сожалению, не удалось найти книги по запросу <i>\"{user_request}\"</i>.\n\n"
+                "<b>Попробуйте:</b>\n"
+                "• Изменить формулировку\n"
+                "• Указать жанр или автора\n"
+                "• Использовать более общие термины"
+            )
+        
+        # Формируем единое сообщение со всеми результатами
+        result_lines = [
+            f"<b>📚 Нашел {len(books)} книг по запросу:</b> <i>\"{user_request}\"</i>",
+            ""
+        ]
+        
+        # Добавляем все книги в одно сообщение
+        for i, book in enumerate(books, 1):
+            result_lines.append(f"<b>{i}.</b>")
+            result_lines.append(self.format_book_result(book))
+            if i < len(books):  # Добавляем разделитель между книгами
+                result_lines.append("")
+        
+        result_lines.append("")
+        result_lines.append("✨ Ещё книги по этому запросу - кнопка 📚 <b>Ещё</b>, новый запрос - 📚 <b>Подбор книг</b> в главном меню.")
+        return "\n".join(result_lines)
+
 
 # Глобальный экземпляр сервиса
 book_search_service = BookSearchService()
\ No newline at end of file
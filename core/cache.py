@@ -0,0 +1,160 @@
+"""
+Ограниченный по размеру кэш с вытеснением LRU и сроком жизни записей,
+а также его вариант с необязательным хранением записей в БД.
+"""
+import hashlib
+import logging
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Hashable, Iterator, Optional, Tuple
+
+from core import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class TTLCache:
+    """
+    LRU-кэш с TTL: не больше max_size записей, каждая живёт ttl секунд.
+
+    Если передано name, размер и hit rate кэша попадают в /metrics.
+    """
+
+    def __init__(self, max_size: int, ttl: float, name: Optional[str] = None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        if name:
+            metrics.register_source(f"cache.{name}", self.stats)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        entry = self._data.get(key)
+        if entry is None:
+            self.misses += 1
+            return default
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            del self._data[key]
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        """Сохранить значение. ttl переопределяет срок жизни по умолчанию."""
+        lifetime = self.ttl if ttl is None else ttl
+        self._data[key] = (time.monotonic() + lifetime, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        entry = self._data.pop(key, None)
+        if entry is None or entry[0] <= time.monotonic():
+            return default
+        return entry[1]
+
+    def expire(self) -> int:
+        """Удалить просроченные записи. Возвращает их количество."""
+        now = time.monotonic()
+        expired = [key for key, (expires_at, _) in self._data.items() if expires_at <= now]
+        for key in expired:
+            del self._data[key]
+        return len(expired)
+
+    def items(self) -> Iterator[Tuple[Hashable, Any]]:
+        """Живые записи от давних к свежим (без учёта в статистике)."""
+        now = time.monotonic()
+        for key, (expires_at, value) in list(self._data.items()):
+            if expires_at > now:
+                yield key, value
+
+    def clear(self) -> None:
+        self._data.clear()
+
+    def __contains__(self, key: Hashable) -> bool:
+        entry = self._data.get(key)
+        return entry is not None and entry[0] > time.monotonic()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else None,
+        }
+
+
+class PersistentCache:
+    """
+    TTLCache в памяти поверх необязательного хранилища в БД (таблица cache_entries).
+
+    С persist промах в памяти проверяется в БД, а запись сохраняется в обе стороны -
+    кэш переживает перезапуск. Значения должны сериализоваться в JSON.
+    """
+
+    # Раз в столько записей из БД удаляются просроченные строки
+    PURGE_EVERY = 200
+
+    def __init__(self, namespace: str, max_size: int, ttl: float, persist: bool = False):
+        self.namespace = namespace
+        self.ttl = ttl
+        self.persist = persist
+        self.memory = TTLCache(max_size, ttl, name=namespace)
+        self._writes = 0
+
+    @staticmethod
+    def _digest(key: str) -> str:
+        return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+    async def get(self, key: str) -> Any:
+        value = self.memory.get(key)
+        if value is not None or not self.persist:
+            return value
+        from core.models import CacheEntry
+
+        now = datetime.now(timezone.utc)
+        try:
+            entry = await CacheEntry.filter(
+                namespace=self.namespace, key=self._digest(key), expires_at__gt=now
+            ).first()
+        except Exception as e:
+            logger.error(f"Failed to read {self.namespace} cache entry: {e}")
+            return None
+        if entry is None:
+            return None
+        metrics.inc(f"cache.{self.namespace}.disk_hit")
+        self.memory.set(key, entry.value, ttl=(entry.expires_at - now).total_seconds())
+        return entry.value
+
+    async def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        lifetime = self.ttl if ttl is None else ttl
+        self.memory.set(key, value, ttl=lifetime)
+        if not self.persist:
+            return
+        from core.models import CacheEntry
+
+        now = datetime.now(timezone.utc)
+        try:
+            await CacheEntry.update_or_create(
+                defaults={"value": value, "expires_at": now + timedelta(seconds=lifetime)},
+                namespace=self.namespace,
+                key=self._digest(key),
+            )
+            self._writes += 1
+            if self._writes % self.PURGE_EVERY == 0:
+                await CacheEntry.filter(namespace=self.namespace, expires_at__lte=now).delete()
+        except Exception as e:
+            logger.error(f"Failed to write {self.namespace} cache entry: {e}")
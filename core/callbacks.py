@@ -9,6 +9,7 @@ from core.keyboards import (
     action_schedule_remove_menu_markup,
 )
 from core.models import Task, Schedule
+from core.outbox import extract_message_id, outbox
 
 
 def derive_user_id(ce: Any) -> Optional[str]:
@@ -132,10 +133,12 @@ async def respond(callback_event: Any, text: str, attachments=None, parse_mode=N
     Умная функция ответа: сначала пытается редактировать исходное сообщение,
     если не получается - отправляет новое.
     """
+    chat_id = derive_chat_id(callback_event) or "unknown"
     try:
         # Сначала пытаемся отредактировать исходное сообщение
         msg = getattr(callback_event, 'message', None)
-        if msg and hasattr(msg, 'edit'):
+        message_id = extract_message_id(msg) if msg is not None else None
+        if msg and hasattr(msg, 'edit') and message_id:
             try:
                 kwargs = {"text": text}
                 if attachments:
@@ -143,7 +146,8 @@ async def respond(callback_event: Any, text: str, attachments=None, parse_mode=N
                 if parse_mode:
                     kwargs["parse_mode"] = parse_mode
                     
-                await msg.edit(**kwargs)
+                await outbox.edit(chat_id, message_id, lambda: msg.edit(**kwargs),
+                                  text=text, attachments=attachments, parse_mode=parse_mode)
                 logging.debug("Successfully edited message via callback")
                 return
             except Exception as edit_error:
@@ -159,7 +163,8 @@ async def respond(callback_event: Any, text: str, attachments=None, parse_mode=N
             if parse_mode:
                 kwargs["parse_mode"] = parse_mode
                 
-            await callback_event.message.answer(**kwargs)
+            await outbox.send(chat_id, lambda: callback_event.message.answer(**kwargs),
+                              text=text, attachments=attachments, parse_mode=parse_mode)
             logging.debug("Sent new message via callback")
             return
             
@@ -0,0 +1,134 @@
+"""
+Локальный каталог книг: полнотекстовый индекс SQLite FTS5 с ранжированием BM25.
+
+Каталог необязателен: файл индекса собирается scripts/import_catalog.py из выгрузки
+(JSONL, CSV или дамп OpenLibrary), а путь к нему задаётся BOOK_CATALOG_PATH.
+Поиск книг сначала идёт в каталог и работает без сети; внешние API только дополняют выдачу.
+"""
+import asyncio
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterable, List, Optional
+
+from core import metrics
+from core.config import BOOK_CATALOG_PATH
+
+logger = logging.getLogger(__name__)
+
+# Индексируемые поля и их веса в BM25: совпадение в названии важнее, чем в описании
+INDEXED_FIELDS = ("title", "authors", "genre", "subjects", "description")
+BM25_WEIGHTS = (10.0, 6.0, 4.0, 3.0, 1.0)
+STORED_FIELDS = ("language", "published_date", "page_count", "rating", "isbn", "link")
+
+SCHEMA = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS books USING fts5("
+    + ", ".join(INDEXED_FIELDS)
+    + ", "
+    + ", ".join(f"{field} UNINDEXED" for field in STORED_FIELDS)
+    + ", tokenize = 'unicode61 remove_diacritics 2')"
+)
+
+# Разделитель списков (авторы, темы) внутри одного поля индекса
+LIST_SEPARATOR = "; "
+
+
+def query_terms(keywords: Dict[str, str]) -> List[str]:
+    """Слова запроса для FTS: без коротких служебных слов, с грубым отсечением окончаний."""
+    text = " ".join(keywords.get(field, "") or "" for field in ("keywords", "genre", "topic", "author"))
+    words = re.sub(r"[^\w\s]", " ", text.lower().replace("ё", "е")).split()
+    terms = []
+    for word in words:
+        if len(word) < 3:
+            continue
+        # "фантастика" и "фантастику" должны совпадать: ищем по префиксу без окончания
+        stem = word[:-2] if len(word) > 5 else word
+        if stem not in terms:
+            terms.append(stem)
+    return terms
+
+
+def match_expression(terms: Iterable[str]) -> str:
+    """Выражение MATCH: любой из префиксов, BM25 поднимает книги с большим числом совпадений."""
+    return " OR ".join(f'"{term}"*' for term in terms)
+
+
+class BookCatalog:
+    """Поиск по файлу индекса. Запросы выполняются в отдельном потоке, соединение одно на процесс."""
+
+    def __init__(self, path: str = ""):
+        self.path = path
+        self._connection: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+    @property
+    def available(self) -> bool:
+        return bool(self.path) and os.path.exists(self.path)
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection is None:
+            self._connection = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, check_same_thread=False)
+            self._connection.row_factory = sqlite3.Row
+        return self._connection
+
+    def _search_sync(self, expression: str, limit: int) -> List[sqlite3.Row]:
+        weights = ", ".join(str(weight) for weight in BM25_WEIGHTS)
+        with self._lock:
+            return self._connect().execute(
+                f"SELECT *, bm25(books, {weights}) AS score FROM books WHERE books MATCH ? "
+                "ORDER BY score LIMIT ?",
+                (expression, limit),
+            ).fetchall()
+
+    async def search(self, keywords: Dict[str, str], limit: int) -> List[Dict]:
+        """
+        Найти книги по ключевым словам.
+
+        Returns:
+            Книги в формате источников BookSearchService, лучшие по BM25 - первыми;
+            пустой список, если каталога нет или он не открылся
+        """
+        terms = query_terms(keywords)
+        if not self.available or not terms:
+            return []
+        started = time.perf_counter()
+        try:
+            rows = await asyncio.to_thread(self._search_sync, match_expression(terms), limit)
+        except sqlite3.Error as e:
+            logger.error(f"Book catalog search failed: {e}")
+            return []
+        metrics.observe("books.catalog", time.perf_counter() - started)
+        return [self._to_book(row) for row in rows]
+
+    @staticmethod
+    def _to_book(row: sqlite3.Row) -> Dict:
+        # core.books импортирует каталог, поэтому импорт здесь, а не на уровне модуля
+        from core.books import truncate_description
+
+        rating = row["rating"]
+        return {
+            "title": row["title"] or "Без названия",
+            "authors": [a for a in (row["authors"] or "").split(LIST_SEPARATOR) if a] or ["Автор не указан"],
+            "description": truncate_description(row["description"]),
+            "published_date": row["published_date"] or "Дата не указана",
+            "page_count": row["page_count"] or "Не указано",
+            "categories": [c for c in (row["genre"] or "").split(LIST_SEPARATOR) if c]
+                          + [s for s in (row["subjects"] or "").split(LIST_SEPARATOR) if s][:3],
+            "rating": float(rating) if rating not in (None, "") else "Нет рейтинга",
+            "preview_link": row["link"] or "",
+            "isbn": (row["isbn"] or "").split(),
+            "language": row["language"] or "",
+            "source": "Каталог",
+        }
+
+    def close(self) -> None:
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+
+# Глобальный экземпляр каталога
+book_catalog = BookCatalog(BOOK_CATALOG_PATH)
@@ -0,0 +1,134 @@
+"""
+История диалогов для AI: ограниченный буфер реплик на чат с обрезкой по токенам.
+
+В памяти держится не больше CHAT_HISTORY_MAX_CHATS чатов (LRU), в каждом - не больше
+CHAT_HISTORY_MAX_MESSAGES реплик и CHAT_HISTORY_MAX_TOKENS оценочных токенов.
+С CHAT_HISTORY_PERSIST реплики пишутся в БД, и вытесненный чат подгружается обратно.
+"""
+import asyncio
+import logging
+from collections import deque
+from typing import Deque, Dict, List, Tuple
+
+from core.cache import TTLCache
+from core.config import (
+    CHAT_HISTORY_FLUSH_INTERVAL,
+    CHAT_HISTORY_MAX_CHATS,
+    CHAT_HISTORY_MAX_MESSAGES,
+    CHAT_HISTORY_MAX_TOKENS,
+    CHAT_HISTORY_PERSIST,
+    CHAT_HISTORY_TTL,
+)
+from core.models import ChatTurn
+
+logger = logging.getLogger(__name__)
+
+
+def estimate_tokens(text: str) -> int:
+    """Грубая оценка токенов: ~3 символа на токен для русского текста плюс служебные."""
+    return len(text) // 3 + 4
+
+
+class _History:
+    """Реплики одного чата и их суммарная оценка в токенах."""
+
+    __slots__ = ("turns", "tokens")
+
+    def __init__(self):
+        self.turns: Deque[Dict] = deque()
+        self.tokens = 0
+
+    def append(self, role: str, content: str, max_messages: int, max_tokens: int) -> None:
+        self.turns.append({"role": role, "content": content})
+        self.tokens += estimate_tokens(content)
+        # Последнюю реплику оставляем всегда, даже если она одна больше бюджета
+        while len(self.turns) > 1 and (len(self.turns) > max_messages or self.tokens > max_tokens):
+            dropped = self.turns.popleft()
+            self.tokens -= estimate_tokens(dropped["content"])
+
+
+class ChatHistoryStore:
+    """Хранилище истории диалогов с вытеснением чатов и write-behind в БД."""
+
+    def __init__(self, max_chats: int = 1000, max_messages: int = 20, max_tokens: int = 1500,
+                 ttl: float = 86400, persist: bool = False):
+        self.max_messages = max_messages
+        self.max_tokens = max_tokens
+        self.persist = persist
+        self._chats = TTLCache(max_chats, ttl, name="chat_history")
+        self._pending: List[Tuple[str, str, str]] = []  # (chat_id, role, content), ещё не в БД
+
+    async def _get(self, chat_id: str) -> _History:
+        history = self._chats.get(chat_id)
+        if history is None:
+            history = _History()
+            if self.persist:
+                await self._load(chat_id, history)
+                # Пока шла загрузка, чат мог появиться из параллельного запроса
+                loaded = self._chats.get(chat_id)
+                if loaded is not None:
+                    return loaded
+            self._chats.set(chat_id, history)
+        return history
+
+    async def _load(self, chat_id: str, history: _History) -> None:
+        try:
+            turns = await ChatTurn.filter(chat_id=chat_id).order_by("-id").limit(self.max_messages)
+            for turn in reversed(turns):
+                history.append(turn.role, turn.content, self.max_messages, self.max_tokens)
+        except Exception as e:
+            logger.error(f"Failed to load chat history for {chat_id}: {e}")
+        # Реплики, которые ещё не успели записаться
+        for pending_chat, role, content in self._pending:
+            if pending_chat == chat_id:
+                history.append(role, content, self.max_messages, self.max_tokens)
+
+    async def append(self, chat_id, role: str, content: str) -> None:
+        key = str(chat_id)
+        history = await self._get(key)
+        history.append(role, content, self.max_messages, self.max_tokens)
+        # Перезаписываем, чтобы продлить срок жизни активного чата
+        self._chats.set(key, history)
+        if self.persist:
+            self._pending.append((key, role, content))
+
+    async def get_messages(self, chat_id) -> List[Dict]:
+        """Реплики чата от старых к новым, уже в пределах бюджета токенов."""
+        history = await self._get(str(chat_id))
+        return list(history.turns)
+
+    async def flush(self) -> None:
+        """Записать накопленные реплики в БД и обрезать старые записи затронутых чатов."""
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, []
+        try:
+            await ChatTurn.bulk_create([
+                ChatTurn(chat_id=chat_id, role=role, content=content) for chat_id, role, content in batch
+            ])
+            for chat_id in {chat_id for chat_id, _, _ in batch}:
+                boundary = await ChatTurn.filter(chat_id=chat_id).order_by("-id").offset(self.max_messages).first()
+                if boundary is not None:
+                    await ChatTurn.filter(chat_id=chat_id, id__lte=boundary.id).delete()
+        except Exception as e:
+            logger.error(f"Failed to flush chat history: {e}")
+            self._pending = batch + self._pending
+
+    async def run_flusher(self, interval: float = CHAT_HISTORY_FLUSH_INTERVAL) -> None:
+        """Фоновая запись истории в БД; при остановке сбрасывает остаток."""
+        try:
+            while True:
+                await asyncio.sleep(interval)
+                await self.flush()
+        finally:
+            await self.flush()
+
+
+# Глобальный экземпляр хранилища
+chat_history = ChatHistoryStore(
+    max_chats=CHAT_HISTORY_MAX_CHATS,
+    max_messages=CHAT_HISTORY_MAX_MESSAGES,
+    max_tokens=CHAT_HISTORY_MAX_TOKENS,
+    ttl=CHAT_HISTORY_TTL,
+    persist=CHAT_HISTORY_PERSIST,
+)
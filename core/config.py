@@ -5,4 +5,140 @@ load_dotenv()
 
 BOT_TOKEN = os.getenv("TOKEN")
 DB_URL = os.getenv("DB_URL")
-AI_TOKEN = os.getenv("AI_TOKEN")
\ No newline at end of file
+AI_TOKEN = os.getenv("AI_TOKEN")
+
+def _env_flag(name: str, default: str = "0") -> bool:
+    return os.getenv(name, default).strip() in ("1", "true", "True", "yes")
+
+
+# Получение обновлений: "polling" (long polling) или "webhook" (HTTP-сервер на aiohttp)
+UPDATES_MODE = os.getenv("UPDATES_MODE", "polling").strip().lower()
+
+# HTTP-сервер бота: вебхук, /healthz, /readyz, /metrics
+HTTP_HOST = os.getenv("HTTP_HOST", "0.0.0.0")
+HTTP_PORT = int(os.getenv("HTTP_PORT", "8080"))
+# В режиме polling сервер поднимается только для health/metrics, если включён явно
+HTTP_SERVER_ENABLED = _env_flag("HTTP_SERVER_ENABLED") or UPDATES_MODE == "webhook"
+
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+# Публичный URL вебхука; если задан, бот сам оформит подписку в MAX при старте
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")
+# Секрет подписки: MAX присылает его в заголовке X-Max-Bot-Api-Secret
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+
+# Файл для записи входящих обновлений (JSONL) - для локального воспроизведения
+UPDATES_RECORD_PATH = os.getenv("UPDATES_RECORD_PATH")
+
+# Очередь исходящих сообщений: лимиты MAX API (запросов в секунду)
+OUTBOX_GLOBAL_RATE = float(os.getenv("OUTBOX_GLOBAL_RATE", "25"))
+OUTBOX_CHAT_RATE = float(os.getenv("OUTBOX_CHAT_RATE", "2"))
+OUTBOX_CHAT_BURST = float(os.getenv("OUTBOX_CHAT_BURST", "4"))
+OUTBOX_MAX_RETRIES = int(os.getenv("OUTBOX_MAX_RETRIES", "4"))
+
+# Реестр последних сообщений бота для редактирования на месте
+# Окно редактирования в секундах: старше этого сообщения не правим, а отправляем заново
+MESSAGE_EDIT_WINDOW = int(os.getenv("MESSAGE_EDIT_WINDOW", str(24 * 3600)))
+MESSAGE_REGISTRY_SIZE = int(os.getenv("MESSAGE_REGISTRY_SIZE", "10000"))
+# Сохранять реестр в БД (write-behind), чтобы правки работали после перезапуска
+MESSAGE_REGISTRY_PERSIST = _env_flag("MESSAGE_REGISTRY_PERSIST")
+MESSAGE_REGISTRY_FLUSH_INTERVAL = float(os.getenv("MESSAGE_REGISTRY_FLUSH_INTERVAL", "5"))
+
+# История диалогов для AI
+CHAT_HISTORY_MAX_CHATS = int(os.getenv("CHAT_HISTORY_MAX_CHATS", "1000"))
+CHAT_HISTORY_MAX_MESSAGES = int(os.getenv("CHAT_HISTORY_MAX_MESSAGES", "20"))
+# Бюджет истории в оценочных токенах - ограничивает размер промпта
+CHAT_HISTORY_MAX_TOKENS = int(os.getenv("CHAT_HISTORY_MAX_TOKENS", "1500"))
+# Сколько секунд неактивный чат держится в памяти
+CHAT_HISTORY_TTL = float(os.getenv("CHAT_HISTORY_TTL", str(24 * 3600)))
+CHAT_HISTORY_PERSIST = _env_flag("CHAT_HISTORY_PERSIST")
+CHAT_HISTORY_FLUSH_INTERVAL = float(os.getenv("CHAT_HISTORY_FLUSH_INTERVAL", "5"))
+
+# Пул заранее сгенерированных названий достижений
+ACHIEVEMENT_POOL_SIZE = int(os.getenv("ACHIEVEMENT_POOL_SIZE", "5"))
+ACHIEVEMENT_POOL_REFILL_INTERVAL = float(os.getenv("ACHIEVEMENT_POOL_REFILL_INTERVAL", "1800"))
+# Часы низкой нагрузки (локальное время сервера), когда пул пополняется до полного
+ACHIEVEMENT_POOL_OFFPEAK_HOURS = os.getenv("ACHIEVEMENT_POOL_OFFPEAK_HOURS", "1-6")
+
+# AI-шлюз: общий лимит конкурентности и частоты запросов к провайдеру
+AI_MAX_IN_FLIGHT = int(os.getenv("AI_MAX_IN_FLIGHT", "4"))
+AI_RPM = float(os.getenv("AI_RPM", "15"))
+AI_TPM = float(os.getenv("AI_TPM", "1000000"))
+# Сколько секунд запрос может ждать очереди, прежде чем уйти в запасной вариант
+AI_QUEUE_TIMEOUT = float(os.getenv("AI_QUEUE_TIMEOUT", "5"))
+AI_BACKGROUND_QUEUE_TIMEOUT = float(os.getenv("AI_BACKGROUND_QUEUE_TIMEOUT", "120"))
+# Предохранитель (у каждой модели свой): ошибок подряд до размыкания и пауза перед пробным запросом
+AI_BREAKER_FAILURES = int(os.getenv("AI_BREAKER_FAILURES", "5"))
+AI_BREAKER_RESET = float(os.getenv("AI_BREAKER_RESET", "30"))
+# Доля общего таймаута маршрута, которую получает модель, если после неё есть запасные
+AI_PRIMARY_TIMEOUT_SHARE = float(os.getenv("AI_PRIMARY_TIMEOUT_SHARE", "0.6"))
+
+# Хеджирование: второй запрос, если ответ задерживается дольше перцентиля места вызова;
+# бюджет - доля дополнительных запросов от общего числа вызовов
+AI_HEDGE_ENABLED = _env_flag("AI_HEDGE_ENABLED")
+AI_HEDGE_BUDGET = float(os.getenv("AI_HEDGE_BUDGET", "0.05"))
+AI_HEDGE_PERCENTILE = float(os.getenv("AI_HEDGE_PERCENTILE", "90"))
+AI_HEDGE_MIN_SAMPLES = int(os.getenv("AI_HEDGE_MIN_SAMPLES", "20"))
+
+# Свой адрес API провайдера (например, локальная заглушка scripts/fake_llm.py); пусто - адрес по умолчанию
+AI_API_BASE = os.getenv("AI_API_BASE", "")
+
+# Переопределение маршрутов AI по местам вызова (JSON): модель, запасные модели, таймаут, max_tokens
+AI_ROUTES = os.getenv("AI_ROUTES", "")
+
+# Кэш ответов AI для служебных промптов (записей)
+AI_CACHE_SIZE = int(os.getenv("AI_CACHE_SIZE", "2000"))
+
+# Сроки ответа AI (сек) по функциям: не успел - пользователь получает запасной ответ,
+# а поздний ответ AI (где возможно) подставляется правкой сообщения
+AI_DEADLINE_DECOMPOSE = float(os.getenv("AI_DEADLINE_DECOMPOSE", "10"))
+AI_DEADLINE_INSIGHTS = float(os.getenv("AI_DEADLINE_INSIGHTS", "8"))
+AI_DEADLINE_MOTIVATION = float(os.getenv("AI_DEADLINE_MOTIVATION", "5"))
+
+# Бюджет токенов (промпт + ожидаемый ответ) одного запроса пакетного разбиения задач
+AI_BULK_DECOMPOSE_TOKENS = int(os.getenv("AI_BULK_DECOMPOSE_TOKENS", "3000"))
+# Сколько задач максимум разбивает /decompose_all за раз
+BULK_DECOMPOSE_MAX_TASKS = int(os.getenv("BULK_DECOMPOSE_MAX_TASKS", "20"))
+
+# Как часто (сек) правим сообщение частичным ответом при потоковой генерации
+AI_STREAM_EDIT_INTERVAL = float(os.getenv("AI_STREAM_EDIT_INTERVAL", "0.5"))
+
+# Очередь фоновых задач (декомпозиция, отчёты, подбор книг)
+JOBS_WORKERS = int(os.getenv("JOBS_WORKERS", "4"))
+JOBS_TIMEOUT = float(os.getenv("JOBS_TIMEOUT", "120"))
+JOBS_MAX_ATTEMPTS = int(os.getenv("JOBS_MAX_ATTEMPTS", "3"))
+
+# Сколько секунд ждём выбора числа подзадач, прежде чем отменить спекулятивное разбиение
+DECOMPOSE_SPECULATION_TTL = float(os.getenv("DECOMPOSE_SPECULATION_TTL", "300"))
+
+# Общий HTTP-клиент для внешних API: размер пула (всего и на хост), кэш DNS и keep-alive (сек)
+HTTP_CLIENT_LIMIT = int(os.getenv("HTTP_CLIENT_LIMIT", "100"))
+HTTP_CLIENT_LIMIT_PER_HOST = int(os.getenv("HTTP_CLIENT_LIMIT_PER_HOST", "10"))
+HTTP_CLIENT_DNS_TTL = float(os.getenv("HTTP_CLIENT_DNS_TTL", "300"))
+HTTP_CLIENT_KEEPALIVE = float(os.getenv("HTTP_CLIENT_KEEPALIVE", "30"))
+# Таймауты запроса целиком и установки соединения (сек)
+HTTP_CLIENT_TIMEOUT = float(os.getenv("HTTP_CLIENT_TIMEOUT", "10"))
+HTTP_CLIENT_CONNECT_TIMEOUT = float(os.getenv("HTTP_CLIENT_CONNECT_TIMEOUT", "3"))
+
+# Поиск книг: вернуть результат, как только один источник дал достаточно книг, не дожидаясь остальных
+BOOK_SEARCH_FAST = _env_flag("BOOK_SEARCH_FAST")
+# Сколько книг запрашивать у каждого источника в запас: выдачи выбираются из него без повторных запросов
+BOOK_SEARCH_SUPERSET = int(os.getenv("BOOK_SEARCH_SUPERSET", "40"))
+# Кэш поиска книг: запрос -> ключевые слова и ключевые слова -> запас книг (сек); 1 - хранить в БД
+BOOK_CACHE_SIZE = int(os.getenv("BOOK_CACHE_SIZE", "1000"))
+BOOK_KEYWORDS_CACHE_TTL = float(os.getenv("BOOK_KEYWORDS_CACHE_TTL", "86400"))
+BOOK_RESULTS_CACHE_TTL = float(os.getenv("BOOK_RESULTS_CACHE_TTL", "21600"))
+BOOK_CACHE_PERSIST = _env_flag("BOOK_CACHE_PERSIST")
+# Локальный каталог книг (индекс SQLite FTS5 из scripts/import_catalog.py); пусто - не использовать.
+# Если в каталоге нашлось не меньше BOOK_CATALOG_MIN_RESULTS книг, внешние API только дополняют выдачу в фоне
+BOOK_CATALOG_PATH = os.getenv("BOOK_CATALOG_PATH", "")
+BOOK_CATALOG_MIN_RESULTS = int(os.getenv("BOOK_CATALOG_MIN_RESULTS", "10"))
+# Источники книг (Google Books, OpenLibrary): таймауты соединения и чтения (сек),
+# окно статистики здоровья (запросов), ошибок подряд до размыкания и пауза до пробного запроса (сек)
+BOOK_SOURCE_CONNECT_TIMEOUT = float(os.getenv("BOOK_SOURCE_CONNECT_TIMEOUT", "2"))
+BOOK_SOURCE_READ_TIMEOUT = float(os.getenv("BOOK_SOURCE_READ_TIMEOUT", "5"))
+BOOK_SOURCE_WINDOW = int(os.getenv("BOOK_SOURCE_WINDOW", "50"))
+BOOK_SOURCE_BREAKER_FAILURES = int(os.getenv("BOOK_SOURCE_BREAKER_FAILURES", "3"))
+BOOK_SOURCE_BREAKER_RESET = float(os.getenv("BOOK_SOURCE_BREAKER_RESET", "60"))
+# Подборка книг: по сколько книг показывать и сколько секунд хранить остаток выдачи для кнопки "📚 Ещё"
+BOOK_PAGE_SIZE = int(os.getenv("BOOK_PAGE_SIZE", "3"))
+BOOK_PAGE_TTL = float(os.getenv("BOOK_PAGE_TTL", "1800"))
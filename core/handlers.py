@@ -16,7 +16,7 @@ from core.utils import (
     minutes_to_human_readable,
     format_reminder_presets,
 )
-from core.state import awaiting_actions
+from core.state import awaiting_actions, cancel_speculation, start_speculation
 from core.keyboards import (
     main_keyboard_markup,
     back_to_menu_markup,
@@ -31,13 +31,18 @@ from core.keyboards import (
     timezone_choice_markup,
     motivation_style_markup,
     quarterly_report_menu_markup,
+    book_more_markup,
 )
 from core.models import Task, Schedule, UserSettings
 from core.task_manager import clear_all_tasks, clear_completed_tasks, clear_expired_tasks, get_task_statistics, increment_completed_tasks_counter, get_total_completed_tasks
 from core.books import book_search_service
 from core.reports import quarterly_report_service
 from core.callbacks import derive_user_id, derive_chat_id, extract_payload, deep_search, respond
-from core.achievements import check_and_unlock_achievements, get_all_achievements
+from core.jobs import job_queue
+from core.message_utils import get_last_message_id
+from core.outbox import extract_message_id, outbox
+from core.config import BOOK_PAGE_SIZE, BULK_DECOMPOSE_MAX_TASKS, DECOMPOSE_SPECULATION_TTL
+from core.achievements import check_and_unlock_achievements, get_all_achievements, invalidate_milestone_cache
 from core.motivation import (
     get_or_create_settings,
     update_motivation_style,
@@ -63,6 +68,12 @@ DAY_NAMES = {
 }
 
 
+def _callback_job_key(callback_event, payload: str) -> Optional[str]:
+    """Ключ идемпотентности фоновой задачи по нажатию: повторная доставка не создаст дубль."""
+    callback_id = getattr(getattr(callback_event, "callback", None), "callback_id", None)
+    return f"{payload}:{callback_id}" if callback_id else None
+
+
 def register_handlers(dp, bot):
     """Register message and callback handlers on the provided dispatcher."""
 
@@ -153,38 +164,62 @@ def register_handlers(dp, bot):
         chat_id = _resolve_chat_id(event)
         user_id = str(event.message.sender.user_id)
         
-        await event.message.answer("🤖 Анализирую задачу и разбиваю на подзадачи...")
-        
-        from core.ai_core import decompose_with_ai
-        subtasks = await decompose_with_ai(int(chat_id), task_text)
-        
-        if not subtasks:
-            await event.message.answer("<b>❌ Не удалось разбить задачу.</b> Попробуйте позже или проверьте настройки AI.", attachments=[back_to_menu_markup()], parse_mode=ParseMode.HTML)
-            return
-        
-        main_task = await Task.create(
-            chat_id=chat_id,
+        # Разбиение выполнит воркер очереди и подставит результат в это сообщение
+        placeholder = await outbox.send(
+            chat_id, lambda: event.message.answer("🤖 Анализирую задачу и разбиваю на подзадачи..."),
+            text="🤖 Анализирую задачу и разбиваю на подзадачи...",
+        )
+        await job_queue.enqueue(
+            "decompose",
+            chat_id,
+            {"task_text": task_text, "n": 5},
             user_id=user_id,
-            text=task_text,
-            status="pending"
+            message_id=extract_message_id(placeholder),
+            idempotency_key=f"decompose:{event.message.body.mid}",
         )
+
+    @dp.message_created(Command('decompose_all'))
+    async def decompose_all_tasks(event: MessageCreated):
+        try:
+            if should_ignore_message_event_on_start(event):
+                return
+        except Exception:
+            pass
+        text = event.message.body.text or ""
+        parts = text.split(maxsplit=1)
+        chat_id = _resolve_chat_id(event)
         
-        for subtask_text in subtasks:
-            await Task.create(
-                chat_id=chat_id,
-                user_id=user_id,
-                text=subtask_text,
-                status="pending",
-                parent_id=main_task.id
-            )
+        # Номера - как в /list (родительские задачи); без номеров берём все активные
+        parent_tasks = await Task.filter(chat_id=chat_id, parent_id=None).order_by("status", "created_at")
+        if len(parts) > 1 and parts[1].strip():
+            try:
+                numbers = [int(token) for token in parts[1].replace(',', ' ').split()]
+            except ValueError:
+                await event.message.answer("Использование: /decompose_all [номера задач из /list]\nПример: /decompose_all 1 3 4")
+                return
+            selected = [parent_tasks[i - 1] for i in dict.fromkeys(numbers) if 1 <= i <= len(parent_tasks)]
+        else:
+            selected = list(parent_tasks)
         
-        result = f"<b>✅ Задача разбита на {len(subtasks)} подзадач:</b>\n\n"
-        result += f"📋 <b>Главная задача:</b> <i>{task_text}</i>\n\n"
-        result += "<b>Подзадачи:</b>\n"
-        for i, subtask in enumerate(subtasks, 1):
-            result += f"{i}. {subtask}\n"
+        with_subtasks = set(await Task.filter(parent_id__in=[t.id for t in selected]).values_list("parent_id", flat=True))
+        selected = [t for t in selected if t.status == "pending" and t.id not in with_subtasks]
+        if not selected:
+            await event.message.answer("Нет активных задач без подзадач для разбиения.", attachments=[back_to_menu_markup()])
+            return
+        selected = selected[:BULK_DECOMPOSE_MAX_TASKS]
         
-        await event.message.answer(result, attachments=[back_to_menu_markup()], parse_mode=ParseMode.HTML)
+        placeholder_text = f"🤖 Разбиваю на подзадачи задач: {len(selected)}..."
+        placeholder = await outbox.send(
+            chat_id, lambda: event.message.answer(placeholder_text), text=placeholder_text,
+        )
+        await job_queue.enqueue(
+            "bulk_decompose",
+            chat_id,
+            {"task_ids": [t.id for t in selected], "n": 5},
+            user_id=str(event.message.sender.user_id),
+            message_id=extract_message_id(placeholder),
+            idempotency_key=f"bulk_decompose:{event.message.body.mid}",
+        )
 
     @dp.message_created(F.message.body.text & ~F.message.body.text.startswith('/'))
     async def add_task_plain_text(event: MessageCreated):
@@ -295,6 +330,15 @@ def register_handlers(dp, bot):
                 if chat_key:
                     awaiting_actions[chat_key] = new_state
                 
+                # Пока пользователь выбирает количество, уже разбиваем на максимум (5);
+                # по нажатию кнопки лишние шаги отбрасываются
+                from core.ai_core import decompose_with_ai
+                start_speculation(
+                    chat_id, task_text,
+                    decompose_with_ai(int(chat_id), task_text, max_subtasks=5),
+                    ttl=DECOMPOSE_SPECULATION_TTL,
+                )
+                
                 from core.keyboards import decompose_count_markup
                 await event.message.answer(
                     f"� Задача: {task_text}\n\nВыберите количество подзадач:",
@@ -328,55 +372,16 @@ def register_handlers(dp, bot):
                     message_type="book_search"
                 )
                 
+                # Поиск выполнит воркер очереди и заменит сообщение о поиске результатом
                 try:
-                    # Выполняем поиск книг
-                    books = await book_search_service.search_books(user_request, max_results=3)
-                    
-                    if books:
-                        # Формируем единое сообщение со всеми результатами
-                        result_lines = [
-                            f"<b>📚 Нашел {len(books)} книг по запросу:</b> <i>\"{user_request}\"</i>",
-                            ""
-                        ]
-                        
-                        # Добавляем все книги в одно сообщение
-                        for i, book in enumerate(books, 1):
-                            book_text = book_search_service.format_book_result(book)
-                            result_lines.append(f"<b>{i}.</b>")
-                            result_lines.append(book_text)
-                            if i < len(books):  # Добавляем разделитель между книгами
-                                result_lines.append("")
-                        
-                        result_lines.append("")
-                        result_lines.append("✨ Хотите найти еще книги? Нажмите 📚 <b>Подбор книг</b> в главном меню.")
-                        
-                        # Редактируем сообщение о поиске на результат
-                        await smart_send_or_edit(
-                            bot=bot,
-                            event=event,
-                            text="\n".join(result_lines),
-                            chat_id=chat_id,
-                            message_type="book_search",
-                            attachments=[back_to_menu_markup()],
-                            parse_mode=ParseMode.HTML
-                        )
-                            
-                    else:
-                        # Редактируем сообщение на "не найдено"
-                        await smart_send_or_edit(
-                            bot=bot,
-                            event=event,
-                            text=f"😔 К сожалению, не удалось найти книги по запросу <i>\"{user_request}\"</i>.\n\n"
-                                 "<b>Попробуйте:</b>\n"
-                                 "• Изменить формулировку\n" 
-                                 "• Указать жанр или автора\n"
-                                 "• Использовать более общие термины",
-                            chat_id=chat_id,
-                            message_type="book_search",
-                            attachments=[back_to_menu_markup()],
-                            parse_mode=ParseMode.HTML
-                        )
-                        
+                    await job_queue.enqueue(
+                        "book_search",
+                        chat_id,
+                        {"request": user_request},
+                        user_id=str(event.message.sender.user_id),
+                        message_id=get_last_message_id(chat_id, "book_search"),
+                        idempotency_key=f"book_search:{event.message.body.mid}",
+                    )
                 except Exception as e:
                     logging.exception(f"Error in book search: {e}")
                     # Редактируем сообщение на ошибку
@@ -459,7 +464,7 @@ def register_handlers(dp, bot):
                     completed_count = await get_total_completed_tasks(str(chat_id))
                     parts.append(f"\n📊 Всего выполнено задач: {completed_count}")
                     
-                    new_achievement = await check_and_unlock_achievements(str(chat_id))
+                    new_achievement = await check_and_unlock_achievements(str(chat_id), completed_count)
                     if new_achievement:
                         parts.append(
                             f"\n\n🎉 НОВОЕ ДОСТИЖЕНИЕ РАЗБЛОКИРОВАНО!\n"
@@ -1227,6 +1232,7 @@ def register_handlers(dp, bot):
             for key in keys_to_remove:
                 awaiting_actions.pop(key, None)
                 logging.info("Cleared old decompose state for key: %s", key)
+            cancel_speculation(chat_id)
             
             state_obj = {'action': 'decompose_input', 'chat_id': str(chat_id)}
             if user_id is not None:
@@ -1284,6 +1290,44 @@ def register_handlers(dp, bot):
             )
             return
 
+        if payload == 'book_more':
+            chat_id = derive_chat_id(callback_event) or None
+            if chat_id is None:
+                try:
+                    chat_id = callback_event.message.recipient.chat_id
+                except Exception:
+                    chat_id = None
+            if chat_id is None:
+                chat_id = str(callback_event.message.sender.user_id)
+
+            # Следующая порция из сохранённой выдачи - сразу, без AI и сети
+            user_request, books = book_search_service.next_page(str(chat_id), BOOK_PAGE_SIZE)
+            if user_request is None:
+                await _respond(
+                    "⌛ Подборка устарела. Начните новый поиск: 📚 Подбор книг в главном меню.",
+                    attachments=[back_to_menu_markup()]
+                )
+                return
+            if books:
+                await _respond(
+                    book_search_service.format_search_reply(user_request, books),
+                    attachments=[book_more_markup()],
+                    parse_mode=ParseMode.HTML
+                )
+                return
+
+            # Выдача кончилась - дозапрос источников выполнит воркер очереди
+            await _respond("🔍 Ищу ещё книги...")
+            await job_queue.enqueue(
+                "book_more",
+                str(chat_id),
+                {},
+                user_id=derive_user_id(callback_event) or None,
+                message_id=extract_message_id(callback_event.message),
+                idempotency_key=_callback_job_key(callback_event, payload),
+            )
+            return
+
         # Обработчик квартальных отчётов
         if payload == 'cmd_quarterly_report':
             await _respond(
@@ -1328,17 +1372,23 @@ def register_handlers(dp, bot):
             chat_id = derive_chat_id(callback_event) or str(callback_event.message.recipient.chat_id)
             
             try:
-                if payload == 'quarterly_current':
-                    # Текущий квартал
-                    report = await quarterly_report_service.generate_quarterly_report(user_id, chat_id)
-                else:
+                year = quarter = None
+                if payload != 'quarterly_current':
                     # Конкретный квартал текущего года
                     quarter = int(payload.split('_')[1])
                     from datetime import datetime
-                    current_year = datetime.now().year
-                    report = await quarterly_report_service.generate_quarterly_report(user_id, chat_id, current_year, quarter)
+                    year = datetime.now().year
                 
-                await _respond(report, attachments=[back_to_menu_markup()], parse_mode=ParseMode.HTML)
+                # Отчёт собирает воркер очереди и подставляет его в это сообщение
+                await _respond("📊 Готовлю отчёт, 🤖 анализирую результаты...")
+                await job_queue.enqueue(
+                    "quarterly_report",
+                    str(chat_id),
+                    {"user_id": str(user_id), "year": year, "quarter": quarter},
+                    user_id=str(user_id),
+                    message_id=extract_message_id(callback_event.message),
+                    idempotency_key=_callback_job_key(callback_event, payload),
+                )
                 
             except Exception as e:
                 logging.error(f"Error generating quarterly report: {e}")
@@ -1388,55 +1438,17 @@ def register_handlers(dp, bot):
                 awaiting_actions.pop(key, None)
                 logging.info("Cleared state for key: %s", key)
             
-            # Редактируем сообщение с кнопками, показывая что анализируем
-            try:
-                await callback_event.message.edit(text=f"🤖 Анализирую задачу и разбиваю на {n} подзадач...", attachments=[])
-            except Exception:
-                pass
-            
-            # Запускаем декомпозицию
-            from core.ai_core import decompose_with_ai
-            try:
-                subtasks = await decompose_with_ai(int(chat_id), task_text, max_subtasks=n)
-            except Exception:
-                logging.exception("AI decomposition failed")
-                subtasks = []
-            
-            if not subtasks:
-                try:
-                    await callback_event.message.edit(text="❌ Не удалось разбить задачу. Попробуйте позже или проверьте настройки AI.", attachments=[back_to_menu_markup()])
-                except Exception:
-                    await callback_event.message.answer("❌ Не удалось разбить задачу. Попробуйте позже или проверьте настройки AI.", attachments=[back_to_menu_markup()])
-                return
-            
-            main_task = await Task.create(
-                chat_id=str(chat_id),
+            # Редактируем сообщение с кнопками, показывая что анализируем;
+            # разбиение выполнит воркер очереди и подставит результат в это же сообщение
+            await _respond(f"🤖 Анализирую задачу и разбиваю на {n} подзадач...")
+            await job_queue.enqueue(
+                "decompose",
+                str(chat_id),
+                {"task_text": task_text, "n": n},
                 user_id=str(user_id),
-                text=task_text,
-                status="pending",
-                ai_generated=True
+                message_id=extract_message_id(callback_event.message),
+                idempotency_key=_callback_job_key(callback_event, payload),
             )
-            
-            created_subtasks = []
-            for subtask_text in subtasks:
-                t = await Task.create(
-                    chat_id=str(chat_id),
-                    user_id=str(user_id),
-                    text=subtask_text,
-                    status="pending",
-                    parent_id=main_task.id,
-                    ai_generated=True
-                )
-                created_subtasks.append(t.text)
-            
-            # Формируем ответ и редактируем сообщение "Анализирую..."
-            result = [f"✅ Задача разбита на {len(created_subtasks)} подзадач:", "", f"📋 Главная задача: {task_text}", "", "Подзадачи:"]
-            for i, sub in enumerate(created_subtasks, 1):
-                result.append(f"{i}. {sub}")
-            try:
-                await callback_event.message.edit(text="\n".join(result), attachments=[back_to_menu_markup()])
-            except Exception:
-                await callback_event.message.answer("\n".join(result), attachments=[back_to_menu_markup()])
             return
 
         if payload == 'cmd_achievements':
@@ -2046,6 +2058,7 @@ def register_handlers(dp, bot):
                 else:
                     message = "❌ Неизвестный тип очистки"
                 
+                invalidate_milestone_cache(str(chat_id))
                 await _respond(message, attachments=[back_to_menu_markup()])
             except Exception as e:
                 logging.exception(f"Error clearing tasks: {e}")
@@ -2066,6 +2079,8 @@ def register_handlers(dp, bot):
                     chat_id = None
             
             if chat_id:
+                # Сценарий разбиения брошен - незачем дожидаться ответа AI
+                cancel_speculation(chat_id)
                 completed_count = await get_total_completed_tasks(str(chat_id))
                 pretty_text = (
                     "🏠 Главное меню — Кузя\n"
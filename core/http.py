@@ -0,0 +1,76 @@
+"""
+Общий HTTP-клиент для исходящих запросов к внешним API (поиск книг и другие интеграции).
+
+Одна aiohttp.ClientSession на процесс: пул соединений с лимитами на хост,
+keep-alive и кэш DNS, так что повторные запросы к тому же API не платят
+за DNS, TCP и TLS заново. Сессия создаётся в main.py и закрывается при остановке.
+"""
+from typing import Dict, Optional
+
+import aiohttp
+
+from core import metrics
+from core.config import (
+    HTTP_CLIENT_CONNECT_TIMEOUT,
+    HTTP_CLIENT_DNS_TTL,
+    HTTP_CLIENT_KEEPALIVE,
+    HTTP_CLIENT_LIMIT,
+    HTTP_CLIENT_LIMIT_PER_HOST,
+    HTTP_CLIENT_TIMEOUT,
+)
+
+
+class HttpClient:
+    """Владелец общей сессии: start/close вызываются из main.py."""
+
+    def __init__(self, limit: int = 100, limit_per_host: int = 10, dns_ttl: float = 300,
+                 keepalive: float = 30, timeout: float = 10, connect_timeout: float = 3):
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.dns_ttl = dns_ttl
+        self.keepalive = keepalive
+        self.timeout = aiohttp.ClientTimeout(total=timeout, connect=connect_timeout)
+        self._session: Optional[aiohttp.ClientSession] = None
+
+        metrics.register_source("http_client", self.stats)
+
+    async def start(self) -> aiohttp.ClientSession:
+        return self.session
+
+    async def close(self) -> None:
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        """Общая сессия. Вне main.py (скрипты) создаётся при первом обращении."""
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.limit,
+                limit_per_host=self.limit_per_host,
+                ttl_dns_cache=self.dns_ttl,
+                keepalive_timeout=self.keepalive,
+            )
+            self._session = aiohttp.ClientSession(connector=connector, timeout=self.timeout)
+        return self._session
+
+    def stats(self) -> Dict:
+        if self._session is None or self._session.closed:
+            return {"open": False}
+        connector = self._session.connector
+        idle = sum(len(conns) for conns in getattr(connector, "_conns", {}).values())
+        acquired = len(getattr(connector, "_acquired", ()))
+        return {"open": True, "acquired": acquired, "idle": idle, "limit": self.limit,
+                "limit_per_host": self.limit_per_host}
+
+
+# Глобальный экземпляр клиента
+http_client = HttpClient(
+    limit=HTTP_CLIENT_LIMIT,
+    limit_per_host=HTTP_CLIENT_LIMIT_PER_HOST,
+    dns_ttl=HTTP_CLIENT_DNS_TTL,
+    keepalive=HTTP_CLIENT_KEEPALIVE,
+    timeout=HTTP_CLIENT_TIMEOUT,
+    connect_timeout=HTTP_CLIENT_CONNECT_TIMEOUT,
+)
@@ -0,0 +1,462 @@
+"""
+Очередь фоновых задач для долгих AI-операций: декомпозиция, квартальный отчёт, подбор книг.
+
+Хендлер отвечает сообщением-заглушкой и ставит задачу в очередь (таблица jobs),
+воркер выполняет её и доставляет результат правкой заглушки. Задачи переживают
+перезапуск: незавершённые при старте возвращаются в очередь.
+"""
+import asyncio
+import html
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from maxapi.enums.parse_mode import ParseMode
+from tortoise.exceptions import IntegrityError
+from tortoise.expressions import Q
+from tortoise.transactions import in_transaction
+
+from core import metrics
+from core.config import AI_DEADLINE_DECOMPOSE, BOOK_PAGE_SIZE, JOBS_MAX_ATTEMPTS, JOBS_TIMEOUT, JOBS_WORKERS
+from core.keyboards import back_to_menu_markup, book_more_markup
+from core.message_utils import progress_editor
+from core.models import Job, Task
+from core.outbox import outbox
+from core.state import take_speculation
+
+logger = logging.getLogger(__name__)
+
+# Обработчик задачи возвращает (текст результата, parse_mode) или
+# (текст, parse_mode, вложения) - если под результатом нужна своя клавиатура
+JobHandler = Callable[[Job, "JobQueue"], Awaitable[tuple]]
+
+JOB_HANDLERS: Dict[str, JobHandler] = {}
+
+
+def job_handler(kind: str):
+    """Зарегистрировать обработчик задач вида kind."""
+    def decorator(fn: JobHandler) -> JobHandler:
+        JOB_HANDLERS[kind] = fn
+        return fn
+    return decorator
+
+
+class JobQueue:
+    """Пул воркеров над таблицей jobs."""
+
+    def __init__(self, workers: int = 4, timeout: float = 120):
+        self.workers = workers
+        self.timeout = timeout
+        self.bot = None
+        self._wakeup = asyncio.Event()
+        self._tasks: List[asyncio.Task] = []
+        self._running = 0
+        self._delivered: Dict[int, asyncio.Future] = {}
+
+        metrics.register_source("jobs", self.stats)
+
+    async def start(self, bot) -> int:
+        """Вернуть в очередь задачи, прерванные перезапуском, и запустить воркеры."""
+        self.bot = bot
+        recovered = await Job.filter(status="running").update(status="queued")
+        if recovered:
+            logger.info(f"Recovered {recovered} interrupted jobs")
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        return recovered
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def enqueue(self, kind: str, chat_id: str, payload: Dict, *, user_id: Optional[str] = None,
+                      message_id: Optional[str] = None, idempotency_key: Optional[str] = None) -> Job:
+        """
+        Поставить задачу в очередь. Повтор с тем же idempotency_key (двойное нажатие,
+        повторная доставка обновления) возвращает уже существующую задачу.
+        """
+        if idempotency_key:
+            existing = await Job.filter(idempotency_key=idempotency_key).first()
+            if existing is not None:
+                metrics.inc("jobs.duplicate")
+                return existing
+        try:
+            job = await Job.create(
+                kind=kind,
+                chat_id=str(chat_id),
+                user_id=user_id,
+                payload=payload,
+                message_id=message_id,
+                idempotency_key=idempotency_key,
+                max_attempts=JOBS_MAX_ATTEMPTS,
+            )
+        except IntegrityError:
+            metrics.inc("jobs.duplicate")
+            return await Job.get(idempotency_key=idempotency_key)
+        metrics.inc(f"jobs.enqueued.{kind}")
+        self._wakeup.set()
+        return job
+
+    async def _claim(self) -> Optional[Job]:
+        now = datetime.now(timezone.utc)
+        # Отложенные повторы отсекаются в SQL, иначе они занимают окно выборки и прячут готовые задачи
+        candidates = await Job.filter(
+            Q(run_after__isnull=True) | Q(run_after__lte=now), status="queued"
+        ).order_by("id").limit(self.workers * 2)
+        for job in candidates:
+            # Забираем атомарно: другой воркер мог успеть раньше
+            if await Job.filter(id=job.id, status="queued").update(status="running"):
+                job.status = "running"
+                return job
+        return None
+
+    async def _next_delay(self) -> Optional[float]:
+        """Секунды до ближайшего отложенного повтора; None - отложенных задач нет."""
+        now = datetime.now(timezone.utc)
+        run_after = await Job.filter(status="queued", run_after__gt=now).order_by("run_after") \
+            .first().values_list("run_after", flat=True)
+        return (run_after - now).total_seconds() if run_after else None
+
+    async def _worker(self) -> None:
+        while True:
+            # Сбрасываем до выборки: enqueue во время _claim не потеряется
+            self._wakeup.clear()
+            try:
+                job = await self._claim()
+                delay = None if job else await self._next_delay()
+            except Exception:
+                logger.exception("Failed to claim job")
+                job, delay = None, 1.0
+            if job is None:
+                # Новые задачи будят воркеров через enqueue, по таймеру - только отложенные повторы
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            # Могут быть ещё задачи - будим остальных воркеров
+            self._wakeup.set()
+            self._running += 1
+            try:
+                await self._run(job)
+            finally:
+                self._running -= 1
+
+    async def _run(self, job: Job) -> None:
+        handler = JOB_HANDLERS.get(job.kind)
+        started = asyncio.get_running_loop().time()
+        try:
+            if handler is None:
+                raise RuntimeError(f"No handler for job kind {job.kind}")
+            text, parse_mode, *extra = await asyncio.wait_for(handler(job, self), self.timeout)
+        except asyncio.CancelledError:
+            # Остановка бота: задача останется running и вернётся в очередь при старте
+            self._resolve_delivered(job, False)
+            raise
+        except Exception as e:
+            self._resolve_delivered(job, False)
+            job.attempts += 1
+            job.error = repr(e)
+            if job.attempts < job.max_attempts:
+                job.status = "queued"
+                job.run_after = datetime.now(timezone.utc) + timedelta(seconds=5 * 2 ** job.attempts)
+                await job.save(update_fields=["status", "attempts", "error", "run_after", "updated_at"])
+                # Простаивающие воркеры должны пересчитать, когда проснуться
+                self._wakeup.set()
+                metrics.inc(f"jobs.retried.{job.kind}")
+                logger.warning(f"Job {job.id} ({job.kind}) failed, retry {job.attempts}: {e!r}")
+                return
+            job.status = "failed"
+            await job.save(update_fields=["status", "attempts", "error", "updated_at"])
+            metrics.inc(f"jobs.failed.{job.kind}")
+            logger.error(f"Job {job.id} ({job.kind}) failed permanently: {e!r}")
+            await self.deliver(job, "❌ Не удалось выполнить запрос. Попробуйте позже.")
+            return
+
+        job.status = "done"
+        job.result = text
+        await job.save(update_fields=["status", "result", "updated_at"])
+        metrics.observe(f"jobs.run.{job.kind}", asyncio.get_running_loop().time() - started)
+        await self.deliver(job, text, parse_mode, extra[0] if extra else None)
+        self._resolve_delivered(job, True)
+
+    def delivered(self, job: Job) -> asyncio.Future:
+        """
+        Future, которое завершится после доставки результата текущего запуска задачи:
+        True - результат доставлен, False - запуск не удался. Поздние правки
+        ждут его, чтобы не оказаться затёртыми основным результатом.
+        """
+        future = self._delivered.get(job.id)
+        if future is None:
+            future = self._delivered[job.id] = asyncio.get_running_loop().create_future()
+        return future
+
+    def _resolve_delivered(self, job: Job, ok: bool) -> None:
+        future = self._delivered.pop(job.id, None)
+        if future is not None and not future.done():
+            future.set_result(ok)
+
+    async def deliver(self, job: Job, text: str, parse_mode: Optional[ParseMode] = None,
+                      attachments: Optional[list] = None) -> None:
+        """Заменить заглушку результатом, а если не вышло - отправить новое сообщение."""
+        attachments = attachments or [back_to_menu_markup()]
+        if job.message_id:
+            try:
+                await outbox.edit(
+                    job.chat_id, job.message_id,
+                    lambda: self.bot.edit_message(
+                        message_id=job.message_id, text=text, attachments=attachments, parse_mode=parse_mode
+                    ),
+                    text=text, attachments=attachments, parse_mode=parse_mode,
+                )
+                return
+            except Exception as e:
+                logger.debug(f"Failed to edit placeholder {job.message_id}: {e}")
+        try:
+            await outbox.send(
+                job.chat_id,
+                lambda: self.bot.send_message(
+                    chat_id=int(job.chat_id), text=text, attachments=attachments, parse_mode=parse_mode
+                ),
+                text=text, attachments=attachments, parse_mode=parse_mode,
+            )
+        except Exception:
+            logger.exception(f"Failed to deliver job {job.id} result")
+
+    def progress(self, job: Job, header: str):
+        """Колбэк частичного ответа AI для заглушки задачи."""
+        return progress_editor(self.bot, job.message_id, job.chat_id, header)
+
+    def stats(self) -> Dict:
+        return {"workers": len(self._tasks), "running": self._running}
+
+
+def _decompose_reply(task_text: str, subtasks: List[str], provisional: bool = False) -> str:
+    """Ответ на разбиение задачи для сообщения "Анализирую..." (HTML)."""
+    result = [
+        f"<b>✅ Задача разбита на {len(subtasks)} подзадач:</b>",
+        "",
+        f"📋 <b>Главная задача:</b> <i>{html.escape(task_text, quote=False)}</i>",
+        "",
+        "<b>Подзадачи:</b>",
+    ]
+    for i, sub in enumerate(subtasks, 1):
+        result.append(f"{i}. {html.escape(sub, quote=False)}")
+    if provisional:
+        result += ["", "⏳ Это быстрый черновой план - когда AI ответит, подзадачи обновятся."]
+    return "\n".join(result)
+
+
+async def _replace_provisional_subtasks(job: Job, queue: JobQueue, main_task_id: int, subtasks: List[str]) -> None:
+    """Заменить черновые подзадачи ответом AI, если пользователь их ещё не трогал."""
+    task_text = job.payload["task_text"]
+    async with in_transaction():
+        main_task = await Task.filter(id=main_task_id).first()
+        current = await Task.filter(parent_id=main_task_id)
+        if main_task is None or any(t.status != "pending" for t in current):
+            metrics.inc("decompose.late_result.skipped")
+            return
+        await Task.filter(parent_id=main_task_id).delete()
+        await Task.bulk_create([
+            Task(
+                chat_id=job.chat_id,
+                user_id=main_task.user_id,
+                text=subtask_text,
+                status="pending",
+                parent_id=main_task_id,
+                ai_generated=True
+            )
+            for subtask_text in subtasks
+        ])
+        job.payload = {**job.payload, "provisional": False}
+        job.result = _decompose_reply(task_text, subtasks)
+        await job.save(update_fields=["payload", "result", "updated_at"])
+    await queue.deliver(job, job.result, ParseMode.HTML)
+
+
+@job_handler("decompose")
+async def run_decompose(job: Job, queue: JobQueue) -> Tuple[str, Optional[ParseMode]]:
+    from core.ai_core import decompose_with_ai, split_task_locally, with_deadline
+
+    task_text = job.payload["task_text"]
+    n = int(job.payload.get("n", 5))
+
+    main_task_id = job.payload.get("main_task_id")
+    if main_task_id is None:
+        progress = queue.progress(job, f"🤖 Анализирую задачу и разбиваю на {n} подзадач...")
+        streaming = True
+
+        async def on_partial(text: str):
+            # После чернового плана частичный ответ AI уже не показываем
+            if streaming:
+                await progress(text)
+
+        async def ai_subtasks() -> List[str]:
+            subtasks = []
+            # Разбиение на 5 шагов могло начаться, пока пользователь выбирал количество
+            speculation = take_speculation(job.chat_id, task_text)
+            if speculation is not None:
+                subtasks = await speculation
+                metrics.inc("decompose.speculation.hit" if len(subtasks) >= n else "decompose.speculation.short")
+            if len(subtasks) >= n:
+                return subtasks[:n]
+            return await decompose_with_ai(int(job.chat_id), task_text, max_subtasks=n, on_partial=on_partial)
+
+        # Поздний ответ AI заменит черновой план, когда тот уже доставлен
+        delivered = queue.delivered(job)
+
+        async def on_late(subtasks: List[str]):
+            if await delivered and job.payload.get("provisional"):
+                await _replace_provisional_subtasks(job, queue, job.payload["main_task_id"], subtasks)
+
+        subtasks, timed_out = await with_deadline(
+            ai_subtasks(), AI_DEADLINE_DECOMPOSE, site="decompose", on_late=on_late
+        )
+        streaming = False
+        if not subtasks and not timed_out:
+            # AI отказал сразу (нет токена, предохранитель, ошибка) - позднего ответа не будет
+            return "<b>❌ Не удалось разбить задачу.</b> Попробуйте позже или проверьте настройки AI.", ParseMode.HTML
+        # Черновой план только пока AI ещё думает: его ответ заменит план через on_late
+        provisional = timed_out
+        if provisional:
+            subtasks = split_task_locally(task_text, n)
+
+        # Задачи и отметка о них в job пишутся атомарно - повтор после сбоя не создаст дублей
+        async with in_transaction():
+            main_task = await Task.create(
+                chat_id=job.chat_id,
+                user_id=str(job.user_id),
+                text=task_text,
+                status="pending",
+                ai_generated=True
+            )
+            await Task.bulk_create([
+                Task(
+                    chat_id=job.chat_id,
+                    user_id=str(job.user_id),
+                    text=subtask_text,
+                    status="pending",
+                    parent_id=main_task.id,
+                    ai_generated=True
+                )
+                for subtask_text in subtasks
+            ])
+            job.payload = {**job.payload, "main_task_id": main_task.id, "provisional": provisional}
+            await job.save(update_fields=["payload", "updated_at"])
+        main_task_id = main_task.id
+
+    created_subtasks = await Task.filter(parent_id=main_task_id).order_by("id").values_list("text", flat=True)
+    return _decompose_reply(task_text, created_subtasks, job.payload.get("provisional", False)), ParseMode.HTML
+
+
+@job_handler("bulk_decompose")
+async def run_bulk_decompose(job: Job, queue: JobQueue) -> Tuple[str, Optional[ParseMode]]:
+    from core.ai_core import decompose_many
+
+    n = int(job.payload.get("n", 5))
+    task_ids = job.payload["task_ids"]
+
+    decomposed = job.payload.get("decomposed")
+    if decomposed is None:
+        tasks = await Task.filter(id__in=task_ids, chat_id=job.chat_id, status="pending")
+        # Задачи, которые уже успели разбить, не трогаем
+        with_subtasks = set(await Task.filter(parent_id__in=[t.id for t in tasks]).values_list("parent_id", flat=True))
+        tasks = sorted((t for t in tasks if t.id not in with_subtasks), key=lambda t: task_ids.index(t.id))
+        if not tasks:
+            return "Нет задач для разбиения: выбранные задачи уже выполнены или разбиты.", None
+
+        results = await decompose_many(int(job.chat_id), [t.text for t in tasks], max_subtasks=n)
+
+        # Все подзадачи и отметка о них в job пишутся одной транзакцией
+        async with in_transaction():
+            await Task.bulk_create([
+                Task(
+                    chat_id=job.chat_id,
+                    user_id=task.user_id,
+                    text=subtask_text,
+                    status="pending",
+                    parent_id=task.id,
+                    ai_generated=True
+                )
+                for task, subtasks in zip(tasks, results)
+                for subtask_text in subtasks
+            ])
+            decomposed = [task.id for task, subtasks in zip(tasks, results) if subtasks]
+            job.payload = {**job.payload, "decomposed": decomposed}
+            await job.save(update_fields=["payload", "updated_at"])
+
+    parents = {t.id: t for t in await Task.filter(id__in=task_ids)}
+    subtasks_by_parent: Dict[int, List[str]] = {}
+    for parent_id, text in await Task.filter(parent_id__in=decomposed).order_by("id").values_list("parent_id", "text"):
+        subtasks_by_parent.setdefault(parent_id, []).append(text)
+
+    result = [f"✅ Разбито задач: {len(decomposed)} из {len(task_ids)}"]
+    for task_id in decomposed:
+        if task_id not in parents:
+            continue
+        result += ["", f"📋 {parents[task_id].text}"]
+        result += [f"{i}. {sub}" for i, sub in enumerate(subtasks_by_parent.get(task_id, []), 1)]
+    skipped = [parents[task_id].text for task_id in task_ids if task_id not in decomposed and task_id in parents]
+    if skipped:
+        result += ["", "❌ Не удалось разбить:"] + [f"• {text}" for text in skipped]
+
+    text = "\n".join(result)
+    if len(text) > 3900:
+        text = text[:3900].rsplit("\n", 1)[0] + "\n…\nПолный список - в /list"
+    return text, None
+
+
+@job_handler("quarterly_report")
+async def run_quarterly_report(job: Job, queue: JobQueue) -> Tuple[str, Optional[ParseMode]]:
+    from core.reports import quarterly_report_service
+
+    header = "📊 Готовлю отчёт, 🤖 анализирую результаты..."
+    delivered = queue.delivered(job)
+
+    async def on_late(late_report: str):
+        # Отчёт с запасным анализом уже отправлен - заменяем его версией с ответом AI
+        if await delivered:
+            await queue.deliver(job, late_report, ParseMode.HTML)
+
+    report = await quarterly_report_service.generate_quarterly_report(
+        job.payload["user_id"], job.chat_id, job.payload.get("year"), job.payload.get("quarter"),
+        on_partial=queue.progress(job, header),
+        on_late=on_late,
+    )
+    return report, ParseMode.HTML
+
+
+def _book_reply(user_request: str, books: List[Dict]) -> Tuple[str, ParseMode, Optional[list]]:
+    """Подборка книг с кнопкой "📚 Ещё", если было что показать."""
+    from core.books import book_search_service
+
+    text = book_search_service.format_search_reply(user_request, books)
+    return text, ParseMode.HTML, [book_more_markup()] if books else None
+
+
+@job_handler("book_search")
+async def run_book_search(job: Job, queue: JobQueue) -> Tuple[str, ParseMode, Optional[list]]:
+    from core.books import book_search_service
+
+    user_request = job.payload["request"]
+    books = await book_search_service.search_books(user_request, max_results=BOOK_PAGE_SIZE, chat_id=job.chat_id)
+    return _book_reply(user_request, books)
+
+
+@job_handler("book_more")
+async def run_book_more(job: Job, queue: JobQueue) -> Tuple[str, Optional[ParseMode], Optional[list]]:
+    """Остаток подборки исчерпан - дозапрос источников для кнопки "📚 Ещё"."""
+    from core.books import book_search_service
+
+    user_request, books = await book_search_service.fetch_more(job.chat_id, BOOK_PAGE_SIZE)
+    if user_request is None:
+        return "⌛ Подборка устарела. Начните новый поиск: 📚 Подбор книг в главном меню.", None, None
+    if not books:
+        return f"📚 Больше ничего не нашёл по запросу \"{user_request}\". Попробуйте сформулировать иначе.", None, None
+    return _book_reply(user_request, books)
+
+
+# Глобальный экземпляр очереди, воркеры запускаются в main.py
+job_queue = JobQueue(workers=JOBS_WORKERS, timeout=JOBS_TIMEOUT)
@@ -46,6 +46,14 @@ def back_to_menu_markup():
     return builder.as_markup()
 
 
+def book_more_markup():
+    """Клавиатура под подборкой книг: следующая порция из того же запроса."""
+    builder = InlineKeyboardBuilder()
+    builder.row(CallbackButton(text="📚 Ещё", payload="book_more"))
+    builder.row(CallbackButton(text="◀️ Обратно в меню", payload="back_to_menu"))
+    return builder.as_markup()
+
+
 def action_menu_markup():
     builder = InlineKeyboardBuilder()
     builder.row(CallbackButton(text="✅ Отметить ещё", payload="cmd_done"))
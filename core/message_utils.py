@@ -1,16 +1,33 @@
 """
 Утилиты для управления сообщениями бота
 """
+import asyncio
 import logging
+from datetime import datetime, timedelta, timezone
 from typing import Dict, Optional
 
-# Простое хранилище для отслеживания последних сообщений по типу
-_last_messages: Dict[str, str] = {}
+from core.cache import TTLCache
+from core.config import (
+    MESSAGE_EDIT_WINDOW,
+    MESSAGE_REGISTRY_FLUSH_INTERVAL,
+    MESSAGE_REGISTRY_PERSIST,
+    MESSAGE_REGISTRY_SIZE,
+)
+from core.models import MessageRef
+from core.outbox import extract_message_id, outbox
+
+# Последние сообщения по типу: ограничены по числу и живут не дольше окна редактирования
+_last_messages = TTLCache(MESSAGE_REGISTRY_SIZE, MESSAGE_EDIT_WINDOW, name="message_registry")
+
+# Изменения, ещё не записанные в БД: ключ -> message_id (None - удаление)
+_dirty: Dict[str, Optional[str]] = {}
 
 def save_message_id(chat_id: str, message_type: str, message_id: str):
     """Сохранить ID сообщения для возможного редактирования"""
     key = f"{chat_id}_{message_type}"
-    _last_messages[key] = message_id
+    _last_messages.set(key, message_id)
+    if MESSAGE_REGISTRY_PERSIST:
+        _dirty[key] = message_id
     logging.debug(f"Saved message {message_id} for {message_type} in chat {chat_id}")
 
 def get_last_message_id(chat_id: str, message_type: str) -> Optional[str]:
@@ -22,8 +39,57 @@ def clear_message_id(chat_id: str, message_type: str):
     """Очистить сохраненный ID сообщения"""
     key = f"{chat_id}_{message_type}"
     _last_messages.pop(key, None)
+    if MESSAGE_REGISTRY_PERSIST:
+        _dirty[key] = None
     logging.debug(f"Cleared message for {message_type} in chat {chat_id}")
 
+async def load_message_registry() -> int:
+    """Загрузить из БД записи, которые ещё в окне редактирования (при старте бота)"""
+    now = datetime.now(timezone.utc)
+    cutoff = now - timedelta(seconds=MESSAGE_EDIT_WINDOW)
+    loaded = 0
+    try:
+        refs = await MessageRef.filter(updated_at__gte=cutoff).order_by("-updated_at").limit(MESSAGE_REGISTRY_SIZE)
+        # От давних к свежим, чтобы порядок LRU совпал с порядком записи
+        for ref in reversed(refs):
+            # Оставшееся время жизни считаем от момента записи, а не от загрузки
+            remaining = MESSAGE_EDIT_WINDOW - (now - ref.updated_at).total_seconds()
+            if remaining > 0:
+                _last_messages.set(ref.key, ref.message_id, ttl=remaining)
+                loaded += 1
+        await MessageRef.filter(updated_at__lt=cutoff).delete()
+    except Exception as e:
+        logging.error(f"Failed to load message registry: {e}")
+    return loaded
+
+async def flush_message_registry():
+    """Записать накопленные изменения реестра в БД"""
+    global _dirty
+    if not _dirty:
+        return
+    batch, _dirty = _dirty, {}
+    try:
+        removed = [key for key, message_id in batch.items() if message_id is None]
+        if removed:
+            await MessageRef.filter(key__in=removed).delete()
+        for key, message_id in batch.items():
+            if message_id is not None:
+                await MessageRef.update_or_create(key=key, defaults={"message_id": message_id})
+    except Exception as e:
+        logging.error(f"Failed to flush message registry: {e}")
+        # Не теряем изменения: более свежие записи из _dirty имеют приоритет
+        batch.update(_dirty)
+        _dirty = batch
+
+async def run_message_registry_flusher(interval: float = MESSAGE_REGISTRY_FLUSH_INTERVAL):
+    """Фоновая запись реестра в БД; при остановке сбрасывает остаток"""
+    try:
+        while True:
+            await asyncio.sleep(interval)
+            await flush_message_registry()
+    finally:
+        await flush_message_registry()
+
 async def smart_send_or_edit(bot, event, text: str, chat_id: str, message_type: str = "general", 
                            attachments=None, parse_mode=None) -> bool:
     """
@@ -47,7 +113,8 @@ async def smart_send_or_edit(bot, event, text: str, chat_id: str, message_type:
             if attachments:
                 kwargs["attachments"] = attachments
                 
-            await bot.edit_message(**kwargs)
+            await outbox.edit(chat_id, last_message_id, lambda: bot.edit_message(**kwargs),
+                              text=text, attachments=attachments, parse_mode=parse_mode)
             logging.debug(f"Successfully edited message {last_message_id}")
             return True
         except Exception as e:
@@ -63,14 +130,38 @@ async def smart_send_or_edit(bot, event, text: str, chat_id: str, message_type:
         if parse_mode:
             kwargs["parse_mode"] = parse_mode
             
-        sent_msg = await event.message.answer(**kwargs)
+        sent_msg = await outbox.send(chat_id, lambda: event.message.answer(**kwargs),
+                                     text=text, attachments=attachments, parse_mode=parse_mode)
         
         # Сохраняем ID нового сообщения для будущего редактирования
-        if hasattr(sent_msg, 'id'):
-            save_message_id(chat_id, message_type, sent_msg.id)
+        sent_id = extract_message_id(sent_msg)
+        if sent_id:
+            save_message_id(chat_id, message_type, sent_id)
         
         logging.debug(f"Sent new message for {message_type}")
         return False
     except Exception as e:
         logging.error(f"Failed to send message: {e}")
-        return False
\ No newline at end of file
+        return False
+
+def progress_editor(bot, message_id: Optional[str], chat_id: str, header: str, limit: int = 3500):
+    """
+    Колбэк для потоковых ответов AI: правит сообщение message_id текстом "header + частичный ответ".
+
+    Правки идут через outbox, поэтому промежуточные версии схлопываются,
+    а финальная правка того же сообщения всегда применяется последней.
+    """
+    async def on_partial(partial: str):
+        if not message_id:
+            return
+        # Держим хвост ответа - новое всегда видно, лимит длины сообщения не превышаем
+        body = partial if len(partial) <= limit else "…" + partial[-limit:]
+        text = f"{header}\n\n{body}"
+        try:
+            await outbox.edit(chat_id, message_id,
+                              lambda: bot.edit_message(message_id=message_id, text=text, attachments=[]),
+                              text=text, attachments=[])
+        except Exception as e:
+            logging.debug(f"Progress edit failed for {message_id}: {e}")
+
+    return on_partial
@@ -0,0 +1,85 @@
+"""
+Лёгкие внутрипроцессные метрики: счётчики, окна задержек и внешние источники.
+
+Снимок отдаётся HTTP-сервером бота на /metrics в виде JSON.
+"""
+import time
+from collections import deque
+from typing import Callable, Deque, Dict, List, Optional
+
+# Сколько последних наблюдений хранить на одну метрику задержки
+LATENCY_WINDOW = 2048
+
+_counters: Dict[str, float] = {}
+_latencies: Dict[str, Deque[float]] = {}
+_sources: Dict[str, Callable[[], Dict]] = {}
+_started_at = time.time()
+
+
+def inc(name: str, value: float = 1) -> None:
+    """Увеличить счётчик."""
+    _counters[name] = _counters.get(name, 0) + value
+
+
+def observe(name: str, seconds: float) -> None:
+    """Записать наблюдение задержки (в секундах)."""
+    window = _latencies.get(name)
+    if window is None:
+        window = _latencies[name] = deque(maxlen=LATENCY_WINDOW)
+    window.append(seconds)
+
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    """Перцентиль q (0..100) по списку значений, None для пустого списка."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    idx = min(len(ordered) - 1, max(0, int(round(q / 100 * (len(ordered) - 1)))))
+    return ordered[idx]
+
+
+def latency_percentile(name: str, q: float) -> Optional[float]:
+    """Перцентиль по текущему окну метрики задержки."""
+    window = _latencies.get(name)
+    if not window:
+        return None
+    return percentile(list(window), q)
+
+
+def latency_count(name: str) -> int:
+    """Сколько наблюдений в текущем окне метрики задержки."""
+    window = _latencies.get(name)
+    return len(window) if window else 0
+
+
+def register_source(name: str, fn: Callable[[], Dict]) -> None:
+    """Зарегистрировать функцию, которая возвращает словарь метрик компонента."""
+    _sources[name] = fn
+
+
+def snapshot() -> Dict:
+    """Собрать все метрики в один словарь."""
+    latencies = {}
+    for name, window in _latencies.items():
+        values = list(window)
+        latencies[name] = {
+            "count": len(values),
+            "p50": percentile(values, 50),
+            "p90": percentile(values, 90),
+            "p99": percentile(values, 99),
+            "max": max(values) if values else None,
+        }
+
+    sources = {}
+    for name, fn in _sources.items():
+        try:
+            sources[name] = fn()
+        except Exception as e:
+            sources[name] = {"error": str(e)}
+
+    return {
+        "uptime": round(time.time() - _started_at, 1),
+        "counters": dict(_counters),
+        "latency": latencies,
+        "sources": sources,
+    }
@@ -72,3 +72,74 @@ class MotivationSettings(Model):
 
     class Meta:
         table = "motivation_settings"
+
+
+class MessageRef(Model):
+    """Последнее сообщение бота данного типа в чате (реестр message_utils)."""
+    id = fields.IntField(pk=True)
+    key = fields.CharField(max_length=128, unique=True)  # f"{chat_id}_{message_type}"
+    message_id = fields.CharField(max_length=128)
+    updated_at = fields.DatetimeField(auto_now=True, index=True)
+
+    class Meta:
+        table = "message_refs"
+
+
+class ChatTurn(Model):
+    """Реплика диалога с AI (история core.chat_history)."""
+    id = fields.IntField(pk=True)
+    chat_id = fields.CharField(max_length=64, index=True)
+    role = fields.CharField(max_length=16)  # user, assistant
+    content = fields.TextField()
+    created_at = fields.DatetimeField(auto_now_add=True)
+
+    class Meta:
+        table = "chat_turns"
+
+
+class AchievementTitle(Model):
+    """Заготовленное AI-название достижения (пул для мгновенной выдачи)."""
+    id = fields.IntField(pk=True)
+    milestone = fields.IntField(index=True)
+    title = fields.CharField(max_length=200)
+    emoji = fields.CharField(max_length=10, default="🏆")
+    created_at = fields.DatetimeField(auto_now_add=True)
+
+    class Meta:
+        table = "achievement_titles"
+        unique_together = [("milestone", "title")]
+
+
+class Job(Model):
+    """Фоновая задача с долгой AI-операцией (очередь core.jobs)."""
+    id = fields.IntField(pk=True)
+    kind = fields.CharField(max_length=32, index=True)  # decompose, quarterly_report, book_search
+    chat_id = fields.CharField(max_length=64, index=True)
+    user_id = fields.CharField(max_length=64, null=True)
+    payload = fields.JSONField(default=dict)
+    status = fields.CharField(max_length=16, default="queued", index=True)  # queued, running, done, failed
+    idempotency_key = fields.CharField(max_length=128, unique=True, null=True)
+    message_id = fields.CharField(max_length=128, null=True)  # сообщение-заглушка, куда придёт результат
+    attempts = fields.IntField(default=0)
+    max_attempts = fields.IntField(default=3)
+    run_after = fields.DatetimeField(null=True, index=True)
+    result = fields.TextField(null=True)
+    error = fields.TextField(null=True)
+    created_at = fields.DatetimeField(auto_now_add=True)
+    updated_at = fields.DatetimeField(auto_now=True)
+
+    class Meta:
+        table = "jobs"
+
+
+class CacheEntry(Model):
+    """Запись кэша, сохранённая на диск (PersistentCache из core.cache)."""
+    id = fields.IntField(pk=True)
+    namespace = fields.CharField(max_length=32)
+    key = fields.CharField(max_length=64)  # sha1 от ключа кэша
+    value = fields.JSONField()
+    expires_at = fields.DatetimeField(index=True)
+
+    class Meta:
+        table = "cache_entries"
+        unique_together = [("namespace", "key")]
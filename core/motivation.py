@@ -3,7 +3,9 @@ from enum import Enum
 from typing import Optional
 from datetime import datetime
 from core.models import Task, MotivationSettings
-from core.ai_core import get_response
+from core.ai_core import complete, with_deadline
+from core.ai_gateway import Priority
+from core.config import AI_DEADLINE_MOTIVATION
 
 logger = logging.getLogger(__name__)
 
@@ -57,11 +59,20 @@ async def generate_motivation_message(
         f"Всего выполнено {completed_count} задач. "
     )
     
-    system_prompt = STYLE_PROMPTS[style]
-    full_prompt = f"{system_prompt}\n\n{context}"
-    
     try:
-        message = await get_response(int(chat_id), full_prompt)
+        message, _ = await with_deadline(
+            complete(
+                context,
+                system=STYLE_PROMPTS[style],
+                temperature=0.9,
+                priority=Priority.BACKGROUND,
+                site="motivation",
+            ),
+            AI_DEADLINE_MOTIVATION,
+            site="motivation",
+        )
+        if not message:
+            return get_fallback_message(task_count, style)
         return message
     except Exception:
         logger.exception("Failed to generate motivation message")
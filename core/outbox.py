@@ -0,0 +1,234 @@
+"""
+Очередь исходящих сообщений: коалесценция правок, ограничение частоты и повторы.
+
+Отправки и правки из message_utils и callbacks проходят через общий экземпляр outbox:
+- в пределах чата операции выполняются по порядку;
+- ожидающая правка того же сообщения заменяется более новой (last-writer-wins);
+- правка без изменений текста и разметки не уходит в API;
+- соблюдаются глобальный и початовый лимиты, 429/5xx повторяются с backoff.
+"""
+import asyncio
+import hashlib
+import logging
+import random
+import time
+from collections import OrderedDict, deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional
+
+from aiohttp import ClientError
+from maxapi.exceptions.max import MaxConnection
+from maxapi.types.errors import Error
+
+from core import metrics
+from core.config import OUTBOX_CHAT_BURST, OUTBOX_CHAT_RATE, OUTBOX_GLOBAL_RATE, OUTBOX_MAX_RETRIES
+from core.limits import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+
+ApiCall = Callable[[], Awaitable[Any]]
+
+
+class OutboundError(Exception):
+    """Вызов MAX API не удался (в том числе после всех повторов)."""
+
+    def __init__(self, message: str, error: Optional[Error] = None):
+        super().__init__(message)
+        self.error = error
+
+
+def extract_message_id(obj: Any) -> Optional[str]:
+    """mid сообщения из Message, SendedMessage или похожего объекта."""
+    for path in (("message", "body", "mid"), ("body", "mid"), ("mid",), ("id",)):
+        value = obj
+        for attr in path:
+            value = getattr(value, attr, None)
+            if value is None:
+                break
+        if isinstance(value, (str, int)):
+            return str(value)
+    return None
+
+
+def content_fingerprint(text: Optional[str], attachments=None, parse_mode=None) -> str:
+    """Отпечаток содержимого сообщения: текст, разметка и режим форматирования."""
+    parts = [text or "", repr(parse_mode)]
+    for attachment in attachments or []:
+        dump = getattr(attachment, "model_dump_json", None)
+        parts.append(dump() if callable(dump) else repr(attachment))
+    return hashlib.sha1("\x00".join(parts).encode("utf-8")).hexdigest()
+
+
+class _Operation:
+    __slots__ = ("key", "call", "fingerprint", "futures")
+
+    def __init__(self, key: Optional[str], call: ApiCall, fingerprint: str, future: asyncio.Future):
+        self.key = key
+        self.call = call
+        self.fingerprint = fingerprint
+        self.futures: List[asyncio.Future] = [future]
+
+
+class OutboundQueue:
+    """Поочерёдная отправка в MAX API с коалесценцией правок и лимитами частоты."""
+
+    def __init__(self, global_rate: float = 25, chat_rate: float = 2, chat_burst: float = 4,
+                 max_retries: int = 4, base_delay: float = 0.5, max_delay: float = 8.0,
+                 applied_size: int = 5000):
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.applied_size = applied_size
+
+        self._queues: Dict[str, Deque[_Operation]] = {}
+        self._pending: Dict[str, _Operation] = {}  # ключ правки -> операция, ещё не взятая в работу
+        self._workers: Dict[str, asyncio.Task] = {}
+        self._chat_buckets: "OrderedDict[str, TokenBucket]" = OrderedDict()
+        self._applied: "OrderedDict[str, str]" = OrderedDict()  # ключ правки -> отпечаток в MAX
+        self._paused_until = 0.0
+
+        metrics.register_source("outbox", self.stats)
+
+    async def edit(self, chat_id, message_id: str, call: ApiCall, text: Optional[str] = None,
+                   attachments=None, parse_mode=None) -> Any:
+        """
+        Поставить правку сообщения в очередь.
+
+        Returns:
+            Результат вызова API или None, если содержимое не изменилось.
+
+        Raises:
+            OutboundError: если MAX API вернул ошибку.
+        """
+        fingerprint = content_fingerprint(text, attachments, parse_mode)
+        return await self._submit(str(chat_id), f"edit:{message_id}", call, fingerprint)
+
+    async def send(self, chat_id, call: ApiCall, text: Optional[str] = None,
+                   attachments=None, parse_mode=None) -> Any:
+        """Поставить отправку нового сообщения в очередь. Ошибки - как у edit."""
+        fingerprint = content_fingerprint(text, attachments, parse_mode)
+        return await self._submit(str(chat_id), None, call, fingerprint)
+
+    async def _submit(self, chat_id: str, key: Optional[str], call: ApiCall, fingerprint: str) -> Any:
+        future = asyncio.get_running_loop().create_future()
+
+        pending = self._pending.get(key) if key else None
+        if pending is not None:
+            # Last-writer-wins: ждущая правка того же сообщения получает новое содержимое
+            pending.call = call
+            pending.fingerprint = fingerprint
+            pending.futures.append(future)
+            metrics.inc("outbox.coalesced")
+            return await future
+
+        operation = _Operation(key, call, fingerprint, future)
+        if key:
+            self._pending[key] = operation
+        self._queues.setdefault(chat_id, deque()).append(operation)
+        if chat_id not in self._workers:
+            self._workers[chat_id] = asyncio.create_task(self._run_chat(chat_id))
+        return await future
+
+    async def _run_chat(self, chat_id: str) -> None:
+        queue = self._queues[chat_id]
+        try:
+            while queue:
+                operation = queue.popleft()
+                if operation.key:
+                    self._pending.pop(operation.key, None)
+                try:
+                    result = await self._execute(chat_id, operation)
+                except Exception as e:
+                    for future in operation.futures:
+                        if not future.done():
+                            future.set_exception(e)
+                else:
+                    for future in operation.futures:
+                        if not future.done():
+                            future.set_result(result)
+        finally:
+            self._workers.pop(chat_id, None)
+            if not queue:
+                self._queues.pop(chat_id, None)
+
+    def _chat_bucket(self, chat_id: str) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = self._chat_buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+            if len(self._chat_buckets) > self.applied_size:
+                self._chat_buckets.popitem(last=False)
+        else:
+            self._chat_buckets.move_to_end(chat_id)
+        return bucket
+
+    async def _execute(self, chat_id: str, operation: _Operation) -> Any:
+        if operation.key and self._applied.get(operation.key) == operation.fingerprint:
+            metrics.inc("outbox.skipped_unchanged")
+            return None
+
+        bucket = self._chat_bucket(chat_id)
+        for attempt in range(self.max_retries + 1):
+            await bucket.acquire()
+            pause = self._paused_until - time.monotonic()
+            if pause > 0:
+                await asyncio.sleep(pause)
+            await self.global_bucket.acquire()
+
+            started = time.perf_counter()
+            try:
+                result = await operation.call()
+                error = result if isinstance(result, Error) else None
+            except (MaxConnection, ClientError, asyncio.TimeoutError) as e:
+                result, error = None, e
+            metrics.inc("outbox.calls")
+            metrics.observe("outbox.call", time.perf_counter() - started)
+
+            if error is None:
+                self._remember(operation, result)
+                return result
+
+            status = error.code if isinstance(error, Error) else None
+            retryable = status in RETRYABLE_STATUSES or not isinstance(error, Error)
+            if not retryable or attempt == self.max_retries:
+                metrics.inc("outbox.failed")
+                raise OutboundError(f"MAX API call failed: {error}", error if isinstance(error, Error) else None)
+
+            delay = min(self.max_delay, self.base_delay * 2 ** attempt) * (1 + random.random() * 0.25)
+            if status == 429:
+                # 429 - лимит на весь бот, притормаживаем все чаты
+                self._paused_until = max(self._paused_until, time.monotonic() + delay)
+            metrics.inc("outbox.retries")
+            logger.debug(f"Outbound call failed ({error}), retry in {delay:.2f}s")
+            await asyncio.sleep(delay)
+
+    def _remember(self, operation: _Operation, result: Any) -> None:
+        key = operation.key
+        if key is None:
+            message_id = extract_message_id(result)
+            key = f"edit:{message_id}" if message_id else None
+        if key is None:
+            return
+        self._applied[key] = operation.fingerprint
+        self._applied.move_to_end(key)
+        while len(self._applied) > self.applied_size:
+            self._applied.popitem(last=False)
+
+    def stats(self) -> Dict:
+        return {
+            "queued": sum(len(q) for q in self._queues.values()),
+            "active_chats": len(self._workers),
+            "tracked_messages": len(self._applied),
+        }
+
+
+# Глобальный экземпляр очереди
+outbox = OutboundQueue(
+    global_rate=OUTBOX_GLOBAL_RATE,
+    chat_rate=OUTBOX_CHAT_RATE,
+    chat_burst=OUTBOX_CHAT_BURST,
+    max_retries=OUTBOX_MAX_RETRIES,
+)
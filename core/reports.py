@@ -2,16 +2,88 @@
 Модуль для генерации поквартальных отчётов о прогрессе пользователей.
 """
 import logging
+import re
 from datetime import datetime, timedelta
-from typing import Dict, List, Optional, Tuple
+from typing import AsyncIterator, Dict, Iterable, List, Optional, Tuple
 from tortoise import Tortoise
+from tortoise.expressions import Q
+from tortoise.functions import Count
 from core.models import Task, UserSettings, Achievement
-from core.ai_core import get_response
+from core.ai_core import SYSTEM_PROMPT, complete, stream_complete, with_deadline
+from core.config import AI_DEADLINE_INSIGHTS
+
+logger = logging.getLogger(__name__)
+
+# Ключевые слова категорий задач. Порядок важен: задача попадает в первую совпавшую категорию
+CATEGORY_KEYWORDS = {
+    "Работа": ["работа", "работать", "проект", "встреча", "отчёт", "презентация", "дедлайн", "задача", "клиент", 
+              "совещание", "документ", "план", "анализ", "разработка", "тестирование", "код", "программирование",
+              "email", "звонок", "переговоры", "контракт", "продажи", "маркетинг", "реклама"],
+    "Учёба": ["учёба", "учиться", "экзамен", "лекция", "курс", "диплом", "учебник", "изучить", "выучить",
+             "университет", "институт", "школа", "конспект", "домашка", "семинар", "практика", "стажировка",
+             "образование", "знания", "навыки", "сертификат", "тест", "контрольная"],
+    "Здоровье": ["спорт", "тренировка", "врач", "здоровье", "зал", "бег", "йога", "диета", "фитнес",
+                "больница", "поликлиника", "лечение", "таблетки", "витамины", "массаж", "зубы", "стоматолог",
+                "анализы", "обследование", "прививка", "медицина", "велосипед", "плавание"],
+    "Личное": ["семья", "друзья", "отношения", "свидание", "день рождения", "праздник", "родители", "дети",
+              "любовь", "романтика", "подарок", "поздравить", "встретиться", "пообщаться", "выходные",
+              "отдых", "путешествие", "поездка", "отпуск", "развлечения"],
+    "Хобби": ["хобби", "творчество", "рисование", "музыка", "фото", "игра", "фильм", "книга", "чтение",
+             "рукоделие", "вязание", "коллекция", "гитара", "пианино", "театр", "кино", "сериал",
+             "живопись", "скульптура", "танцы", "пение", "писать", "блог", "социальные сети"],
+    "Дом": ["дом", "дома", "уборка", "покупки", "ремонт", "готовка", "стирка", "растения", "питомец",
+           "квартира", "кухня", "ванная", "спальня", "мебель", "техника", "электричество", "сантехника",
+           "кот", "собака", "цветы", "сад", "огород", "магазин", "продукты", "еда", "приготовить"]
+}
+
+CATEGORIES = list(CATEGORY_KEYWORDS) + ["Прочее"]
+
+
+def _keywords_pattern(keywords: List[str]) -> str:
+    """
+    Регулярное выражение "любое из слов" в виде префиксного дерева: "кот|кухня" -> "к(?:от|ухня)".
+    Движок re не перебирает слова по одному, а идёт по общим префиксам. Слово, которое
+    продолжает другое ("дома" после "дом"), отбрасывается - для поиска подстроки хватает короткого.
+    """
+    trie: Dict = {}
+    for keyword in keywords:
+        node = trie
+        for char in keyword:
+            node = node.setdefault(char, {})
+        node[""] = {}
+
+    def build(node: Dict) -> str:
+        if "" in node:
+            return ""
+        branches = [re.escape(char) + build(child) for char, child in sorted(node.items())]
+        return branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+
+    return build(trie)
+
+
+# По регулярному выражению на категорию, собираются один раз при импорте.
+# Совпадение - по подстроке, как при прежней проверке "kw in text"
+CATEGORY_PATTERNS = [
+    (category, re.compile(_keywords_pattern(keywords)))
+    for category, keywords in CATEGORY_KEYWORDS.items()
+]
+
+
+def categorize_text(text: str) -> str:
+    """Категория задачи: первая по порядку категория, чьё ключевое слово встречается в тексте."""
+    task_text = text.lower()
+    for category, pattern in CATEGORY_PATTERNS:
+        if pattern.search(task_text):
+            return category
+    return "Прочее"
 
 
 class QuarterlyReportService:
     """Сервис для создания поквартальных отчётов о прогрессе."""
 
+    # По сколько текстов задач читать из БД при категоризации
+    TEXT_BATCH_SIZE = 500
+
     def __init__(self):
         self.quarters = {
             1: {"months": [1, 2, 3], "name": "I квартал"},
@@ -51,39 +123,28 @@ class QuarterlyReportService:
         """Собирает статистику по задачам за квартал."""
         start_date, end_date = self.get_quarter_date_range(year, quarter)
         
-        # Импортируем Q для создания OR запросов
-        from tortoise.expressions import Q
-        
-        # Задачи, созданные в квартале - ищем по user_id ИЛИ chat_id
-        created_tasks = await Task.filter(
-            Q(user_id=user_id) | Q(chat_id=chat_id),
-            created_at__gte=start_date,
-            created_at__lte=end_date
-        ).all()
-        
-        # Задачи, завершённые в квартале  
-        completed_tasks = await Task.filter(
-            Q(user_id=user_id) | Q(chat_id=chat_id),
-            status="done",
-            updated_at__gte=start_date,
-            updated_at__lte=end_date
-        ).all()
-        
-        # Просроченные задачи в квартале
-        expired_tasks = await Task.filter(
-            Q(user_id=user_id) | Q(chat_id=chat_id),
-            status="expired",
-            expired_at__gte=start_date,
-            expired_at__lte=end_date
-        ).all()
-        
-        # Анализируем категории задач (простая категоризация по ключевым словам)
-        categories = self._categorize_tasks(created_tasks)
-        
-        # Считаем показатели продуктивности
-        total_created = len(created_tasks)
-        total_completed = len(completed_tasks)
-        total_expired = len(expired_tasks)
+        # Задачи пользователя - ищем по user_id ИЛИ chat_id
+        owner = Q(user_id=user_id) | Q(chat_id=chat_id)
+        created = Q(created_at__gte=start_date, created_at__lte=end_date)
+        completed = Q(status="done", updated_at__gte=start_date, updated_at__lte=end_date)
+        expired = Q(status="expired", expired_at__gte=start_date, expired_at__lte=end_date)
+        
+        # Созданные, завершённые и просроченные в квартале - одним запросом с условными COUNT
+        counts = await Task.filter(owner, created | completed | expired).annotate(
+            total_created=Count("id", _filter=created),
+            total_completed=Count("id", _filter=completed),
+            total_expired=Count("id", _filter=expired),
+        ).first().values("total_created", "total_completed", "total_expired")
+        total_created = counts["total_created"] if counts else 0
+        total_completed = counts["total_completed"] if counts else 0
+        total_expired = counts["total_expired"] if counts else 0
+        
+        # Анализируем категории задач (простая категоризация по ключевым словам):
+        # тексты читаются порциями, в памяти не больше одной порции
+        categories = None
+        async for texts in self._iter_task_texts(Q(owner, created)):
+            categories = self._categorize_tasks(texts, categories)
+        categories = categories or self._categorize_tasks([])
         
         completion_rate = (total_completed / total_created * 100) if total_created > 0 else 0
         
@@ -101,67 +162,39 @@ class QuarterlyReportService:
             "total_expired": total_expired,
             "completion_rate": round(completion_rate, 1),
             "categories": categories,
-            "created_tasks": created_tasks,
-            "completed_tasks": completed_tasks
         }
 
-    def _categorize_tasks(self, tasks: List[Task]) -> Dict[str, int]:
-        """Простая категоризация задач по ключевым словам."""
-        categories = {
-            "Работа": 0,
-            "Учёба": 0,
-            "Здоровье": 0,
-            "Личное": 0,
-            "Хобби": 0,
-            "Дом": 0,
-            "Прочее": 0
-        }
-        
-        category_keywords = {
-            "Работа": ["работа", "работать", "проект", "встреча", "отчёт", "презентация", "дедлайн", "задача", "клиент", 
-                      "совещание", "документ", "план", "анализ", "разработка", "тестирование", "код", "программирование",
-                      "email", "звонок", "переговоры", "контракт", "продажи", "маркетинг", "реклама"],
-            "Учёба": ["учёба", "учиться", "экзамен", "лекция", "курс", "диплом", "учебник", "изучить", "выучить",
-                     "университет", "институт", "школа", "конспект", "домашка", "семинар", "практика", "стажировка",
-                     "образование", "знания", "навыки", "сертификат", "тест", "контрольная"],
-            "Здоровье": ["спорт", "тренировка", "врач", "здоровье", "зал", "бег", "йога", "диета", "фитнес",
-                        "больница", "поликлиника", "лечение", "таблетки", "витамины", "массаж", "зубы", "стоматолог",
-                        "анализы", "обследование", "прививка", "медицина", "велосипед", "плавание"],
-            "Личное": ["семья", "друзья", "отношения", "свидание", "день рождения", "праздник", "родители", "дети",
-                      "любовь", "романтика", "подарок", "поздравить", "встретиться", "пообщаться", "выходные",
-                      "отдых", "путешествие", "поездка", "отпуск", "развлечения"],
-            "Хобби": ["хобби", "творчество", "рисование", "музыка", "фото", "игра", "фильм", "книга", "чтение",
-                     "рукоделие", "вязание", "коллекция", "гитара", "пианино", "театр", "кино", "сериал",
-                     "живопись", "скульптура", "танцы", "пение", "писать", "блог", "социальные сети"],
-            "Дом": ["дом", "дома", "уборка", "покупки", "ремонт", "готовка", "стирка", "растения", "питомец",
-                   "квартира", "кухня", "ванная", "спальня", "мебель", "техника", "электричество", "сантехника",
-                   "кот", "собака", "цветы", "сад", "огород", "магазин", "продукты", "еда", "приготовить"]
-        }
-        
-        # Для отладки - сохраняем детали категоризации
-        categorization_details = []
-        
-        for task in tasks:
-            task_text = task.text.lower()
-            categorized = False
-            
-            for category, keywords in category_keywords.items():
-                matched_keywords = [kw for kw in keywords if kw in task_text]
-                if matched_keywords:
-                    categories[category] += 1
-                    categorized = True
-                    categorization_details.append(f"'{task.text[:30]}...' → {category} (ключевые слова: {matched_keywords[:3]})")
-                    break
-            
-            if not categorized:
-                categories["Прочее"] += 1
-                categorization_details.append(f"'{task.text[:30]}...' → Прочее (не найдено ключевых слов)")
-        
-        # Логируем детали категоризации для отладки
-        if categorization_details:
-            logging.info(f"Task categorization details:")
-            for detail in categorization_details:
-                logging.info(f"  {detail}")
+    async def _iter_task_texts(self, condition: Q) -> AsyncIterator[List[str]]:
+        """Тексты подходящих задач порциями по TEXT_BATCH_SIZE (пагинация по id, без OFFSET)."""
+        last_id = 0
+        while True:
+            rows = await Task.filter(condition, id__gt=last_id).order_by("id").limit(
+                self.TEXT_BATCH_SIZE
+            ).values_list("id", "text")
+            if not rows:
+                return
+            yield [text for _, text in rows]
+            if len(rows) < self.TEXT_BATCH_SIZE:
+                return
+            last_id = rows[-1][0]
+
+    def _categorize_tasks(self, texts: Iterable[str], categories: Optional[Dict[str, int]] = None) -> Dict[str, int]:
+        """
+        Простая категоризация задач по ключевым словам.
+        Переданный categories дополняется - так счётчики копятся по порциям текстов.
+        """
+        if categories is None:
+            categories = dict.fromkeys(CATEGORIES, 0)
+        
+        # Детали категоризации нужны только при отладке - не собираем их без DEBUG
+        debug = logger.isEnabledFor(logging.DEBUG)
+        for text in texts:
+            category = categorize_text(text)
+            categories[category] += 1
+            if debug:
+                task_text = text.lower()
+                matched_keywords = [kw for kw in CATEGORY_KEYWORDS.get(category, []) if kw in task_text]
+                logger.debug(f"'{text[:30]}...' → {category} (ключевые слова: {matched_keywords[:3] or 'не найдены'})")
                 
         return categories
 
@@ -175,8 +208,13 @@ class QuarterlyReportService:
         
         return [f"🏆 {achievement.title}" for achievement in achievements]
 
-    async def generate_ai_insights(self, stats: Dict) -> str:
-        """Генерирует AI-анализ прогресса пользователя."""
+    async def generate_ai_insights(self, stats: Dict, on_partial=None, on_late=None) -> str:
+        """
+        Генерирует AI-анализ прогресса пользователя.
+
+        Если AI не ответил за AI_DEADLINE_INSIGHTS секунд, возвращается запасной анализ,
+        а поздний ответ AI передаётся в on_late (если задан).
+        """
         prompt = f"""
 Проанализируй результаты пользователя за {stats['quarter_name']} {stats['year']} года и дай конструктивные советы.
 
@@ -197,34 +235,45 @@ class QuarterlyReportService:
 Отвечай на русском языке, дружелюбным тоном.
 """
         
+        streaming = True
+
+        async def partial(text: str):
+            # После запасного ответа частичный текст AI уже не показываем
+            if streaming:
+                await on_partial(text)
+
         try:
-            response = await get_response(12345, prompt)  # Используем фиктивный chat_id для системных запросов
-            return response.strip()
+            # Выводы пишет Кузя - с тем же системным промптом, что и в чате
+            system = SYSTEM_PROMPT["content"]
+            if on_partial is not None:
+                call = stream_complete(prompt, partial, system=system, temperature=0.7, site="report_insights")
+            else:
+                call = complete(prompt, system=system, temperature=0.7, site="report_insights")
+            response, _ = await with_deadline(call, AI_DEADLINE_INSIGHTS, site="report_insights", on_late=on_late)
+            streaming = False
+            if not response:
+                return self._get_fallback_insights(stats)
+            return response
         except Exception as e:
             logging.error(f"Error generating AI insights: {e}")
             return self._get_fallback_insights(stats)
 
     async def debug_user_tasks(self, user_id: str, chat_id: str) -> Dict:
         """Отладочная функция для проверки всех задач пользователя."""
-        from tortoise.expressions import Q
+        owner = Q(user_id=user_id) | Q(chat_id=chat_id)
         
-        # Все задачи пользователя
-        all_tasks = await Task.filter(
-            Q(user_id=user_id) | Q(chat_id=chat_id)
-        ).all()
+        # Группируем по статусу на стороне БД
+        rows = await Task.filter(owner).annotate(count=Count("id")).group_by("status").values("status", "count")
+        by_status = {row["status"]: row["count"] for row in rows}
         
-        # Группируем по статусу
-        by_status = {}
-        for task in all_tasks:
-            status = task.status
-            if status not in by_status:
-                by_status[status] = []
-            by_status[status].append(task)
+        # Последние 10
+        last_tasks = await Task.filter(owner).order_by("-id").limit(10).values_list("id", "text", "status", "created_at")
         
         return {
-            "total_tasks": len(all_tasks),
-            "by_status": {status: len(tasks) for status, tasks in by_status.items()},
-            "tasks_info": [(task.id, task.text, task.status, task.created_at.strftime("%Y-%m-%d")) for task in all_tasks[-10:]]  # Последние 10
+            "total_tasks": sum(by_status.values()),
+            "by_status": by_status,
+            "tasks_info": [(task_id, text, status, created_at.strftime("%Y-%m-%d"))
+                           for task_id, text, status, created_at in reversed(last_tasks)]
         }
 
     def _get_fallback_insights(self, stats: Dict) -> str:
@@ -294,8 +343,14 @@ class QuarterlyReportService:
         
         return report
 
-    async def generate_quarterly_report(self, user_id: str, chat_id: str, year: Optional[int] = None, quarter: Optional[int] = None) -> str:
-        """Генерирует полный поквартальный отчёт."""
+    async def generate_quarterly_report(self, user_id: str, chat_id: str, year: Optional[int] = None, quarter: Optional[int] = None,
+                                        on_partial=None, on_late=None) -> str:
+        """
+        Генерирует полный поквартальный отчёт.
+
+        on_partial - колбэк для частичного текста AI-анализа, пока он генерируется.
+        on_late - колбэк для отчёта с AI-анализом, если тот опоздал и в отчёт попал запасной.
+        """
         if year is None or quarter is None:
             current_quarter, _ = self.get_current_quarter()
             year = year or datetime.now().year
@@ -310,7 +365,12 @@ class QuarterlyReportService:
             achievements = await self.get_achievements_for_period(chat_id, start_date, end_date)
             
             # Генерируем AI-анализ
-            insights = await self.generate_ai_insights(stats)
+            async def insights_arrived(late_insights: str):
+                await on_late(self.format_report(stats, achievements, late_insights))
+
+            insights = await self.generate_ai_insights(
+                stats, on_partial, on_late=insights_arrived if on_late is not None else None
+            )
             
             # Формируем итоговый отчёт
             report = self.format_report(stats, achievements, insights)
@@ -1,2 +1,41 @@
 """Shared runtime state for the bot."""
+import asyncio
+from typing import Awaitable, Dict, Optional, Tuple
+
 awaiting_actions = {}
+
+# Спекулятивные разбиения задач, запущенные до выбора числа подзадач:
+# chat_id -> (текст задачи, asyncio.Task, таймер отмены)
+speculative_decompositions: Dict[str, Tuple[str, asyncio.Task, asyncio.TimerHandle]] = {}
+
+
+def start_speculation(chat_id, task_text: str, coro: Awaitable, ttl: float) -> asyncio.Task:
+    """Запустить спекулятивное разбиение; брошенное дольше ttl секунд отменяется."""
+    key = str(chat_id)
+    cancel_speculation(key)
+    task = asyncio.ensure_future(coro)
+    timer = asyncio.get_running_loop().call_later(ttl, cancel_speculation, key)
+    speculative_decompositions[key] = (task_text, task, timer)
+    return task
+
+
+def take_speculation(chat_id, task_text: str) -> Optional[asyncio.Task]:
+    """Забрать спекулятивное разбиение чата, если оно для того же текста задачи."""
+    entry = speculative_decompositions.pop(str(chat_id), None)
+    if entry is None:
+        return None
+    spec_text, task, timer = entry
+    timer.cancel()
+    if spec_text != task_text:
+        task.cancel()
+        return None
+    return task
+
+
+def cancel_speculation(chat_id) -> None:
+    """Отменить спекулятивное разбиение чата (сценарий брошен или начат заново)."""
+    entry = speculative_decompositions.pop(str(chat_id), None)
+    if entry is not None:
+        _, task, timer = entry
+        timer.cancel()
+        task.cancel()
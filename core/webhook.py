@@ -0,0 +1,252 @@
+"""
+HTTP-сервер бота на aiohttp: приём обновлений через вебхук, health/readiness и метрики.
+
+В режиме webhook обновления приходят POST-запросом, проверяются, дедуплицируются
+и передаются в тот же Dispatcher, что и при long polling.
+"""
+import asyncio
+import hashlib
+import hmac
+import json
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Set
+
+from aiohttp import web
+from maxapi.methods.types.getted_updates import UPDATE_MODEL_MAPPING
+from maxapi.utils.updates import enrich_event
+
+from core import metrics
+from core.config import UPDATES_RECORD_PATH, WEBHOOK_PATH, WEBHOOK_SECRET, WEBHOOK_URL
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = "X-Max-Bot-Api-Secret"
+
+
+class UpdateDeduplicator:
+    """Помнит ключи недавних обновлений, чтобы отбрасывать повторные доставки."""
+
+    def __init__(self, max_size: int = 10000, ttl: float = 600):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._seen: "OrderedDict[str, float]" = OrderedDict()
+
+    def seen(self, key: str) -> bool:
+        """True, если ключ уже встречался; иначе запоминает его."""
+        now = time.monotonic()
+        # Ключи упорядочены по времени вставки: чистим устаревшие и лишние с головы
+        while self._seen:
+            _, ts = next(iter(self._seen.items()))
+            if now - ts < self.ttl and len(self._seen) < self.max_size:
+                break
+            self._seen.popitem(last=False)
+
+        if key in self._seen:
+            return True
+        self._seen[key] = now
+        return False
+
+
+def validate_update(update: Any) -> Optional[str]:
+    """Проверка формы обновления. Возвращает описание ошибки или None."""
+    if not isinstance(update, dict):
+        return "update must be a JSON object"
+    if not isinstance(update.get("update_type"), str):
+        return "missing update_type"
+    if update["update_type"] not in UPDATE_MODEL_MAPPING:
+        return f"unknown update_type: {update['update_type']}"
+    if not isinstance(update.get("timestamp"), int):
+        return "missing timestamp"
+    return None
+
+
+def update_key(update: Dict[str, Any]) -> str:
+    """
+    Ключ идемпотентности обновления.
+
+    Сквозного update_id у обновлений MAX нет, поэтому ключ собирается из типа,
+    идентификатора объекта (callback_id или mid сообщения) и timestamp.
+    """
+    update_type = update.get("update_type")
+    timestamp = update.get("timestamp")
+
+    callback_id = (update.get("callback") or {}).get("callback_id")
+    if callback_id:
+        return f"{update_type}:{callback_id}:{timestamp}"
+
+    mid = ((update.get("message") or {}).get("body") or {}).get("mid")
+    if mid:
+        return f"{update_type}:{mid}:{timestamp}"
+
+    raw = json.dumps(update, sort_keys=True, ensure_ascii=False, default=str)
+    return f"{update_type}:{hashlib.sha1(raw.encode('utf-8')).hexdigest()}"
+
+
+def _record_update(event_object) -> None:
+    """Дописать обновление в UPDATES_RECORD_PATH (JSONL) для последующего воспроизведения."""
+    try:
+        raw = event_object.model_dump(mode="json")
+        with open(UPDATES_RECORD_PATH, "a", encoding="utf-8") as f:
+            f.write(json.dumps(raw, ensure_ascii=False) + "\n")
+    except Exception as e:
+        logger.debug(f"Failed to record update: {e}")
+
+
+def instrument_dispatcher(dp, mode: str) -> None:
+    """
+    Оборачивает dp.handle метриками с меткой режима получения обновлений.
+
+    updates.lag.<mode> - от timestamp обновления на стороне MAX до начала обработки,
+    updates.handle.<mode> - время работы обработчиков. По ним сравниваются
+    polling и webhook на одном и том же боте.
+    """
+    original_handle = dp.handle
+
+    async def handle(event_object):
+        started = time.time()
+        ts = getattr(event_object, "timestamp", None)
+        if isinstance(ts, (int, float)) and ts > 0:
+            metrics.observe(f"updates.lag.{mode}", max(0.0, started - ts / 1000))
+        metrics.inc(f"updates.received.{mode}")
+        if UPDATES_RECORD_PATH:
+            _record_update(event_object)
+        try:
+            await original_handle(event_object)
+        finally:
+            metrics.observe(f"updates.handle.{mode}", time.time() - started)
+
+    dp.handle = handle
+
+
+async def prepare_dispatcher(dp, bot) -> None:
+    """
+    Подготовка диспетчера без запуска polling: привязка бота, check_me, on_started.
+
+    В maxapi это делает приватный Dispatcher.__ready внутри start_polling/handle_webhook;
+    публичного аналога для собственного сервера нет. Проверено на maxapi==0.9.7
+    (версия закреплена в requirements.txt).
+    """
+    ready = getattr(dp, "_Dispatcher__ready", None)
+    if ready is None:
+        raise RuntimeError(
+            "maxapi Dispatcher has no private __ready method (tested with maxapi==0.9.7); "
+            "install the version pinned in requirements.txt or update core/webhook.prepare_dispatcher"
+        )
+    await ready(bot)
+
+
+class UpdateServer:
+    """aiohttp-сервер: вебхук (если передан dispatcher), /healthz, /readyz и /metrics."""
+
+    def __init__(self, bot, dp=None, host: str = "0.0.0.0", port: int = 8080,
+                 webhook_path: str = WEBHOOK_PATH, secret: Optional[str] = WEBHOOK_SECRET):
+        self.bot = bot
+        self.dp = dp
+        self.host = host
+        self.port = port
+        self.secret = secret
+        self.ready = False
+        self.dedup = UpdateDeduplicator()
+
+        self._tasks: Set[asyncio.Task] = set()
+        self._runner: Optional[web.AppRunner] = None
+
+        self.app = web.Application()
+        self.app.router.add_get("/healthz", self.health)
+        self.app.router.add_get("/readyz", self.readiness)
+        self.app.router.add_get("/metrics", self.metrics)
+        if dp is not None:
+            self.app.router.add_post(webhook_path, self.webhook)
+
+    async def start(self) -> None:
+        self._runner = web.AppRunner(self.app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        logger.info(f"HTTP server listening on {self.host}:{self.port}")
+
+    async def stop(self, timeout: float = 10) -> None:
+        self.ready = False
+        # Даём уже принятым обновлениям доработать
+        if self._tasks:
+            await asyncio.wait(set(self._tasks), timeout=timeout)
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def health(self, request: web.Request) -> web.Response:
+        return web.json_response({"status": "ok"})
+
+    async def readiness(self, request: web.Request) -> web.Response:
+        if not self.ready:
+            return web.json_response({"status": "starting"}, status=503)
+        return web.json_response({"status": "ready", "in_flight": len(self._tasks)})
+
+    async def metrics(self, request: web.Request) -> web.Response:
+        return web.json_response(metrics.snapshot())
+
+    async def webhook(self, request: web.Request) -> web.Response:
+        received = time.perf_counter()
+
+        if self.secret:
+            provided = request.headers.get(SECRET_HEADER, "")
+            if not hmac.compare_digest(provided, self.secret):
+                metrics.inc("webhook.forbidden")
+                return web.json_response({"ok": False, "error": "forbidden"}, status=403)
+
+        if not self.ready:
+            # MAX повторит доставку позже
+            return web.json_response({"ok": False, "error": "not ready"}, status=503)
+
+        try:
+            update = await request.json()
+        except Exception:
+            metrics.inc("webhook.invalid")
+            return web.json_response({"ok": False, "error": "invalid json"}, status=400)
+
+        error = validate_update(update)
+        if error is None:
+            try:
+                event_object = UPDATE_MODEL_MAPPING[update["update_type"]](**update)
+            except Exception as e:
+                error = f"invalid update: {e}"
+        if error:
+            metrics.inc("webhook.invalid")
+            logger.warning(f"Rejected webhook update: {error}")
+            return web.json_response({"ok": False, "error": error}, status=400)
+
+        if self.dedup.seen(update_key(update)):
+            metrics.inc("webhook.duplicates")
+            return web.json_response({"ok": True, "duplicate": True})
+
+        # Отвечаем сразу, обработка идёт в фоне - MAX не ждёт работы хендлеров
+        task = asyncio.create_task(self._dispatch(event_object))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+        metrics.inc("webhook.accepted")
+        metrics.observe("webhook.accept", time.perf_counter() - received)
+        return web.json_response({"ok": True})
+
+    async def _dispatch(self, event_object) -> None:
+        try:
+            event_object = await enrich_event(event_object=event_object, bot=self.bot)
+            await self.dp.handle(event_object)
+        except Exception:
+            logger.exception("Webhook update processing failed")
+
+
+async def serve_webhook(dp, bot, server: UpdateServer) -> None:
+    """Режим webhook: подготовить диспетчер, оформить подписку и принимать обновления до отмены."""
+    await prepare_dispatcher(dp, bot)
+
+    if WEBHOOK_URL:
+        try:
+            await bot.subscribe_webhook(url=WEBHOOK_URL, secret=WEBHOOK_SECRET)
+            logger.info(f"Subscribed webhook: {WEBHOOK_URL}")
+        except Exception:
+            logger.exception("Failed to subscribe webhook")
+
+    server.ready = True
+    await asyncio.Event().wait()
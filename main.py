@@ -2,13 +2,22 @@ import asyncio
 import logging
 import time
 from core.middleware import ignore_old_events
-from core.config import BOT_TOKEN, DB_URL
+from core.config import (
+    BOT_TOKEN, DB_URL, UPDATES_MODE, HTTP_SERVER_ENABLED, HTTP_HOST, HTTP_PORT, MESSAGE_REGISTRY_PERSIST,
+    CHAT_HISTORY_PERSIST,
+)
 from maxapi import Bot, Dispatcher
 from tortoise import Tortoise
 
 from core import utils
+from core.achievements import run_title_pool_refiller
+from core.chat_history import chat_history
 from core.handlers import register_handlers
+from core.http import http_client
+from core.jobs import job_queue
+from core.message_utils import load_message_registry, run_message_registry_flusher
 from core.scheduler import start_scheduler
+from core.webhook import UpdateServer, instrument_dispatcher, serve_webhook
 
 # Минимальное логирование - только ошибки и важная информация
 logging.basicConfig(
@@ -45,16 +54,45 @@ async def main():
     
     app_logger.info("✅ База данных инициализирована")
     
+    instrument_dispatcher(dp, UPDATES_MODE)
+    
+    server = None
+    background_tasks = []
     try:
-        # Запускаем scheduler и dispatcher одновременно
+        await http_client.start()
+        if MESSAGE_REGISTRY_PERSIST:
+            loaded = await load_message_registry()
+            background_tasks.append(asyncio.create_task(run_message_registry_flusher()))
+            app_logger.info(f"✉️ Реестр сообщений загружен: {loaded}")
+        if CHAT_HISTORY_PERSIST:
+            background_tasks.append(asyncio.create_task(chat_history.run_flusher()))
+        background_tasks.append(asyncio.create_task(run_title_pool_refiller()))
+        await job_queue.start(bot)
+        
+        if HTTP_SERVER_ENABLED:
+            server = UpdateServer(
+                bot=bot,
+                dp=dp if UPDATES_MODE == "webhook" else None,
+                host=HTTP_HOST,
+                port=HTTP_PORT,
+            )
+            await server.start()
+            app_logger.info(f"🌐 HTTP-сервер запущен на {HTTP_HOST}:{HTTP_PORT}")
+        
+        # Запускаем scheduler и приём обновлений одновременно
         scheduler_task = asyncio.create_task(start_scheduler(bot, interval=30))
-        polling_task = asyncio.create_task(dp.start_polling(bot))
+        if UPDATES_MODE == "webhook":
+            updates_task = asyncio.create_task(serve_webhook(dp, bot, server))
+        else:
+            updates_task = asyncio.create_task(dp.start_polling(bot))
+            if server:
+                server.ready = True
         
-        app_logger.info("🚀 Бот запущен и готов к работе")
+        app_logger.info(f"🚀 Бот запущен и готов к работе (режим: {UPDATES_MODE})")
         
         # Если один из них упадёт, отменяем оба
         done, pending = await asyncio.wait(
-            [scheduler_task, polling_task],
+            [scheduler_task, updates_task],
             return_when=asyncio.FIRST_EXCEPTION
         )
         
@@ -70,6 +108,14 @@ async def main():
     except Exception as e:
         app_logger.error(f"💥 Ошибка запуска: {e}")
     finally:
+        if server:
+            await server.stop()
+        await job_queue.stop()
+        await http_client.close()
+        for task in background_tasks:
+            task.cancel()
+        if background_tasks:
+            await asyncio.gather(*background_tasks, return_exceptions=True)
         await Tortoise.close_connections()
         app_logger.info("🔌 Соединения с БД закрыты")
 
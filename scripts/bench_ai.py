@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+"""
+Нагрузочный прогон AI-путей бота против локальной заглушки (scripts/fake_llm.py).
+
+Параллельно вызывает get_response, decompose_with_ai, generate_motivation_message,
+generate_ai_insights и extract_search_keywords и печатает по каждому пути
+пропускную способность, перцентили задержки и долю запасных ответов, а также
+счётчики AI-шлюза (отказы, переключения моделей, хеджи, пропущенные сроки).
+
+По умолчанию заглушка поднимается в этом же процессе:
+    python scripts/bench_ai.py --requests 200 --concurrency 20 --latency lognormal:0.8,0.6 --rate-limit 0.02
+
+Против уже запущенной заглушки (или другого OpenAI-совместимого сервера):
+    python scripts/bench_ai.py --api-base http://localhost:8090/v1
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+PATHS = ["chat", "decompose", "motivation", "insights", "keywords"]
+ROUTED_SITES = ["default", "chat", "decompose", "achievement_title", "motivation", "book_keywords", "report_insights"]
+
+
+def configure_env(args, api_base: str) -> None:
+    """Настройки читаются core.config при импорте - выставляем их до импорта модулей бота."""
+    os.environ["AI_TOKEN"] = "fake"
+    os.environ["AI_API_BASE"] = api_base
+    os.environ["AI_ROUTES"] = json.dumps({
+        site: {"model": f"openai/{args.model}", "fallbacks": [f"openai/{args.fallback_model}"] if args.fallback_model else []}
+        for site in ROUTED_SITES
+    })
+    os.environ["AI_MAX_IN_FLIGHT"] = str(args.in_flight)
+    os.environ["AI_RPM"] = str(args.rpm)
+    os.environ["AI_HEDGE_ENABLED"] = "1" if args.hedge else "0"
+    os.environ.setdefault("CHAT_HISTORY_PERSIST", "0")
+
+
+async def start_fake(args) -> tuple:
+    from aiohttp import web
+    from scripts.fake_llm import make_app
+
+    app = make_app(args.latency, args.rate_limit, args.hang, args.error, hang_seconds=args.hang_seconds)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", args.fake_port)
+    await site.start()
+    return runner, app["fake_llm"]
+
+
+async def prepare_db(chats: int) -> None:
+    from tortoise import Tortoise
+    from core.models import Task
+
+    await Tortoise.init(db_url="sqlite://:memory:", modules={"models": ["core.models"]})
+    await Tortoise.generate_schemas()
+    await Task.bulk_create([
+        Task(chat_id=str(chat), user_id=str(chat), text=f"Задача {i} чата {chat}", status="pending")
+        for chat in range(chats) for i in range(3)
+    ])
+
+
+def make_calls(i: int):
+    """Вызов пути i-го запроса и проверка, что ответ - запасной."""
+    from core.ai_core import decompose_with_ai, get_response
+    from core.books import book_search_service
+    from core.motivation import MotivationStyle, generate_motivation_message, get_fallback_message
+    from core.reports import quarterly_report_service
+
+    path = PATHS[i % len(PATHS)]
+    # Уникальные промпты, чтобы не мерить кэш ответов
+    if path == "chat":
+        return path, get_response(100000 + i, f"Как мне успеть всё сегодня? #{i}"), lambda r: r.startswith("Извини")
+    if path == "decompose":
+        return path, decompose_with_ai(i, f"Подготовить презентацию для клиента #{i}", 5), lambda r: not r
+    if path == "motivation":
+        chat = str(i % 50)
+        style = random.choice(list(MotivationStyle))
+        return path, generate_motivation_message(chat, style), lambda r: r == get_fallback_message(3, style)
+    if path == "insights":
+        stats = {
+            "quarter_name": "III квартал", "year": 2025, "total_created": 40 + i, "total_completed": 25,
+            "total_expired": 5, "completion_rate": 62.5, "categories": {"Работа": 20, "Дом": 10 + i},
+        }
+        return path, quarterly_report_service.generate_ai_insights(stats), \
+            lambda r: r == quarterly_report_service._get_fallback_insights(stats)
+    request = f"Посоветуйте лёгкую фантастику на вечер #{i}"
+    return path, book_search_service.extract_search_keywords(request), \
+        lambda r: r == book_search_service._extract_keywords_fallback(request)
+
+
+async def run(args) -> None:
+    runner = fake = None
+    api_base = args.api_base or f"http://127.0.0.1:{args.fake_port}/v1"
+    configure_env(args, api_base)
+    if not args.api_base:
+        runner, fake = await start_fake(args)
+    await prepare_db(50)
+
+    from core import metrics
+    from core.metrics import percentile
+
+    latencies = {path: [] for path in PATHS}
+    fallbacks = {path: 0 for path in PATHS}
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def one(i: int):
+        path, call, is_fallback = make_calls(i)
+        async with semaphore:
+            started = time.perf_counter()
+            result = await call
+            latencies[path].append(time.perf_counter() - started)
+            if is_fallback(result):
+                fallbacks[path] += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(args.requests)))
+    elapsed = time.perf_counter() - started
+
+    print(f"{args.requests} вызовов за {elapsed:.2f} с ({args.requests / elapsed:.1f} вызовов/с), "
+          f"параллельно {args.concurrency}, AI_MAX_IN_FLIGHT={args.in_flight}")
+    print(f"{'путь':<12}{'n':>6}{'p50, с':>9}{'p90, с':>9}{'p99, с':>9}{'запасные':>10}")
+    for path in PATHS:
+        values = latencies[path]
+        if not values:
+            continue
+        p = [percentile(values, q) for q in (50, 90, 99)]
+        print(f"{path:<12}{len(values):>6}{p[0]:>9.3f}{p[1]:>9.3f}{p[2]:>9.3f}{fallbacks[path] / len(values):>10.1%}")
+
+    counters = metrics.snapshot()["counters"]
+    interesting = {k: v for k, v in sorted(counters.items())
+                   if k.startswith(("ai.rejected", "ai.fallback", "ai.hedge", "ai.deadline", "ai.failures",
+                                    "ai.rate_limited", "ai.breaker"))}
+    print("Счётчики шлюза:", json.dumps(interesting, ensure_ascii=False))
+    if fake is not None:
+        print("Заглушка:", json.dumps(fake.stats))
+
+    from tortoise import Tortoise
+    await Tortoise.close_connections()
+    if runner is not None:
+        await runner.cleanup()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--api-base", default="", help="адрес запущенной заглушки; пусто - поднять в процессе")
+    parser.add_argument("--fake-port", type=int, default=8090)
+    parser.add_argument("--model", default="fake")
+    parser.add_argument("--fallback-model", default="", help="запасная модель маршрутов")
+    parser.add_argument("--in-flight", type=int, default=4, help="AI_MAX_IN_FLIGHT")
+    parser.add_argument("--rpm", type=float, default=6000, help="AI_RPM")
+    parser.add_argument("--hedge", action="store_true", help="включить хеджирование запросов")
+    parser.add_argument("--latency", default="lognormal:0.5,0.5", help="распределение задержки заглушки")
+    parser.add_argument("--rate-limit", type=float, default=0.0)
+    parser.add_argument("--error", type=float, default=0.0)
+    parser.add_argument("--hang", type=float, default=0.0)
+    parser.add_argument("--hang-seconds", type=float, default=60.0)
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Замер категоризации задач квартального отчёта (core/reports.py).
+
+Сравнивает прежний поиск подстрок по всем ключевым словам категорий с регулярными
+выражениями, собранными при импорте, на синтетических текстах задач и проверяет,
+что категории совпадают.
+
+Запуск:
+    python scripts/bench_categorize.py --count 1000000
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from collections import Counter
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+from core.reports import CATEGORY_KEYWORDS, categorize_text  # noqa: E402
+
+LEGACY_DETAILS = []
+
+FILLER = ["сделать", "до", "пятницы", "не", "забыть", "срочно", "вечером", "завтра", "позвонить", "маме",
+          "проверить", "купить", "новый", "старый", "важно", "после", "обеда", "утром", "вместе", "с"]
+
+
+def legacy_categorize(text: str) -> str:
+    """
+    Прежний алгоритм: перебор всех ключевых слов категорий подстрокой и строка
+    с деталями для лога на каждую задачу (сам вывод в лог не замеряется).
+    """
+    task_text = text.lower()
+    for category, keywords in CATEGORY_KEYWORDS.items():
+        matched_keywords = [kw for kw in keywords if kw in task_text]
+        if matched_keywords:
+            LEGACY_DETAILS.append(f"'{text[:30]}...' → {category} (ключевые слова: {matched_keywords[:3]})")
+            return category
+    LEGACY_DETAILS.append(f"'{text[:30]}...' → Прочее (не найдено ключевых слов)")
+    return "Прочее"
+
+
+def make_texts(count: int, seed: int) -> list:
+    """Тексты из 3-8 слов; примерно в трети нет ни одного ключевого слова."""
+    rng = random.Random(seed)
+    keywords = [kw for words in CATEGORY_KEYWORDS.values() for kw in words]
+    texts = []
+    for _ in range(count):
+        words = rng.choices(FILLER, k=rng.randint(3, 8))
+        if rng.random() < 0.67:
+            words.insert(rng.randrange(len(words) + 1), rng.choice(keywords).capitalize())
+        texts.append(" ".join(words))
+    return texts
+
+
+def measure(fn, texts: list) -> tuple:
+    started = time.perf_counter()
+    result = Counter(fn(text) for text in texts)
+    return time.perf_counter() - started, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--count", type=int, default=1_000_000, help="сколько текстов задач")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    texts = make_texts(args.count, args.seed)
+    legacy_time, legacy = measure(legacy_categorize, texts)
+    LEGACY_DETAILS.clear()
+    compiled_time, compiled = measure(categorize_text, texts)
+
+    print(f"{args.count} текстов задач")
+    print(f"{'вариант':<22}{'время, с':>10}{'текстов/с':>14}")
+    print(f"{'прежний перебор':<22}{legacy_time:>10.2f}{args.count / legacy_time:>14.0f}")
+    print(f"{'регулярные выражения':<22}{compiled_time:>10.2f}{args.count / compiled_time:>14.0f}")
+    print(f"Ускорение: {legacy_time / compiled_time:.1f}x")
+    print("Категории совпадают" if legacy == compiled else f"Категории расходятся: {legacy} != {compiled}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+"""
+Локальная заглушка OpenAI-совместимого API для проверки AI-путей бота без Gemini.
+
+Отвечает на POST /v1/chat/completions (обычный и stream=True) заготовленными
+ответами по типу промпта: разбиение задачи, ключевые слова книг, название
+достижения, анализ отчёта или просто реплика. Задержка, 429 и зависания задаются
+параметрами, счётчики запросов - на GET /stats.
+
+Запуск:
+    python scripts/fake_llm.py --port 8090 --latency lognormal:0.8,0.6 --rate-limit 0.02 --hang 0.01
+
+Бот направляется на заглушку через маршруты AI и AI_API_BASE:
+    AI_API_BASE=http://localhost:8090/v1 AI_TOKEN=fake \\
+    AI_ROUTES='{"default": {"model": "openai/fake", "fallbacks": []}, ...}'
+(scripts/bench_ai.py делает это сам).
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+import uuid
+
+from aiohttp import web
+
+# Ответы по ключевым фразам промпта: первая совпавшая фраза выбирает ответ
+SCRIPTED_RESPONSES = [
+    ("ЗАДАЧИ:\n[1]", None),  # пакетное разбиение - собирается по списку задач
+    ("декомпозиц", "Составить список дел\nРаспределить дела по дням\nВыполнить первый шаг\nПроверить результат\nПодвести итоги"),
+    ("в формате JSON", '{"keywords": "мотивация бизнес", "genre": "бизнес", "author": "", "mood": "мотивирующая", "topic": "бизнес", "language": "ru"}'),
+    ("названи", "Повелитель дедлайнов, 🏆"),
+    ("Проанализируй результаты", "Отличный квартал: больше половины задач выполнено. Сильная сторона - регулярность. Попробуйте планировать крупные задачи заранее."),
+    ("невыполненных задач", "Ты справишься! Начни с самой маленькой задачи - и остальные пойдут легче."),
+]
+DEFAULT_RESPONSE = "Привет! Я Кузя, готов помочь с задачами."
+
+
+def parse_latency(spec: str):
+    """Распределение задержки: fixed:S, uniform:A,B, lognormal:MEDIAN,SIGMA."""
+    kind, _, params = spec.partition(":")
+    values = [float(v) for v in params.split(",") if v]
+    if kind == "fixed":
+        return lambda: values[0]
+    if kind == "uniform":
+        return lambda: random.uniform(values[0], values[1])
+    if kind == "lognormal":
+        import math
+        median, sigma = values
+        return lambda: random.lognormvariate(math.log(median), sigma)
+    raise ValueError(f"Неизвестное распределение задержки: {spec}")
+
+
+def pick_response(messages: list) -> str:
+    prompt = "\n".join(str(m.get("content") or "") for m in messages)
+    for marker, response in SCRIPTED_RESPONSES:
+        if marker in prompt:
+            if response is None:
+                count = prompt.split("ЗАДАЧИ:", 1)[1].count("\n[") + 1
+                return "\n".join(f"[{i}]\nПодготовиться\nСделать основную часть\nПроверить результат"
+                                 for i in range(1, count + 1))
+            return response
+    return DEFAULT_RESPONSE
+
+
+class FakeLLM:
+    def __init__(self, latency, rate_limit: float, hang: float, error: float, hang_seconds: float):
+        self.latency = latency
+        self.rate_limit = rate_limit
+        self.hang = hang
+        self.error = error
+        self.hang_seconds = hang_seconds
+        self.stats = {"requests": 0, "streams": 0, "rate_limited": 0, "hung": 0, "errors": 0}
+
+    def _completion_body(self, model: str, content: str) -> dict:
+        tokens = max(1, len(content) // 3)
+        return {
+            "id": f"chatcmpl-{uuid.uuid4().hex[:12]}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": 50, "completion_tokens": tokens, "total_tokens": 50 + tokens},
+        }
+
+    async def chat_completions(self, request: web.Request) -> web.StreamResponse:
+        body = await request.json()
+        self.stats["requests"] += 1
+        roll = random.random()
+        if roll < self.rate_limit:
+            self.stats["rate_limited"] += 1
+            return web.json_response(
+                {"error": {"message": "Rate limit exceeded", "type": "rate_limit_error", "code": "rate_limit_exceeded"}},
+                status=429,
+            )
+        roll -= self.rate_limit
+        if roll < self.error:
+            self.stats["errors"] += 1
+            return web.json_response({"error": {"message": "Upstream failure", "type": "server_error"}}, status=503)
+        roll -= self.error
+        if roll < self.hang:
+            # Клиент должен отвалиться по своему таймауту
+            self.stats["hung"] += 1
+            await asyncio.sleep(self.hang_seconds)
+
+        model = body.get("model", "fake")
+        content = pick_response(body.get("messages") or [])
+        delay = self.latency()
+
+        if not body.get("stream"):
+            await asyncio.sleep(delay)
+            return web.json_response(self._completion_body(model, content))
+
+        # Поток: первый токен через половину задержки, остальное равномерно
+        self.stats["streams"] += 1
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream", "Cache-Control": "no-cache"})
+        await response.prepare(request)
+        await asyncio.sleep(delay / 2)
+        words = content.split(" ")
+        step = delay / 2 / max(1, len(words))
+        chunk_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+        for i, word in enumerate(words):
+            chunk = {
+                "id": chunk_id,
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{"index": 0, "delta": {"content": word if i == 0 else " " + word}, "finish_reason": None}],
+            }
+            await response.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+            await asyncio.sleep(step)
+        done = {"id": chunk_id, "object": "chat.completion.chunk", "created": int(time.time()), "model": model,
+                "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]}
+        await response.write(f"data: {json.dumps(done)}\n\ndata: [DONE]\n\n".encode("utf-8"))
+        await response.write_eof()
+        return response
+
+    async def get_stats(self, request: web.Request) -> web.Response:
+        return web.json_response(self.stats)
+
+
+def make_app(latency: str = "fixed:0.2", rate_limit: float = 0.0, hang: float = 0.0, error: float = 0.0,
+             hang_seconds: float = 120.0) -> web.Application:
+    fake = FakeLLM(parse_latency(latency), rate_limit, hang, error, hang_seconds)
+    app = web.Application()
+    app["fake_llm"] = fake
+    for prefix in ("", "/v1"):
+        app.router.add_post(f"{prefix}/chat/completions", fake.chat_completions)
+    app.router.add_get("/stats", fake.get_stats)
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--latency", default="fixed:0.2", help="fixed:S | uniform:A,B | lognormal:MEDIAN,SIGMA")
+    parser.add_argument("--rate-limit", type=float, default=0.0, help="доля ответов 429")
+    parser.add_argument("--error", type=float, default=0.0, help="доля ответов 503")
+    parser.add_argument("--hang", type=float, default=0.0, help="доля зависающих запросов")
+    parser.add_argument("--hang-seconds", type=float, default=120.0)
+    args = parser.parse_args()
+
+    web.run_app(
+        make_app(args.latency, args.rate_limit, args.hang, args.error, args.hang_seconds),
+        host=args.host, port=args.port,
+    )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+"""
+Импорт выгрузки книг в локальный каталог (индекс SQLite FTS5 для core/catalog.py).
+
+Файл читается потоково, пачками, так что дамп на миллионы записей не загружается в память.
+Поддерживаемые форматы (можно сжатые .gz):
+    jsonl - одна книга в строке: title, authors, genre, subjects, language, description,
+            published_date, page_count, rating, isbn, link (понимаются и поля OpenLibrary:
+            author_name, subject, first_publish_year, isbn_13, key ...)
+    csv   - те же поля в заголовке, списки через ";"
+    ol    - дамп OpenLibrary (ol_dump_works/editions: TSV, JSON в последней колонке)
+
+Запуск:
+    python scripts/import_catalog.py books.jsonl.gz --output data/catalog.sqlite3
+    python scripts/import_catalog.py ol_dump_editions.txt.gz --format ol --language ru --replace
+Затем в .env: BOOK_CATALOG_PATH=data/catalog.sqlite3
+"""
+import argparse
+import csv
+import gzip
+import io
+import json
+import os
+import sqlite3
+import sys
+import time
+from typing import Dict, Iterator, List, Optional
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+from core.catalog import INDEXED_FIELDS, LIST_SEPARATOR, SCHEMA, STORED_FIELDS  # noqa: E402
+
+COLUMNS = INDEXED_FIELDS + STORED_FIELDS
+# Коды языков OpenLibrary (MARC) -> двухбуквенные, как у Google Books
+LANGUAGE_CODES = {"rus": "ru", "eng": "en", "ukr": "uk", "bel": "be", "ger": "de", "fre": "fr", "spa": "es"}
+
+
+def open_text(path: str) -> io.TextIOBase:
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", encoding="utf-8", newline="")
+    return open(path, "r", encoding="utf-8", newline="")
+
+
+def detect_format(path: str) -> str:
+    name = path[:-3] if path.endswith(".gz") else path
+    if name.endswith(".csv"):
+        return "csv"
+    if "ol_dump" in os.path.basename(name) or name.endswith(".txt"):
+        return "ol"
+    return "jsonl"
+
+
+def read_records(path: str, fmt: str) -> Iterator[Dict]:
+    with open_text(path) as f:
+        if fmt == "csv":
+            yield from csv.DictReader(f)
+            return
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line.rsplit("\t", 1)[-1] if fmt == "ol" else line)
+            except json.JSONDecodeError:
+                continue
+
+
+def _as_list(value) -> List[str]:
+    """Список строк из списка, строки через ";" или ссылок OpenLibrary вида {"name": ...}."""
+    if value is None:
+        return []
+    if isinstance(value, str):
+        return [part.strip() for part in value.split(";") if part.strip()]
+    items = []
+    for item in value if isinstance(value, list) else [value]:
+        if isinstance(item, dict):
+            item = item.get("name") or item.get("key", "").rsplit("/", 1)[-1]
+        if item:
+            items.append(str(item).strip())
+    return items
+
+
+def _text(value) -> str:
+    if isinstance(value, dict):  # описания OpenLibrary: {"type": "/type/text", "value": ...}
+        value = value.get("value")
+    return str(value).strip() if value not in (None, "") else ""
+
+
+def _language(record: Dict) -> str:
+    values = _as_list(record.get("language") or record.get("languages"))
+    code = values[0].lower() if values else ""
+    return LANGUAGE_CODES.get(code, code)
+
+
+def normalize_record(record: Dict) -> Optional[tuple]:
+    """Строка индекса из записи выгрузки; None, если у записи нет названия."""
+    title = _text(record.get("title"))
+    if not title:
+        return None
+    if record.get("subtitle"):
+        title = f"{title}: {_text(record['subtitle'])}"
+    rating = record.get("rating", record.get("ratings_average"))
+    try:
+        rating = round(float(rating), 1) if rating not in (None, "") else None
+    except (TypeError, ValueError):
+        rating = None
+    isbn = _as_list(record.get("isbn")) + _as_list(record.get("isbn_13")) + _as_list(record.get("isbn_10"))
+    link = _text(record.get("link") or record.get("url"))
+    if not link and str(record.get("key", "")).startswith("/"):
+        link = f"https://openlibrary.org{record['key']}"
+    row = {
+        "title": title,
+        "authors": LIST_SEPARATOR.join(_as_list(record.get("authors") or record.get("author_name"))),
+        "genre": LIST_SEPARATOR.join(_as_list(record.get("genre") or record.get("genres"))),
+        "subjects": LIST_SEPARATOR.join(_as_list(record.get("subjects") or record.get("subject"))[:20]),
+        "description": _text(record.get("description"))[:2000],
+        "language": _language(record),
+        "published_date": _text(record.get("published_date") or record.get("first_publish_year")
+                                or record.get("publish_date")),
+        "page_count": _text(record.get("page_count") or record.get("number_of_pages")
+                            or record.get("number_of_pages_median")),
+        "rating": rating,
+        "isbn": " ".join(dict.fromkeys(i.replace("-", "") for i in isbn)),
+        "link": link,
+    }
+    return tuple(row[column] for column in COLUMNS)
+
+
+def import_catalog(path: str, output: str, fmt: str, language: str = "", replace: bool = False,
+                   batch_size: int = 5000) -> int:
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    connection = sqlite3.connect(output)
+    if replace:
+        connection.execute("DROP TABLE IF EXISTS books")
+    connection.execute(SCHEMA)
+    insert = f"INSERT INTO books ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))})"
+
+    imported = 0
+    batch = []
+    started = time.perf_counter()
+    for record in read_records(path, fmt):
+        row = normalize_record(record)
+        if row is None or (language and row[COLUMNS.index("language")] != language):
+            continue
+        batch.append(row)
+        if len(batch) >= batch_size:
+            with connection:
+                connection.executemany(insert, batch)
+            imported += len(batch)
+            batch.clear()
+            print(f"\r{imported} книг ({imported / (time.perf_counter() - started):.0f}/с)", end="", flush=True)
+    with connection:
+        connection.executemany(insert, batch)
+    imported += len(batch)
+
+    # Слить сегменты индекса в один - быстрее поиск
+    with connection:
+        connection.execute("INSERT INTO books(books) VALUES ('optimize')")
+    connection.close()
+    print(f"\rИмпортировано {imported} книг в {output} за {time.perf_counter() - started:.1f} с")
+    return imported
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("path", help="файл выгрузки (.jsonl, .csv, дамп OpenLibrary; можно .gz)")
+    parser.add_argument("--output", default="data/catalog.sqlite3", help="файл индекса")
+    parser.add_argument("--format", choices=["auto", "jsonl", "csv", "ol"], default="auto")
+    parser.add_argument("--language", default="", help="импортировать только книги на этом языке (ru, en ...)")
+    parser.add_argument("--replace", action="store_true", help="пересоздать индекс вместо дополнения")
+    parser.add_argument("--batch-size", type=int, default=5000)
+    args = parser.parse_args()
+
+    fmt = detect_format(args.path) if args.format == "auto" else args.format
+    import_catalog(args.path, args.output, fmt, args.language, args.replace, args.batch_size)
+
+
+if __name__ == '__main__':
+    main()
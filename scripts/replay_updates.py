@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+Воспроизведение записанных обновлений через вебхук бота.
+
+Запись: запустите бота с UPDATES_RECORD_PATH=updates.jsonl (в любом режиме) -
+каждое входящее обновление будет дописано в файл.
+
+Воспроизведение: бот в режиме UPDATES_MODE=webhook, затем
+    python scripts/replay_updates.py updates.jsonl --url http://localhost:8080/webhook
+
+Сравнение с polling: бот пишет задержку доставки в метрики updates.lag.polling и
+updates.lag.webhook (от timestamp обновления в MAX до начала обработки). Снимите
+/metrics с бота в каждом режиме при живом трафике и сравните:
+    python scripts/replay_updates.py --metrics-only --metrics-url http://localhost:8080/metrics
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+import aiohttp
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+from core.metrics import percentile
+from core.webhook import SECRET_HEADER
+
+
+def load_updates(path: str, fresh: bool, salt: str) -> list:
+    updates = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            update = json.loads(line)
+            now_ms = int(time.time() * 1000)
+            if fresh:
+                # Старые события бот игнорирует после старта (IGNORE_HISTORY_ON_START)
+                update["timestamp"] = now_ms
+                if isinstance(update.get("message"), dict):
+                    update["message"]["timestamp"] = now_ms
+            if salt:
+                # Новые ключи идемпотентности, чтобы повторный прогон не отбросился как дубль
+                callback = update.get("callback")
+                if isinstance(callback, dict) and callback.get("callback_id"):
+                    callback["callback_id"] = f"{callback['callback_id']}-{salt}"
+                body = (update.get("message") or {}).get("body")
+                if isinstance(body, dict) and body.get("mid"):
+                    body["mid"] = f"{body['mid']}-{salt}"
+            updates.append(update)
+    return updates
+
+
+async def post_all(url: str, updates: list, concurrency: int, secret: str) -> tuple:
+    latencies, statuses = [], {}
+    semaphore = asyncio.Semaphore(concurrency)
+    headers = {SECRET_HEADER: secret} if secret else {}
+
+    async with aiohttp.ClientSession(headers=headers) as session:
+        async def post(update):
+            async with semaphore:
+                started = time.perf_counter()
+                async with session.post(url, json=update) as response:
+                    await response.read()
+                    latencies.append(time.perf_counter() - started)
+                    statuses[response.status] = statuses.get(response.status, 0) + 1
+
+        await asyncio.gather(*(post(u) for u in updates))
+    return latencies, statuses
+
+
+async def print_lag_metrics(metrics_url: str):
+    async with aiohttp.ClientSession() as session:
+        async with session.get(metrics_url) as response:
+            snapshot = await response.json()
+
+    print(f"\nМетрики {metrics_url}:")
+    for name, stats in sorted(snapshot.get("latency", {}).items()):
+        if name.startswith("updates.") or name.startswith("webhook."):
+            print(f"  {name}: n={stats['count']} p50={stats['p50']} p90={stats['p90']} p99={stats['p99']}")
+    for name, value in sorted(snapshot.get("counters", {}).items()):
+        if name.startswith("updates.") or name.startswith("webhook."):
+            print(f"  {name} = {value}")
+
+
+async def run(args):
+    if not args.metrics_only:
+        updates = load_updates(args.path, fresh=not args.keep_timestamps, salt=args.salt)
+        started = time.perf_counter()
+        latencies, statuses = await post_all(args.url, updates, args.concurrency, args.secret)
+        elapsed = time.perf_counter() - started
+
+        print(f"Отправлено {len(updates)} обновлений за {elapsed:.2f} с ({len(updates) / elapsed:.1f} upd/s)")
+        print(f"HTTP статусы: {statuses}")
+        for q in (50, 90, 99):
+            value = percentile(latencies, q)
+            print(f"  p{q} ответа вебхука: {value * 1000:.1f} мс" if value is not None else f"  p{q}: -")
+
+    if args.metrics_url:
+        await print_lag_metrics(args.metrics_url)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("path", nargs="?", help="JSONL с записанными обновлениями")
+    parser.add_argument("--url", default="http://localhost:8080/webhook")
+    parser.add_argument("--secret", default=os.getenv("WEBHOOK_SECRET", ""))
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--keep-timestamps", action="store_true", help="не подменять timestamp на текущее время")
+    parser.add_argument("--salt", default="", help="суффикс к mid/callback_id для повторного прогона")
+    parser.add_argument("--metrics-url", default=None)
+    parser.add_argument("--metrics-only", action="store_true")
+    args = parser.parse_args()
+
+    if not args.metrics_only and not args.path:
+        parser.error("укажите файл с обновлениями или --metrics-only")
+
+    asyncio.run(run(args))
+
+
+if __name__ == '__main__':
+    main()